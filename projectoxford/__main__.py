@@ -0,0 +1,323 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Bulk Jobs
+
+Runs the speech, emotion and LUIS clients over every item in a manifest
+and writes one JSON line per item.
+
+    python -m projectoxford synth prompts.txt -o synth.jsonl --wav-dir wavs
+    python -m projectoxford transcribe wavs.txt -o transcripts.jsonl
+    python -m projectoxford emotion images.txt -o faces.jsonl
+    python -m projectoxford luis utterances.txt -o intents.jsonl --url URL
+
+Each line of a manifest is either a plain value (the text, path or URL
+to process) or a JSON object containing the value and optionally an
+``id`` and per-item options such as ``locale``. Items without an ``id``
+are identified by their line number.
+
+When writing to a file, completed items are recorded in a state file
+(by default the output path followed by ``.state``). Running the same
+command again skips completed items and continues the output from the
+last recorded item, so an interrupted job resumes where it stopped.
+An existing output without a state file is only replaced when
+``--force`` is passed.
+'''
+
+import argparse
+import json
+import os
+import sys
+import time
+
+from projectoxford.batch import imap_unordered
+
+__all__ = ['main']
+
+# The manifest field holding each command's input, and the environment
+# variable holding its subscription key
+_FIELDS = {'synth': 'text', 'transcribe': 'path', 'emotion': 'image', 'luis': 'text'}
+_KEY_VARIABLES = {'synth': 'PROJECTOXFORD_SPEECH_KEY', 'transcribe': 'PROJECTOXFORD_SPEECH_KEY',
+                  'emotion': 'PROJECTOXFORD_EMOTION_KEY', 'luis': 'PROJECTOXFORD_LUIS_KEY'}
+
+def _read_manifest(path, field):
+    '''Returns a list of (id, item) tuples, where item is a dict
+    containing at least `field`.
+    '''
+    f = sys.stdin if path == '-' else open(path, 'r', encoding='utf-8-sig')
+    items = []
+    seen = set()
+    try:
+        for lineno, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                item = json.loads(line)
+                if field not in item:
+                    raise ValueError('line {} of {} has no "{}"'.format(lineno, path, field))
+            else:
+                item = {field: line}
+            id = item.pop('id', lineno)
+            if isinstance(id, bool) or not isinstance(id, (str, int)):
+                raise ValueError('line {} of {} has an id that is not a string or integer'.format(lineno, path))
+            if id in seen:
+                raise ValueError('line {} of {} repeats id {!r}'.format(lineno, path, id))
+            seen.add(id)
+            items.append((id, item))
+    finally:
+        if f is not sys.stdin:
+            f.close()
+    return items
+
+class _Checkpoint(object):
+    '''Writes output records and journals each one in a state file.
+
+    Each journal line records an item's id and the length of the output
+    once its record was written. On resume, the output is truncated to
+    the last journalled length, so a record that was partly written
+    when the job stopped is discarded and its item is run again.
+    '''
+
+    def __init__(self, output_path, state_path, command, retry_errors=False, force=False):
+        self.done = set()
+        offset = 0
+        state_size = 0
+        if os.path.exists(output_path) and not os.path.exists(state_path) and not force:
+            raise ValueError('{} exists but {} does not; pass --force to overwrite it'.format(
+                output_path, state_path))
+        if os.path.exists(state_path) and os.path.exists(output_path):
+            with open(state_path, 'rb') as f:
+                lines = f.read().split(b'\n')
+            try:
+                header = json.loads(lines[0].decode('utf-8'))
+            except ValueError:
+                header = {}
+            if header.get('command') != command:
+                raise ValueError('{} was created by a different command'.format(state_path))
+            state_size = len(lines[0]) + 1
+            # The final element is empty unless the last line was only
+            # partly written, in which case it is ignored
+            for line in lines[1:-1]:
+                entry = json.loads(line.decode('utf-8'))
+                if not (entry['error'] and retry_errors):
+                    self.done.add(entry['id'])
+                offset = entry['offset']
+                state_size += len(line) + 1
+
+        if state_size:
+            self.output = open(output_path, 'r+b')
+            self.output.truncate(offset)
+            self.output.seek(offset)
+            self.state = open(state_path, 'r+b')
+            self.state.truncate(state_size)
+            self.state.seek(state_size)
+        else:
+            self.output = open(output_path, 'wb')
+            self.state = open(state_path, 'wb')
+            self._write(self.state, {'version': 1, 'command': command})
+
+    @staticmethod
+    def _write(f, obj):
+        f.write(json.dumps(obj).encode('utf-8') + b'\n')
+        f.flush()
+
+    def write(self, record):
+        self._write(self.output, record)
+        self._write(self.state, {'id': record['id'], 'offset': self.output.tell(),
+                                 'error': record['error'] is not None})
+
+    def close(self):
+        self.output.close()
+        self.state.close()
+
+class _Stream(object):
+    def __init__(self, output):
+        self.done = set()
+        self.output = output
+
+    def write(self, record):
+        self.output.write(json.dumps(record) + '\n')
+        self.output.flush()
+
+    def close(self):
+        pass
+
+class _Progress(object):
+    def __init__(self, total, enabled, interval=0.5):
+        self.total = total
+        self.enabled = enabled
+        self.interval = interval
+        self.completed = 0
+        self.failed = 0
+        self.start = self._last = time.monotonic()
+
+    def update(self, failed):
+        self.completed += 1
+        self.failed += bool(failed)
+        now = time.monotonic()
+        if self.enabled and now - self._last >= self.interval:
+            self._last = now
+            self._print(now)
+
+    def _print(self, now):
+        rate = self.completed / max(now - self.start, 1e-6)
+        print('\r{} of {} done, {} failed, {:.1f} per second'.format(
+            self.completed, self.total, self.failed, rate
+        ), end='', file=sys.stderr, flush=True)
+
+    def finish(self):
+        if self.enabled:
+            self._print(time.monotonic())
+            print(file=sys.stderr)
+
+def _keys(args):
+    keys = args.key or [k for k in os.environ.get(_KEY_VARIABLES[args.command], '').split(',') if k]
+    if not keys and args.command != 'luis':
+        raise ValueError('no subscription key; pass --key or set ' + _KEY_VARIABLES[args.command])
+    return keys
+
+def _make_job(args):
+    '''Returns a function that processes one manifest item and returns
+    the fields to add to its output record.
+    '''
+    if args.command in ('synth', 'transcribe'):
+        from projectoxford.speech import SpeechClient
+        client = SpeechClient(_keys(args), locale=args.locale, gender=args.gender, timeout=args.timeout,
+                              endpoint=args.endpoint, token_endpoint=args.token_endpoint)
+        pool = client.keys
+    elif args.command == 'emotion':
+        from projectoxford.emotion import EmotionClient
+        client = EmotionClient(_keys(args), timeout=args.timeout, endpoint=args.endpoint,
+                               keep_content=False, fetch_content=False, image_cache=False)
+        pool = client.keys
+    else:
+        from projectoxford.luis import LuisClient
+        url = args.url or os.environ.get('PROJECTOXFORD_LUIS_URL')
+        if not url:
+            raise ValueError('no LUIS URL; pass --url or set PROJECTOXFORD_LUIS_URL')
+        client = LuisClient(url, keys=_keys(args), timeout=args.timeout)
+        pool = client.urls
+    # The rate applies to each key in the pool. Rates below one call per
+    # second become a single call per longer window.
+    if args.rate is not None:
+        if args.rate <= 0 or (args.rate >= 1 and args.rate != int(args.rate)):
+            raise ValueError('--rate must be a whole number, or a fraction below 1')
+        if args.rate < 1:
+            pool.quota, pool.period = 1, 1.0 / args.rate
+        else:
+            pool.quota, pool.period = int(args.rate), 1.0
+
+    if args.command == 'synth':
+        os.makedirs(args.wav_dir, exist_ok=True)
+
+        def job(id, item):
+            filename = os.path.join(args.wav_dir, item.get('filename') or '{}.wav'.format(id))
+            wav = client.say_to_wav(item['text'], item.get('locale'), item.get('gender'), filename=filename)
+            return {'filename': filename, 'bytes': len(wav)}
+
+    elif args.command == 'transcribe':
+        def job(id, item):
+            r = client.recognize_raw(item['path'], item.get('locale'), typed=True)
+            best = r.best
+            return {
+                'text': best and best.text,
+                'confidence': best and best.level,
+                'result': r.to_dict(),
+            }
+
+    elif args.command == 'emotion':
+        def job(id, item):
+            image = item['image']
+            if image.lower().startswith(('http://', 'https://')):
+                r = client.process_image_from_url(image)
+            else:
+                r = client.process_image_from_path(image)
+            return {'faces': r.raw_result}
+
+    else:
+        def job(id, item):
+            r = client.query_raw(item['text'], typed=True)
+            return {'intent': r.intent, 'result': r.to_dict()}
+
+    return job
+
+def run(args):
+    '''Runs the bulk job described by the parsed command line `args`
+    and returns the number of items that failed.
+    '''
+    field = _FIELDS[args.command]
+    items = _read_manifest(args.manifest, field)
+    job = _make_job(args)
+
+    if args.output and args.output != '-':
+        state_path = args.state or args.output + '.state'
+        writer = _Checkpoint(args.output, state_path, args.command, args.retry_errors, args.force)
+    else:
+        writer = _Stream(sys.stdout)
+
+    try:
+        todo = [(id, item) for id, item in items if id not in writer.done]
+        progress = _Progress(len(todo), args.progress)
+        call = lambda entry: job(*entry)
+        for r in imap_unordered(call, todo, args.workers):
+            id, item = r.item
+            record = {'id': id, field: item[field]}
+            if r.error is None:
+                record.update(r.result)
+                record['error'] = None
+            else:
+                record['error'] = '{}: {}'.format(type(r.error).__name__, r.error)
+            writer.write(record)
+            progress.update(r.error is not None)
+        progress.finish()
+    finally:
+        writer.close()
+    return progress.failed
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m projectoxford', description=__doc__.partition('\n')[0])
+    commands = parser.add_subparsers(dest='command', metavar='COMMAND')
+    commands.required = True
+    helps = {
+        'synth': 'synthesize each line of text to a wave file',
+        'transcribe': 'recognize speech in each wave file',
+        'emotion': 'recognize emotions in each image path or URL',
+        'luis': 'query LUIS with each line of text',
+    }
+    for name in ('synth', 'transcribe', 'emotion', 'luis'):
+        p = commands.add_parser(name, help=helps[name], description=helps[name])
+        p.add_argument('manifest', help='file listing the items to process, or - for stdin')
+        p.add_argument('--output', '-o', help='JSON Lines file to write results to (default: stdout)')
+        p.add_argument('--state', help='file to record completed items in (default: OUTPUT.state)')
+        p.add_argument('--retry-errors', action='store_true', help='run items that failed previously again')
+        p.add_argument('--force', action='store_true', help='overwrite OUTPUT if it exists without a state file')
+        p.add_argument('--key', action='append', help='subscription key; may be repeated to use several '
+                       '(default: ${})'.format(_KEY_VARIABLES[name]))
+        p.add_argument('--workers', '-j', type=int, default=8, help='number of concurrent calls')
+        p.add_argument('--rate', type=float, help='maximum calls per second for each key')
+        p.add_argument('--timeout', type=float, help='seconds allowed for each item')
+        p.add_argument('--progress', action='store_true', help='report progress on stderr')
+        if name == 'luis':
+            p.add_argument('--url', help='LUIS application URL ending with &q= (default: $PROJECTOXFORD_LUIS_URL)')
+        else:
+            p.add_argument('--endpoint', help='URL of the service')
+        if name in ('synth', 'transcribe'):
+            p.add_argument('--token-endpoint', help='URL used to obtain authorization tokens')
+            p.add_argument('--locale', default='en-US', help='default locale')
+            p.add_argument('--gender', default='Female', help='default voice gender')
+        if name == 'synth':
+            p.add_argument('--wav-dir', default='.', help='directory to write wave files to')
+    args = parser.parse_args(argv)
+
+    try:
+        failed = run(args)
+    except (OSError, ValueError) as ex:
+        parser.exit(2, '{}: error: {}\n'.format(parser.prog, ex))
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
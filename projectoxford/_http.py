@@ -0,0 +1,231 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Internal helpers for issuing HTTP requests with deadlines and
+optional hedging.
+'''
+
+import collections
+import concurrent.futures
+import json
+import os
+import threading
+import time
+
+import requests
+import requests.adapters
+
+from projectoxford import metrics
+
+# Seconds allowed to establish a connection and to wait for each read
+# when the caller has not provided a deadline.
+CONNECT_TIMEOUT = 10.0
+READ_TIMEOUT = 60.0
+
+class Deadline(object):
+    '''Tracks the time remaining for an operation, including every
+    connection, read and retry that it makes.
+
+    Deadline(seconds)
+
+    seconds:
+        The total budget in seconds. If ``None``, the operation has no
+        overall limit and each request uses the default timeouts.
+    '''
+    __slots__ = ('end',)
+
+    def __init__(self, seconds=None):
+        self.end = None if seconds is None else time.monotonic() + seconds
+
+    @classmethod
+    def coerce(cls, deadline):
+        '''Returns `deadline` if it is a `Deadline`, otherwise a new
+        deadline of `deadline` seconds.
+        '''
+        if isinstance(deadline, cls):
+            return deadline
+        return cls(deadline)
+
+    def remaining(self):
+        '''Returns the number of seconds remaining, or ``None`` if
+        there is no limit.
+        '''
+        if self.end is None:
+            return None
+        return self.end - time.monotonic()
+
+    def check(self):
+        '''Raises `requests.Timeout` if the deadline has passed.'''
+        if self.end is not None and time.monotonic() >= self.end:
+            raise requests.Timeout('deadline exceeded')
+
+    def timeout(self):
+        '''Returns a (connect, read) timeout tuple for the next request
+        that will not exceed the remaining budget.
+        '''
+        remaining = self.remaining()
+        if remaining is None:
+            return CONNECT_TIMEOUT, READ_TIMEOUT
+        if remaining <= 0:
+            raise requests.Timeout('deadline exceeded')
+        return min(CONNECT_TIMEOUT, remaining), remaining
+
+def _body_size(kwargs):
+    data = kwargs.get('data')
+    if isinstance(data, (bytes, bytearray, memoryview, str)):
+        return len(data)
+    if hasattr(data, 'read') and hasattr(data, '__len__'):
+        return len(data) - data.tell()
+    if hasattr(data, 'fileno'):
+        try:
+            return os.fstat(data.fileno()).st_size - data.tell()
+        except (OSError, ValueError):
+            return 0
+    if kwargs.get('json') is not None:
+        return len(json.dumps(kwargs['json']))
+    return 0
+
+def new_session(max_connections=32):
+    '''Returns a `requests.Session` that keeps up to `max_connections`
+    connections open to each host for reuse.
+    '''
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_connections)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+def request(method, url, deadline=None, span=metrics.NULL_SPAN, session=None, **kwargs):
+    '''Sends a request using a timeout derived from `deadline`, and
+    records its timing and size in `span`. If `session` is provided,
+    its connections are reused.
+    '''
+    deadline = Deadline.coerce(deadline)
+    send = requests.request if session is None else session.request
+    if not span:
+        return send(method, url, timeout=deadline.timeout(), **kwargs)
+
+    span.count('bytes_sent', _body_size(kwargs))
+    start = time.perf_counter()
+    r = send(method, url, timeout=deadline.timeout(), stream=True, **kwargs)
+    span.add('wait', time.perf_counter() - start)
+    with span.phase('download'):
+        content = r.content
+    span.count('bytes_received', len(content))
+    if r.status_code == 429:
+        span.count('throttled')
+    return r
+
+def acquire(pool, deadline=None):
+    '''Acquires a key from `pool`, waiting no longer than `deadline`.'''
+    remaining = Deadline.coerce(deadline).remaining()
+    try:
+        return pool.acquire(None if remaining is None else max(0, remaining))
+    except RuntimeError:
+        raise requests.Timeout('deadline exceeded')
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ThreadPoolExecutor(max_workers=32)
+        return _executor
+
+class Hedge(object):
+    '''Sends a duplicate of an idempotent call when the first attempt
+    takes longer than most recent calls, and returns whichever attempt
+    completes first.
+
+    Hedge(percentile=0.95, min_samples=20, max_samples=200)
+
+    percentile:
+        The fraction of recent calls that must complete before a
+        duplicate is sent.
+    min_samples:
+        The number of calls to observe before hedging begins.
+    max_samples:
+        The number of recent call durations to retain.
+    '''
+
+    def __init__(self, percentile=0.95, min_samples=20, max_samples=200):
+        if not 0 < percentile < 1:
+            raise ValueError('percentile must be between 0 and 1')
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self._samples = collections.deque(maxlen=max_samples)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def coerce(cls, hedge):
+        '''Returns a `Hedge` for a client's `hedge` argument, which may
+        be ``None``, ``True``, a percentile or a `Hedge` instance.
+        '''
+        if hedge is None or hedge is False:
+            return None
+        if isinstance(hedge, cls):
+            return hedge
+        if hedge is True:
+            return cls()
+        return cls(percentile=hedge)
+
+    def delay(self):
+        '''Returns the number of seconds to wait before sending a
+        duplicate, or ``None`` if too few calls have been observed.
+        '''
+        with self._lock:
+            if len(self._samples) < self.min_samples:
+                return None
+            samples = sorted(self._samples)
+        return samples[min(len(samples) - 1, int(self.percentile * len(samples)))]
+
+    def record(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def call(self, fn, deadline=None):
+        '''Calls `fn`, sending a duplicate call if the first has not
+        completed within `delay` seconds, and returns the first
+        successful result. If every attempt fails, the first error is
+        raised.
+        '''
+        deadline = Deadline.coerce(deadline)
+        delay = self.delay()
+        start = time.monotonic()
+        if delay is None:
+            result = fn()
+            self.record(time.monotonic() - start)
+            return result
+
+        remaining = deadline.remaining()
+        if remaining is not None:
+            delay = min(delay, max(0, remaining))
+        pool = _get_executor()
+        pending = {pool.submit(fn)}
+        done, pending = concurrent.futures.wait(pending, timeout=delay)
+        if not done:
+            pending.add(pool.submit(fn))
+
+        error = None
+        while True:
+            for f in done:
+                if f.exception() is None:
+                    self.record(time.monotonic() - start)
+                    return f.result()
+                if error is None:
+                    error = f.exception()
+            if not pending:
+                raise error
+            remaining = deadline.remaining()
+            done, pending = concurrent.futures.wait(
+                pending,
+                timeout=None if remaining is None else max(0, remaining),
+                return_when=concurrent.futures.FIRST_COMPLETED
+            )
+            if not done:
+                raise requests.Timeout('deadline exceeded')
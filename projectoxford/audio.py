@@ -14,9 +14,9 @@ import array
 import contextlib
 import math
 import sys
-import wave
 
 from io import BytesIO
+from projectoxford import metrics, wavefile
 
 __all__ = ['play', 'record', 'get_quiet_threshold',
            'get_playback_devices', 'get_recording_devices']
@@ -32,7 +32,8 @@ if sys.platform == 'win32':
             wav.getframerate(),
             wav.getsampwidth(),
         )) as pd:
-            pd.play(lambda: wav.readframes(wav.getframerate() // 2))
+            # The device needs each block as bytes while it is playing
+            pd.play(lambda: bytes(wav.readframes(wav.getframerate() // 2)))
     
     def _record(device_id, wav, seconds_per_chunk, on_chunk):
         with contextlib.closing(RecordingDevice(
@@ -59,22 +60,22 @@ else:
 @contextlib.contextmanager
 def _open_wav(wav):
     '''Internal helper function to open an unknown parameter as a
-    wave file.
+    `projectoxford.wavefile.WavReader`.
 
     wav:
-        An open `wave.Wave_read` object, a `bytes` object containing
-        a wave file, or a valid argument to `wave.open`.
+        An open `WavReader`, or any value accepted by
+        `projectoxford.wavefile.open_wav`. Readers that are passed in
+        are not closed.
     '''
-    if isinstance(wav, wave.Wave_read):
+    if isinstance(wav, wavefile.WavReader):
         yield wav
         return
 
-    if isinstance(wav, bytes) and wav[:4] == b'RIFF':
-        w = wave.open(BytesIO(wav), 'rb')
-    else:
-        w = wave.open(wav, 'rb')
-    yield w
-    w.close()
+    w = wavefile.open_wav(wav)
+    try:
+        yield w
+    finally:
+        w.close()
 
 def get_playback_devices():
     '''Returns a list of available playback devices.
@@ -101,16 +102,26 @@ def play(wav, device_id=None):
     The function will block until playback is complete.
 
     wav:
-        An open `wave.Wave_read` object, a `bytes` object containing
-        a wave file, or a valid argument to `wave.open`.
+        A `bytes` object or other buffer containing a wave file, the
+        path to a wave file, a binary file object or socket to read a
+        wave file from, or an open `wave.Wave_read` or
+        `projectoxford.wavefile.WavReader` object.
     device_id:
         The device to play over. Defaults to the first available.
     '''
     if device_id is None:
         device_id = get_playback_devices()[0][1]
     
-    with _open_wav(wav) as w:
-        return _play(device_id, w)
+    with metrics.start('audio.play') as span, _open_wav(wav) as w:
+        with span.phase('play'):
+            return _play(device_id, w)
+
+def _mean_square_8(data):
+    return sum(((d - 128) / 256) ** 2 for d in data) / len(data)
+
+def _mean_square_16(data):
+    arr = array.array('h', data)
+    return sum((d / 32768) ** 2 for d in arr) / len(arr)
 
 class _RecordStatus(object):
     def __init__(
@@ -144,13 +155,10 @@ class _RecordStatus(object):
 
 
     def _is_quiet_8(self, data):
-        mean_square = sum(((d - 128) / 256) ** 2 for d in data) / len(data)
-        return mean_square < self.quiet_threshold ** 2
+        return _mean_square_8(data) < self.quiet_threshold ** 2
 
     def _is_quiet_16(self, data):
-        arr = array.array('h', data)
-        mean_square = sum((d / 32768) ** 2 for d in arr) / len(arr)
-        return mean_square < self.quiet_threshold ** 2
+        return _mean_square_16(data) < self.quiet_threshold ** 2
 
     def __call__(self, chunk):
         if self.on_call:
@@ -199,9 +207,11 @@ def record(
     as bytes.
 
     wav:
-        A writable wave file, opened with `wave.open`. If ``None``,
-        a new wave file will be created using the values provided
-        for `channels`, `sample_rate` and `bits_per_sample`.
+        A writable wave file, such as a
+        `projectoxford.wavefile.WavWriter` writing to a pipe or socket,
+        or a file opened with `wave.open`. If ``None``, a new wave file
+        will be created using the values provided for `channels`,
+        `sample_rate` and `bits_per_sample`.
     channels:
         The number of channels to record. Must be either 1 or 2.
         Ignored when `wav` is provided.
@@ -249,10 +259,7 @@ def record(
         bits_per_sample = wav.getsampwidth() * 8
     else:
         result = BytesIO()
-        wav = wave.open(result, 'wb')
-        wav.setnchannels(channels)
-        wav.setframerate(sample_rate)
-        wav.setsampwidth(bits_per_sample // 8)
+        wav = wavefile.WavWriter(result, channels, sample_rate, bits_per_sample // 8)
 
     _on_chunk = _RecordStatus(
         wav,
@@ -265,7 +272,8 @@ def record(
         on_chunk
     )
     try:
-        _record(device_id, wav, seconds_per_chunk, _on_chunk)
+        with metrics.start('audio.record') as span, span.phase('record'):
+            _record(device_id, wav, seconds_per_chunk, _on_chunk)
     finally:
         if result:
             wav.close()
@@ -291,17 +299,13 @@ def get_quiet_threshold(sample_rate=11025, bits_per_sample=8, device_id=None):
     rms = [1.0]
     if bits_per_sample == 8:
         def on_chunk(data):
-            rms[0] = math.sqrt(sum(((d - 128) / 256) ** 2 for d in data) / len(data))
+            rms[0] = math.sqrt(_mean_square_8(data))
     elif bits_per_sample == 16:
         def on_chunk(data):
-            arr = array.array('h', data)
-            rms[0] = math.sqrt(sum((d / 32768) ** 2 for d in arr) / len(arr))
+            rms[0] = math.sqrt(_mean_square_16(data))
     else:
         raise ValueError('cannot record {} bits per sample'.format(bits_per_sample))
 
-    with wave.open(BytesIO(), 'wb') as wav:
-        wav.setnchannels(1)
-        wav.setframerate(sample_rate)
-        wav.setsampwidth(bits_per_sample // 8)
+    with wavefile.WavWriter(BytesIO(), 1, sample_rate, bits_per_sample // 8) as wav:
         _record(device_id, wav, 0.5, on_chunk)
     return rms[0]
@@ -0,0 +1,66 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Batch Processing
+
+This module provides the helpers used by the clients to process many
+items concurrently while capturing failures for each item.
+'''
+
+import collections
+import concurrent.futures
+import itertools
+
+__all__ = ['BatchResult', 'imap_unordered']
+
+BatchResult = collections.namedtuple('BatchResult', 'index item result error')
+BatchResult.__doc__ = '''The outcome of processing one item in a batch.
+
+index:
+    The position of the item in the input.
+item:
+    The input item.
+result:
+    The result of processing the item, or ``None`` if it failed.
+error:
+    The exception raised while processing the item, or ``None`` if it
+    succeeded.
+'''
+
+def _call(fn, index, item):
+    try:
+        return BatchResult(index, item, fn(item), None)
+    except Exception as ex:
+        return BatchResult(index, item, None, ex)
+
+def imap_unordered(fn, items, max_workers=8, executor=None):
+    '''Calls `fn` for each of `items` on up to `max_workers` threads and
+    yields a `BatchResult` for each as it completes.
+
+    Items are read from `items` as workers become available, so it may
+    be a generator of unknown length.
+
+    executor:
+        An existing executor to submit calls to. If omitted, a new
+        thread pool is created and shut down when iteration ends.
+    '''
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        it = enumerate(items)
+        pending = set()
+        for index, item in itertools.islice(it, max_workers * 2):
+            pending.add(executor.submit(_call, fn, index, item))
+        while pending:
+            done, pending = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for index, item in itertools.islice(it, len(done)):
+                pending.add(executor.submit(_call, fn, index, item))
+            for f in done:
+                yield f.result()
+    finally:
+        if own_executor:
+            executor.shutdown(wait=False)
@@ -0,0 +1,261 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Benchmarks
+
+Measures the performance of the audio kernels, request construction
+and complete client calls against the local service emulator. No network
+access, audio devices or subscription keys are required.
+
+Run ``python -m projectoxford.benchmarks`` to print results as JSON,
+or pass ``--output FILE`` to write them to a file. Each result has the
+benchmark name, its parameters and timing statistics in seconds.
+'''
+
+import argparse
+import array
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import threading
+import time
+import wave
+
+from io import BytesIO
+
+import projectoxford
+from projectoxford import audio, speech, wavefile
+from projectoxford.emotion import EmotionClient, EmotionResult
+from projectoxford.emulator import Emulator
+from projectoxford.luis import LuisClient
+from projectoxford.speech import SpeechClient
+
+__all__ = ['run', 'main']
+
+_EMOTIONS = ('anger', 'contempt', 'disgust', 'fear', 'happiness', 'neutral', 'sadness', 'surprise')
+
+def _percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(p * len(samples)))]
+
+def _summarize(name, params, samples, number=1, **extra):
+    per_call = [s / number for s in samples]
+    result = {
+        'name': name,
+        'params': params,
+        'repeat': len(samples),
+        'number': number,
+        'min': min(per_call),
+        'mean': sum(per_call) / len(per_call),
+        'p50': _percentile(per_call, 0.50),
+        'p95': _percentile(per_call, 0.95),
+        'p99': _percentile(per_call, 0.99),
+    }
+    result.update(extra)
+    return result
+
+def _timeit(fn, repeat, number):
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+def _make_pcm(bits_per_sample, frames, amplitude=0.01):
+    rnd = random.Random(frames)
+    if bits_per_sample == 8:
+        return bytes(128 + int(rnd.uniform(-amplitude, amplitude) * 127) for _ in range(frames))
+    return array.array('h', (int(rnd.uniform(-amplitude, amplitude) * 32767) for _ in range(frames))).tobytes()
+
+def _make_wav(sample_rate=16000, seconds=1.0, bits_per_sample=16):
+    f = BytesIO()
+    with wavefile.WavWriter(f, 1, sample_rate, bits_per_sample // 8) as w:
+        w.writeframes(_make_pcm(bits_per_sample, int(sample_rate * seconds)))
+    return f.getvalue()
+
+def _make_faces(count):
+    rnd = random.Random(count)
+    return [{
+        'faceRectangle': {'left': rnd.randint(0, 500), 'top': rnd.randint(0, 500), 'width': 100, 'height': 100},
+        'scores': {e: rnd.random() for e in _EMOTIONS},
+    } for _ in range(count)]
+
+def bench_quiet_detection(repeat, number):
+    results = []
+    for bits in (8, 16):
+        for chunk_frames in (512, 5512, 44100):
+            data = _make_pcm(bits, chunk_frames)
+            status = audio._RecordStatus(None, bits, 11025, 0.005, max_quiet_seconds=1, lstrip_quiet=False)
+            samples = _timeit(lambda: status.is_quiet(data), repeat, number)
+            results.append(_summarize('audio.is_quiet', {'bits': bits, 'frames': chunk_frames}, samples, number))
+    return results
+
+def bench_rms(repeat, number):
+    results = []
+    for bits, kernel in ((8, audio._mean_square_8), (16, audio._mean_square_16)):
+        for chunk_frames in (512, 5512, 44100):
+            data = _make_pcm(bits, chunk_frames)
+            samples = _timeit(lambda: kernel(data), repeat, number)
+            results.append(_summarize('audio.rms', {'bits': bits, 'frames': chunk_frames}, samples, number))
+    return results
+
+def bench_open_wav(repeat, number):
+    results = []
+    data = _make_wav(seconds=5)
+    fd, path = tempfile.mkstemp(suffix='.wav')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+
+        def read(wav):
+            with audio._open_wav(wav) as w:
+                w.readframes(w.getnframes())
+
+        def read_file():
+            with open(path, 'rb') as f:
+                read(f)
+
+        def read_wave_module():
+            with wave.open(BytesIO(data), 'rb') as w:
+                w.readframes(w.getnframes())
+
+        for kind, fn in (
+            ('bytes', lambda: read(data)),
+            ('path', lambda: read(path)),
+            ('file', read_file),
+            ('bytes (wave module)', read_wave_module),
+        ):
+            samples = _timeit(fn, repeat, number)
+            results.append(_summarize('audio.open_wav', {'source': kind, 'bytes': len(data)}, samples, number))
+    finally:
+        os.unlink(path)
+    return results
+
+def bench_request_building(repeat, number):
+    results = []
+    voice = speech.VOICES['en-US']['Female']
+    for length in (10, 500):
+        text = 'x' * length
+        samples = _timeit(
+            lambda: speech._SYNTHESIZE_TEMPLATE.format(locale='en-US', gender='Female', voice=voice, text=text),
+            repeat, number
+        )
+        results.append(_summarize('speech.ssml', {'chars': length}, samples, number))
+
+    data = _make_wav()
+    def headers():
+        with audio._open_wav(data) as w:
+            speech._recognize_content_type(w)
+        speech._recognize_params('en-US')
+    samples = _timeit(headers, repeat, number)
+    results.append(_summarize('speech.recognize_headers', {}, samples, number))
+    return results
+
+def bench_strongest_emotion(repeat, number):
+    results = []
+    for count in (1, 10, 100, 1000):
+        result = EmotionResult(_make_faces(count), bytearray())
+        samples = _timeit(result.get_strongest_emotion, repeat, number)
+        results.append(_summarize('emotion.get_strongest_emotion', {'faces': count}, samples, number))
+    return results
+
+def _end_to_end(name, fn, calls, workers):
+    latencies = []
+    lock = threading.Lock()
+    remaining = [calls]
+
+    def worker():
+        while True:
+            with lock:
+                if remaining[0] <= 0:
+                    return
+                remaining[0] -= 1
+            start = time.perf_counter()
+            fn()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.append(elapsed)
+
+    start = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    total = time.perf_counter() - start
+    return _summarize(name, {'calls': calls, 'workers': workers}, latencies,
+                      throughput=calls / total)
+
+def bench_end_to_end(calls, workers=(1, 8)):
+    results = []
+    fd, image_path = tempfile.mkstemp(suffix='.jpg')
+    os.write(fd, os.urandom(32 * 1024))
+    os.close(fd)
+    try:
+        with Emulator() as emu:
+            wav = _make_wav()
+            sc = SpeechClient('key', **emu.speech_args())
+            ec = EmotionClient('key', **emu.emotion_args())
+            lc = LuisClient(emu.luis_url())
+            cases = (
+                ('speech.say_to_wav', lambda: sc.say_to_wav('Hello world')),
+                ('speech.recognize_raw', lambda: sc.recognize_raw(wav)),
+                ('emotion.process_image_from_path', lambda: ec.process_image_from_path(image_path)),
+                ('luis.query', lambda: lc.query('hello world')),
+            )
+            for name, fn in cases:
+                fn()
+                for w in workers:
+                    results.append(_end_to_end(name, fn, calls, w))
+    finally:
+        os.unlink(image_path)
+    return results
+
+def run(repeat=20, number=10, calls=200, quick=False):
+    '''Runs every benchmark and returns a dict containing information
+    about the environment and a list of results.
+    '''
+    if quick:
+        repeat, number, calls = 3, 2, 20
+    results = []
+    results.extend(bench_quiet_detection(repeat, number))
+    results.extend(bench_rms(repeat, number))
+    results.extend(bench_open_wav(repeat, number))
+    results.extend(bench_request_building(repeat, number * 100))
+    results.extend(bench_strongest_emotion(repeat, number))
+    results.extend(bench_end_to_end(calls))
+    return {
+        'version': projectoxford.__version__,
+        'python': sys.version,
+        'platform': platform.platform(),
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m projectoxford.benchmarks', description=__doc__.partition('\n')[0])
+    parser.add_argument('--output', '-o', help='file to write results to (default: stdout)')
+    parser.add_argument('--repeat', type=int, default=20, help='number of timing samples per benchmark')
+    parser.add_argument('--number', type=int, default=10, help='number of calls per timing sample')
+    parser.add_argument('--calls', type=int, default=200, help='number of calls per end-to-end benchmark')
+    parser.add_argument('--quick', action='store_true', help='run a small number of iterations')
+    args = parser.parse_args(argv)
+
+    report = run(args.repeat, args.number, args.calls, args.quick)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+
+if __name__ == '__main__':
+    main()
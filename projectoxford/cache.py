@@ -0,0 +1,314 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Result Caching
+
+This module provides the caches used by the clients to answer repeated
+requests without contacting the service.
+'''
+
+import collections
+import copy
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+
+__all__ = ['TTLCache', 'DiskCache', 'SingleFlight']
+
+_MISSING = object()
+
+class TTLCache(object):
+    '''A thread-safe least-recently-used cache whose entries expire.
+
+    TTLCache(maxsize=1024, ttl=None)
+
+    maxsize:
+        The maximum number of entries. When exceeded, the least
+        recently used entry is removed.
+    ttl:
+        The number of seconds an entry remains valid. If ``None``,
+        entries do not expire.
+    '''
+
+    def __init__(self, maxsize=1024, ttl=None):
+        if maxsize <= 0:
+            raise ValueError('maxsize must be positive')
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __repr__(self):
+        return '<TTLCache {}/{} entries, {} hits, {} misses>'.format(
+            len(self._data), self.maxsize, self.hits, self.misses
+        )
+
+    def get(self, key, default=None):
+        '''Returns the value for `key`, or `default` if it is missing
+        or has expired.
+        '''
+        with self._lock:
+            try:
+                expires, value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            if expires is not None and expires <= time.monotonic():
+                del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value, ttl=None):
+        '''Stores `value` for `key`. If provided, `ttl` overrides the
+        cache's default lifetime for this entry.
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        expires = None if ttl is None else time.monotonic() + ttl
+        with self._lock:
+            self._data[key] = expires, value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def pop(self, key, default=None):
+        '''Removes and returns the value for `key`.'''
+        with self._lock:
+            try:
+                return self._data.pop(key)[1]
+            except KeyError:
+                return default
+
+    def clear(self):
+        '''Removes every entry.'''
+        with self._lock:
+            self._data.clear()
+
+class DiskCache(object):
+    '''A thread-safe cache of JSON values stored as files in a
+    directory, which persists between processes.
+
+    DiskCache(directory, max_bytes=268435456, ttl=None)
+
+    directory:
+        The directory to store entries in. It is created if it does not
+        exist, and existing entries are reused.
+    max_bytes:
+        The maximum total size of the stored entries. When exceeded,
+        the least recently used entries are removed.
+    ttl:
+        The number of seconds an entry remains valid. If ``None``,
+        entries do not expire.
+    '''
+
+    def __init__(self, directory, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._sizes = collections.OrderedDict()
+        self._total = 0
+
+        os.makedirs(directory, exist_ok=True)
+        found = []
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                try:
+                    st = os.stat(os.path.join(directory, name))
+                except OSError:
+                    continue
+                found.append((st.st_mtime, name[:-5], st.st_size))
+        for _, name, size in sorted(found):
+            self._sizes[name] = size
+            self._total += size
+
+    def __len__(self):
+        return len(self._sizes)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+    def __repr__(self):
+        return '<DiskCache {!r} {} entries, {} bytes>'.format(self.directory, len(self._sizes), self._total)
+
+    def _name(self, key):
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _path(self, name):
+        return os.path.join(self.directory, name + '.json')
+
+    def _read(self, name):
+        try:
+            with open(self._path(name), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remove(self, name):
+        self._total -= self._sizes.pop(name, 0)
+        try:
+            os.unlink(self._path(name))
+        except OSError:
+            pass
+
+    def get(self, key, default=None):
+        '''Returns the value for `key`, or `default` if it is missing
+        or has expired.
+        '''
+        name = self._name(key)
+        with self._lock:
+            entry = self._read(name) if name in self._sizes else None
+            if entry is None or entry.get('key') != key:
+                self.misses += 1
+                return default
+            expires = entry.get('expires')
+            if expires is not None and expires <= time.time():
+                self._remove(name)
+                self.misses += 1
+                return default
+            self._sizes.move_to_end(name)
+            try:
+                os.utime(self._path(name))
+            except OSError:
+                pass
+            self.hits += 1
+            return entry['value']
+
+    def put(self, key, value, ttl=None):
+        '''Stores `value`, which must be serializable as JSON, for
+        `key`. If provided, `ttl` overrides the cache's default
+        lifetime for this entry.
+        '''
+        ttl = self.ttl if ttl is None else ttl
+        data = json.dumps({
+            'key': key,
+            'expires': None if ttl is None else time.time() + ttl,
+            'value': value,
+        }).encode('utf-8')
+        name = self._name(key)
+        with self._lock:
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp, self._path(name))
+            except BaseException:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+                raise
+            self._total += len(data) - self._sizes.pop(name, 0)
+            self._sizes[name] = len(data)
+            while self._total > self.max_bytes and len(self._sizes) > 1:
+                self._remove(next(iter(self._sizes)))
+
+    def pop(self, key, default=None):
+        '''Removes and returns the value for `key`.'''
+        name = self._name(key)
+        with self._lock:
+            entry = self._read(name) if name in self._sizes else None
+            if entry is None or entry.get('key') != key:
+                return default
+            self._remove(name)
+            return entry['value']
+
+    def clear(self):
+        '''Removes every entry.'''
+        with self._lock:
+            for name in list(self._sizes):
+                self._remove(name)
+
+    def items(self):
+        '''Returns a list of the keys and values of every entry that
+        has not expired.
+        '''
+        now = time.time()
+        with self._lock:
+            names = list(self._sizes)
+        result = []
+        for name in names:
+            entry = self._read(name)
+            if entry is not None and (entry.get('expires') is None or entry['expires'] > now):
+                result.append((entry['key'], entry['value']))
+        return result
+
+class _Flight(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+def _copy_error(error):
+    '''Returns a new exception like `error`, including attributes such
+    as the `response` of a `requests.HTTPError`, or a `RuntimeError` if
+    it cannot be copied.
+    '''
+    try:
+        return copy.copy(error)
+    except Exception:
+        return RuntimeError('shared call failed: {}'.format(error))
+
+class SingleFlight(object):
+    '''Coalesces concurrent calls for the same key into one call whose
+    result is shared by every caller.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, fn, timeout=None):
+        '''Calls `fn` and returns its result, unless a call for `key`
+        is already in progress, in which case that call's result is
+        returned (or its exception raised) when it completes.
+
+        timeout:
+            The number of seconds to wait for another caller's result.
+            If exceeded, `TimeoutError` is raised.
+        '''
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            if not flight.event.wait(timeout):
+                raise TimeoutError('timed out waiting for a shared result')
+            if flight.error is not None:
+                # Each waiter raises its own exception so that concurrent
+                # handlers do not share one traceback
+                raise _copy_error(flight.error) from flight.error
+            return flight.result
+
+        try:
+            flight.result = fn()
+        except BaseException as ex:
+            flight.error = ex
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.event.set()
+        return flight.result
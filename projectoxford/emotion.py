@@ -11,11 +11,23 @@ This module provides access to the Project Oxford Emotion APIs.
 See https://www.projectoxford.ai/emotion to obtain an API key.
 '''
 
-import time, requests, os
-from .endpoints import EMOTION_ENDPOINT
+import requests, os, json, copy, hashlib, threading, array, csv, concurrent.futures
+from collections import OrderedDict, namedtuple
+from . import endpoints
+from .batch import BatchResult, imap_unordered
+from .cache import DiskCache, SingleFlight, TTLCache
+from .keys import KeyPool, _retry_after
+from .operations import OperationManager
+from . import _http, metrics, preprocess, results
 
 
 MAX_NUM_RETRIES = 10    # Maximum number of retries to fetch results.
+MAX_FACES = 64          # Maximum number of faces returned for one image.
+
+
+def _check_image_path(img_path):
+    if img_path is None or not isinstance(img_path, str) or not os.path.exists(img_path):
+        raise ValueError('Image path should be a valid string and pointing to an existing file.')
 
 
 def image_to_binary(img_path):
@@ -23,9 +35,7 @@ def image_to_binary(img_path):
         Returns contents of the given image in binary stream.
     """
 
-    if img_path is None or not os.path.exists(img_path) or not isinstance(img_path, str):
-        raise ValueError('Image path should be a valid string and pointing to an existing file.')
-
+    _check_image_path(img_path)
     with open(img_path, 'rb') as image_file:
         return image_file.read()
 
@@ -52,58 +62,439 @@ def check_rendering_requirements():
         raise ImportError('Package opencv for python is not installed')
 
 
+def _import_cv2():
+    try:
+        import numpy, cv2
+    except ImportError:
+        raise ImportError('Packages numpy and opencv for python are required to encode or resize images.')
+    return numpy, cv2
+
+
+def _prepare_image(image, max_side, quality):
+    """
+        Encodes an image for upload, reducing it to at most max_side pixels on its longest side.
+
+        Parameters:
+            image: encoded image as bytes, or decoded image as a numpy array in BGR order.
+            max_side: maximum width and height of the uploaded image, or None.
+            quality: JPEG quality between 0 and 100 used when the image is encoded.
+
+        Returns:
+            A tuple of the encoded image and the factors to multiply its x and y coordinates
+            by to obtain coordinates in the original image.
+    """
+
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        if max_side is None:
+            return image, 1.0, 1.0
+        numpy, cv2 = _import_cv2()
+        arr = cv2.imdecode(numpy.frombuffer(image, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+        if arr is None:
+            raise ValueError('Image could not be decoded.')
+        if max(arr.shape[:2]) <= max_side:
+            return image, 1.0, 1.0
+    else:
+        numpy, cv2 = _import_cv2()
+        arr = image
+
+    height, width = arr.shape[:2]
+    fx = fy = 1.0
+    if max_side is not None and max(height, width) > max_side:
+        scale = max_side / max(height, width)
+        new_width, new_height = max(1, int(round(width * scale))), max(1, int(round(height * scale)))
+        arr = cv2.resize(arr, (new_width, new_height), interpolation=cv2.INTER_AREA)
+        fx, fy = width / new_width, height / new_height
+
+    ok, encoded = cv2.imencode('.jpg', arr, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+    if not ok:
+        raise ValueError('Image could not be encoded.')
+    return encoded.tobytes(), fx, fy
+
+
+def _rescale_faces(result, fx, fy):
+    """
+        Converts the face rectangles in a result to the coordinates of the original image.
+    """
+
+    if not result or (fx == 1.0 and fy == 1.0):
+        return result
+    for face in result:
+        rect = face['faceRectangle']
+        rect['left'] = int(round(rect['left'] * fx))
+        rect['top'] = int(round(rect['top'] * fy))
+        rect['width'] = int(round(rect['width'] * fx))
+        rect['height'] = int(round(rect['height'] * fy))
+    return result
+
+
+def _dhash(gray):
+    """
+        Returns the 64-bit difference hash of a grayscale image array, which changes little when
+        the image is resized or re-encoded.
+    """
+
+    numpy, cv2 = _import_cv2()
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(numpy.packbits(bits).tobytes(), 'big')
+
+
+class FaceDetector:
+    """
+        Detects faces locally with an OpenCV cascade classifier. Requires numpy and opencv.
+
+            FaceDetector(cascade=None, scale_factor=1.1, min_neighbors=5, min_size=36, max_side=640)
+
+        cascade:
+            Path to a cascade classifier file. If omitted, the frontal face cascade included with
+            opencv is used.
+        scale_factor, min_neighbors:
+            Parameters for cv2.CascadeClassifier.detectMultiScale. Lower min_neighbors finds more
+            faces, including more false detections, which are then checked by the service.
+        min_size:
+            The smallest face in pixels of the original image. The service does not detect faces
+            smaller than 36 pixels.
+        max_side:
+            Images larger than this are reduced before detection, which is faster and rarely
+            affects faces large enough for the service.
+    """
+
+    def __init__(self, cascade=None, scale_factor=1.1, min_neighbors=5, min_size=36, max_side=640):
+        numpy, cv2 = _import_cv2()
+        if not hasattr(cv2, 'CascadeClassifier'):
+            raise ImportError('This version of opencv for python does not include cascade classifiers.')
+        self.cascade = cascade or os.path.join(cv2.data.haarcascades, 'haarcascade_frontalface_default.xml')
+        self.scale_factor = scale_factor
+        self.min_neighbors = min_neighbors
+        self.min_size = min_size
+        self.max_side = max_side
+        self._local = threading.local()
+        if self._classifier().empty():
+            raise ValueError('Cascade classifier could not be loaded from {0}.'.format(self.cascade))
+
+
+    def _classifier(self):
+        # Classifiers are not safe to share between threads
+        classifier = getattr(self._local, 'classifier', None)
+        if classifier is None:
+            import cv2
+            classifier = self._local.classifier = cv2.CascadeClassifier(self.cascade)
+        return classifier
+
+
+    def detect(self, image):
+        """
+            Detects faces in an image.
+
+            Parameters:
+                image: path to a local image, encoded image as bytes, or numpy array.
+
+            Returns:
+                A list of (left, top, width, height) tuples in the coordinates of the image.
+        """
+
+        numpy, cv2 = _import_cv2()
+        if isinstance(image, str):
+            gray = cv2.imread(image, cv2.IMREAD_GRAYSCALE)
+        elif isinstance(image, (bytes, bytearray, memoryview)):
+            gray = cv2.imdecode(numpy.frombuffer(image, dtype=numpy.uint8), cv2.IMREAD_GRAYSCALE)
+        elif image.ndim == 3:
+            gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        else:
+            gray = image
+        if gray is None:
+            raise ValueError('Image could not be decoded.')
+
+        scale = 1.0
+        if self.max_side and max(gray.shape[:2]) > self.max_side:
+            scale = max(gray.shape[:2]) / self.max_side
+            gray = cv2.resize(gray, (int(round(gray.shape[1] / scale)), int(round(gray.shape[0] / scale))),
+                              interpolation=cv2.INTER_AREA)
+        min_size = max(1, int(self.min_size / scale))
+        faces = self._classifier().detectMultiScale(gray, scaleFactor=self.scale_factor,
+                                                    minNeighbors=self.min_neighbors, minSize=(min_size, min_size))
+        return [tuple(int(round(v * scale)) for v in face) for face in faces]
+
+
+_CacheKey = namedtuple('_CacheKey', 'name phash size')
+
+
+class EmotionCache:
+    """
+        Caches emotion results by the content of each image, so that identical images are only
+        processed once.
+
+            EmotionCache(maxsize=4096, directory=None, max_bytes=268435456, ttl=None, max_distance=None)
+
+        maxsize:
+            The maximum number of results kept in memory.
+        directory:
+            A directory to also store results in, so that they persist between processes.
+        max_bytes:
+            The maximum total size of the results stored in directory.
+        ttl:
+            The number of seconds a result remains valid, or None if results do not expire.
+        max_distance:
+            If provided, images whose perceptual hash differs from a cached image's by at most
+            this many of 64 bits reuse that image's result, with face rectangles scaled to the
+            new image's size. Values between 4 and 10 match resized and re-encoded copies.
+            Requires numpy and opencv.
+    """
+
+    def __init__(self, maxsize=4096, directory=None, max_bytes=256 * 1024 * 1024, ttl=None, max_distance=None):
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk = DiskCache(directory, max_bytes, ttl) if directory else None
+        self.max_distance = max_distance
+        self._hashes = OrderedDict()
+        self._lock = threading.Lock()
+        if max_distance is not None and self.disk is not None:
+            for name, entry in self.disk.items():
+                if entry.get('phash') is not None:
+                    self._hashes[name] = entry['phash']
+
+
+    def key_for_file(self, img_path):
+        """
+            Returns the cache key for a local image, reading the file in blocks to hash it.
+        """
+
+        digest = hashlib.sha256()
+        with open(img_path, 'rb') as image_file:
+            for block in iter(lambda: image_file.read(1024 * 1024), b''):
+                digest.update(block)
+        phash = size = None
+        if self.max_distance is not None:
+            numpy, cv2 = _import_cv2()
+            gray = cv2.imread(img_path, cv2.IMREAD_GRAYSCALE)
+            if gray is not None:
+                phash, size = _dhash(gray), (gray.shape[1], gray.shape[0])
+        return _CacheKey('sha256:' + digest.hexdigest(), phash, size)
+
+
+    def key_for_url(self, img_url):
+        """
+            Returns the cache key for a remote image, which is identified by its URL.
+        """
+
+        return _CacheKey('url:' + img_url, None, None)
+
+
+    def _get(self, name):
+        entry = self.memory.get(name)
+        if entry is None and self.disk is not None:
+            entry = self.disk.get(name)
+            if entry is not None:
+                self.memory.put(name, entry)
+        return entry
+
+
+    def get(self, key):
+        """
+            Returns a copy of the cached result for key, or None.
+        """
+
+        entry = self._get(key.name)
+        if entry is not None:
+            return copy.deepcopy(entry['faces'])
+        if key.phash is None or self.max_distance is None:
+            return None
+
+        with self._lock:
+            candidates = sorted((bin(h ^ key.phash).count('1'), name) for name, h in self._hashes.items())
+        for distance, name in candidates:
+            if distance > self.max_distance:
+                break
+            entry = self._get(name)
+            if entry is None:
+                with self._lock:
+                    self._hashes.pop(name, None)
+                continue
+            faces = copy.deepcopy(entry['faces'])
+            if entry.get('size') and key.size:
+                _rescale_faces(faces, key.size[0] / entry['size'][0], key.size[1] / entry['size'][1])
+            return faces
+        return None
+
+
+    def put(self, key, result):
+        """
+            Stores the result for key.
+        """
+
+        entry = {'faces': result, 'phash': key.phash, 'size': key.size}
+        self.memory.put(key.name, entry)
+        if self.disk is not None:
+            self.disk.put(key.name, entry)
+        if key.phash is not None and self.max_distance is not None:
+            with self._lock:
+                self._hashes[key.name] = key.phash
+                self._hashes.move_to_end(key.name)
+                limit = self.memory.maxsize + (len(self.disk) if self.disk is not None else 0)
+                while len(self._hashes) > limit:
+                    self._hashes.popitem(last=False)
+
+
 class EmotionClient:
     """
         Provides access to the Project Oxford Emotion APIs.
 
-            EmotionClient(key)
+            EmotionClient(key, timeout=None, hedge=None, endpoint=None, quota=None, session=None,
+                          keep_content=True, fetch_content='lazy', image_cache=True, cache=None,
+                          video_endpoint=None, face_detector=None)
 
         key:
             The API key for your subscription. Visit https://www.projectoxford.ai/emotion to obtain one.
+            To spread requests across multiple subscriptions, pass a sequence of keys or a
+            projectoxford.keys.KeyPool.
+        timeout:
+            The default number of seconds allowed for each call, including any retries. This value
+            can be overridden on individual calls.
+        hedge:
+            If True or a percentile between 0 and 1, requests for remote images that take longer
+            than that fraction of recent requests are sent again and the first response is used.
+        endpoint:
+            The URL of the emotion recognition service. If omitted, uses
+            projectoxford.endpoints.EMOTION_ENDPOINT.
+        quota:
+            The number of calls each key may start per second. Calls beyond the quota wait for
+            the next available key, which keeps concurrent callers within the subscription's
+            rate limit. Ignored if key is already a KeyPool.
+        session:
+            A requests.Session to send requests with. If omitted, the client creates its own so
+            that connections are reused.
+        keep_content:
+            If False, results do not keep any reference to the image, and cannot be rendered.
+            Otherwise, results of local images keep the path and only read the file when needed.
+        fetch_content:
+            When remote images are downloaded for rendering. 'lazy' downloads the image when the
+            result's content is first used, True downloads it while the service processes the
+            image, and False never downloads it.
+        image_cache:
+            A projectoxford.cache.TTLCache of downloaded remote images keyed by URL. True caches
+            up to 32 images for five minutes, and None or False disables caching.
+        cache:
+            An EmotionCache of results, which is checked before images are sent to the service.
+            True caches up to 4096 results in memory.
+        video_endpoint:
+            The URL of the video emotion recognition service. If omitted, uses
+            projectoxford.endpoints.EMOTION_VIDEO_ENDPOINT.
+        face_detector:
+            A FaceDetector used to find faces in local and in-memory images before they are
+            sent. Images without faces are not sent, and the detected rectangles are sent with
+            the others so that the service does not detect faces again. True uses a FaceDetector
+            with the default cascade. Requires numpy and opencv.
     """
 
-    def __init__(self, key=None):
-        assert key is not None or isinstance(key, str), 'API subscription key should be a valid string.'
+    def __init__(self, key=None, timeout=None, hedge=None, endpoint=None, quota=None, session=None,
+                 keep_content=True, fetch_content='lazy', image_cache=True, cache=None,
+                 video_endpoint=None, face_detector=None):
+        assert key is not None, 'API subscription key should be a valid string.'
         self.key = key
-
-
-    def _processRequest(self, json, data, headers):
+        if quota is not None and not isinstance(key, KeyPool):
+            self.keys = KeyPool(key, quota=quota)
+        else:
+            self.keys = KeyPool.coerce(key)
+        self.timeout = timeout
+        self._hedge = _http.Hedge.coerce(hedge)
+        self.endpoint = endpoint
+        self.session = session or _http.new_session()
+        self.keep_content = keep_content
+        self.fetch_content = fetch_content
+        if image_cache is True:
+            image_cache = TTLCache(maxsize=32, ttl=300)
+        self.image_cache = image_cache if image_cache is not False else None
+        self._image_flights = SingleFlight()
+        if cache is True:
+            cache = EmotionCache()
+        self.cache = cache if cache is not False else None
+        self.video_endpoint = video_endpoint
+        if face_detector is True:
+            face_detector = FaceDetector()
+        self.face_detector = face_detector or None
+
+
+    def _processRequest(self, json, data, headers, deadline=None, params=None, typed=False):
         """
             Helper function to process the request to Project Oxford
 
             Parameters:
                 json: Used when processing images from its URL. See API Documentation
-                data: Used when processing image read from disk. See API Documentation
+                data: Used when processing image read from disk. May be an open file, which is
+                    rewound and streamed on each attempt. See API Documentation
                 headers: Used to pass the key information and the data type request
+                deadline: Time allowed for the request and any retries
+                params: Query parameters, such as faceRectangles. See API Documentation
+                typed: If True, JSON responses are returned as a projectoxford.results.Faces that
+                    keeps the response content and is only decoded when used
         """
 
-        retries, result = 0, None
+        result = None
 
-        while True:
-            response = requests.request('POST', EMOTION_ENDPOINT, json=json, data=data, headers=headers, params=None)
-            if response.status_code == 429:
-                print('POST Attempt Failed.\nMessage: {0}'.format(response.json()['error']['message']))
-                if retries <= MAX_NUM_RETRIES:
-                    time.sleep(1)
-                    retries += 1
-                    continue
-                else:
-                    raise RuntimeError('Maximum number of retries reached.')
-            elif response.status_code == 200 or response.status_code == 201:
+        with metrics.start('emotion.recognize') as span:
+            key, response = self._post(self.endpoint or endpoints.EMOTION_ENDPOINT, json, data, headers, deadline, span, params)
+            if response.status_code == 200 or response.status_code == 201:
                 if 'content-length' in response.headers and int(response.headers['content-length']) == 0:
                     result = None
                 elif 'content-type' in response.headers and isinstance(response.headers['content-type'], str):
                     if 'application/json' in response.headers['content-type'].lower():
-                        result = response.json() if response.content else None
+                        if not response.content:
+                            result = None
+                        elif typed:
+                            result = results.Faces(response.content)
+                        else:
+                            with span.phase('parse'):
+                                result = results.loads(response.content)
                     elif 'image' in response.headers['content-type'].lower():
                         result = response.content
                 return result
             else:
-                raise RuntimeError('Error Code: {0}\nMessage: {1}'.format(response.status_code, response.json()['error']['message']))
+                raise RuntimeError('Error Code: {0}\nMessage: {1}'.format(response.status_code, results.loads(response.content)['error']['message']))
+
+
+    def _post(self, url, json, data, headers, deadline, span, params=None):
+        """
+            Sends a request with a key from the pool, retrying with another key when the key is
+            throttled or rejected.
+
+            Returns:
+                A tuple of the key that was used and the final response.
+        """
+
+        retries = 0
+        while True:
+            key, response = _http.acquire(self.keys, deadline), None
+            try:
+                if hasattr(data, 'seek'):
+                    data.seek(0)
+                headers = dict(headers)
+                headers['Ocp-Apim-Subscription-Key'] = key
+                response = _http.request('POST', url, deadline, span, session=self.session, json=json, data=data, headers=headers, params=params)
+            finally:
+                if response is None:
+                    self.keys.release(key)
+                else:
+                    ejected = self.keys.release(key, response.status_code, _retry_after(response))
+            if response.status_code == 429:
+                # Throttled responses are counted by _http.request
+                if retries <= MAX_NUM_RETRIES:
+                    # The pool holds back the throttled key until it may be used again
+                    retries += 1
+                    span.count('retries')
+                    continue
+                else:
+                    raise RuntimeError('Maximum number of retries reached.')
+            elif response.status_code in (401, 403) and ejected:
+                retries += 1
+                if retries <= MAX_NUM_RETRIES:
+                    span.count('retries')
+                    continue
+                raise RuntimeError('Maximum number of retries reached.')
+            return key, response
 
     def _make_headers(self, local):
         """
-            Makes correct HTTP headers for Emotion API call request.
+            Makes correct HTTP headers for Emotion API call request. The subscription key is added
+            by _processRequest once a key has been selected from the pool.
 
             Parameters:
                 local: Boolean flag to determine whether image is in local storage or not.
@@ -113,7 +504,6 @@ class EmotionClient:
         """
 
         headers = dict()
-        headers['Ocp-Apim-Subscription-Key'] = self.key
         if local:
             headers['Content-Type'] = 'application/octet-stream'
         else:
@@ -121,63 +511,749 @@ class EmotionClient:
         return headers
 
 
-    def process_image_from_path(self, img_path):
+    def process_image_from_path(self, img_path, timeout=None, typed=False):
         """
-            Processes emotions in local image.
+            Processes emotions in local image. The file is streamed to the service rather than
+            read into memory.
 
             Parameters:
                 img_path: path to local image, '/path/to/image'.
+                timeout: seconds allowed for the call, or None to use the client's default.
+                typed: if True, the response is kept as received and only decoded when the
+                    result's faces or raw_result are used.
 
             Returns:
                 EmotionResult object representing emotions present in target image.
         """
 
         assert img_path is not None and isinstance(img_path, str), 'Image path should be a valid string.'
-        binary = image_to_binary(img_path)
-        result = self._processRequest(None, binary, self._make_headers(local=True))
-        return EmotionResult(result, bytearray(binary))
+        _check_image_path(img_path)
+        cache_key = self.cache.key_for_file(img_path) if self.cache is not None else None
+        result = self._cache_get(cache_key)
+        if result is None:
+            params = self._detect(img_path)
+            if params is False:
+                result = []
+            else:
+                deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+                with open(img_path, 'rb') as image_file:
+                    result = self._processRequest(None, image_file, self._make_headers(local=True), deadline, params, typed)
+            self._cache_put(cache_key, result)
+        return EmotionResult(result, source=img_path if self.keep_content else None)
+
+
+    def _detect(self, image, fx=1.0, fy=1.0):
+        """
+            Detects faces with the client's face detector, if any.
 
+            Returns:
+                None if there is no detector, False if no faces were found, or query parameters
+                containing the faces in the coordinates of the uploaded image.
+        """
 
-    def process_image_from_url(self, img_url):
+        if self.face_detector is None:
+            return None
+        with metrics.start('emotion.detect') as span:
+            with span.phase('detect'):
+                faces = self.face_detector.detect(image)
+            if not faces:
+                span.count('skipped')
+                return False
+        return {'faceRectangles': ';'.join('{0},{1},{2},{3}'.format(
+            int(round(left / fx)), int(round(top / fy)), max(1, int(round(width / fx))), max(1, int(round(height / fy))))
+            for left, top, width, height in faces)}
+
+
+    def _cache_get(self, cache_key):
+        """
+            Returns the cached result for cache_key, or None.
+        """
+
+        if cache_key is None:
+            return None
+        result = self.cache.get(cache_key)
+        if result is not None:
+            with metrics.start('emotion.recognize') as span:
+                span.count('cache_hits')
+        return result
+
+
+    def _cache_put(self, cache_key, result):
+        if cache_key is not None and result is not None:
+            self.cache.put(cache_key, result.to_dict() if isinstance(result, results.Faces) else result)
+
+
+    def process_image(self, image, max_side=1024, quality=90, timeout=None):
+        """
+            Processes emotions in an image held in memory. Images larger than max_side are
+            reduced before uploading, and the face rectangles in the result are converted back
+            to the coordinates of the original image.
+
+            Parameters:
+                image: encoded image as bytes, or decoded image as a numpy array in BGR order,
+                    as returned by cv2.imread.
+                max_side: maximum width and height of the uploaded image, or None to upload
+                    encoded images unchanged. Faces smaller than 36 pixels after reduction are
+                    not detected.
+                quality: JPEG quality between 0 and 100 used when the image is encoded.
+                timeout: seconds allowed for the call, or None to use the client's default.
+
+            Returns:
+                EmotionResult object representing emotions present in target image.
+        """
+
+        assert image is not None, 'Image should be bytes or a numpy array.'
+        data, fx, fy = _prepare_image(image, max_side, quality)
+        params = self._detect(image, fx, fy)
+        if params is False:
+            result = []
+        else:
+            deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+            result = _rescale_faces(self._processRequest(None, data, self._make_headers(local=True), deadline, params), fx, fy)
+
+        return self._make_result(result, image)
+
+
+    def _make_result(self, result, image):
+        """
+            Returns an EmotionResult for an image given as a path, bytes or numpy array, keeping a
+            reference to the image unless keep_content is False.
+        """
+
+        if not self.keep_content:
+            return EmotionResult(result)
+        if isinstance(image, str):
+            return EmotionResult(result, source=image)
+        if isinstance(image, (bytes, bytearray, memoryview)):
+            return EmotionResult(result, bytearray(image))
+        return EmotionResult(result, loader=lambda: _prepare_image(image, None, 100)[0])
+
+
+    def process_mosaic(self, images, tile_size=256, padding=16, quality=90, max_side=4096, max_workers=4,
+                       timeout=None):
+        """
+            Processes emotions in many small images, such as thumbnails or face crops, by combining
+            them into mosaics so that each request covers many images. Requires numpy and opencv.
+
+            Parameters:
+                images: iterable of local paths, encoded images as bytes, or numpy arrays in BGR
+                    order.
+                tile_size: width and height in pixels of the square each image is scaled to fit
+                    in. Faces smaller than 36 pixels after scaling are not detected.
+                padding: pixels of blank space between images, so that faces in neighbouring
+                    images are not combined.
+                quality: JPEG quality between 0 and 100 used to encode each mosaic.
+                max_side: maximum width and height of a mosaic. The service does not accept images
+                    larger than 4096 pixels. Each mosaic holds at most MAX_FACES images, and a
+                    mosaic in which the service finds MAX_FACES faces may have been truncated, so
+                    its images are sent again in two smaller mosaics.
+                max_workers: maximum number of mosaics being encoded or uploaded at once.
+                timeout: seconds allowed for each mosaic, or None to use the client's default.
+
+            Returns:
+                A list containing an EmotionResult for each image in the same order as images,
+                with face rectangles in the coordinates of that image. Raises the first error
+                encountered for any mosaic.
+        """
+
+        images = list(images)
+        columns = max(1, (max_side + padding) // (tile_size + padding))
+        per_mosaic = min(columns * columns, MAX_FACES)
+        chunks = [list(range(i, min(i + per_mosaic, len(images)))) for i in range(0, len(images), per_mosaic)]
+        results = [None] * len(images)
+
+        def process(chunk):
+            faces = self._process_mosaic([images[i] for i in chunk], tile_size, padding, quality, timeout)
+            if faces is None:
+                half = len(chunk) // 2
+                return process(chunk[:half]) + process(chunk[half:])
+            return faces
+
+        for r in imap_unordered(process, chunks, max_workers):
+            if r.error is not None:
+                raise r.error
+            for i, faces in zip(r.item, r.result):
+                results[i] = self._make_result(faces, images[i])
+        return results
+
+
+    def _process_mosaic(self, images, tile_size, padding, quality, timeout):
+        """
+            Sends one mosaic of images and returns a list of the faces in each image, or None if
+            the service returned MAX_FACES faces for a mosaic of more than one image.
+        """
+
+        numpy, cv2 = _import_cv2()
+        columns = max(1, int(len(images) ** 0.5 + 0.999999))
+        rows = (len(images) + columns - 1) // columns
+        step = tile_size + padding
+        mosaic = numpy.zeros((rows * step - padding, columns * step - padding, 3), dtype=numpy.uint8)
+        placements = []
+        for n, image in enumerate(images):
+            if isinstance(image, str):
+                arr = cv2.imread(image, cv2.IMREAD_COLOR)
+            elif isinstance(image, (bytes, bytearray, memoryview)):
+                arr = cv2.imdecode(numpy.frombuffer(image, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+            else:
+                arr = image if image.ndim == 3 else cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+            if arr is None:
+                raise ValueError('Image could not be decoded.')
+            height, width = arr.shape[:2]
+            scale = min(tile_size / width, tile_size / height)
+            tile = cv2.resize(arr, (max(1, int(width * scale)), max(1, int(height * scale))),
+                              interpolation=cv2.INTER_AREA if scale < 1 else cv2.INTER_LINEAR)
+            x, y = (n % columns) * step, (n // columns) * step
+            mosaic[y:y + tile.shape[0], x:x + tile.shape[1]] = tile
+            placements.append((x, y, tile.shape[1], tile.shape[0], width / tile.shape[1], height / tile.shape[0]))
+
+        ok, encoded = cv2.imencode('.jpg', mosaic, [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)])
+        if not ok:
+            raise ValueError('Image could not be encoded.')
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+        result = self._processRequest(None, encoded.tobytes(), self._make_headers(local=True), deadline) or []
+        if len(result) >= MAX_FACES and len(images) > 1:
+            with metrics.start('emotion.recognize') as span:
+                span.count('truncated')
+            return None
+
+        faces = [[] for _ in images]
+        for face in result:
+            rect = face['faceRectangle']
+            cx, cy = rect['left'] + rect['width'] / 2, rect['top'] + rect['height'] / 2
+            n = int(cy // step) * columns + int(cx // step)
+            if n >= len(images):
+                continue
+            x, y, w, h, fx, fy = placements[n]
+            if not (x <= cx < x + w and y <= cy < y + h):
+                continue
+            left, top = max(x, rect['left']), max(y, rect['top'])
+            right = min(x + w, rect['left'] + rect['width'])
+            bottom = min(y + h, rect['top'] + rect['height'])
+            face['faceRectangle'] = {
+                'left': int(round((left - x) * fx)),
+                'top': int(round((top - y) * fy)),
+                'width': int(round((right - left) * fx)),
+                'height': int(round((bottom - top) * fy)),
+            }
+            faces[n].append(face)
+        return faces
+
+
+    def process_image_from_url(self, img_url, timeout=None, fetch_content=None, typed=False):
         """
             Processes emotions in remote image.
 
             Parameters:
                 img_url: path to remote image, 'http://example.com/path/to/image'.
+                timeout: seconds allowed for the call, or None to use the client's default.
+                fetch_content: 'lazy', True or False to override when the image is downloaded
+                    for rendering, or None to use the client's default.
+                typed: if True, the response is kept as received and only decoded when the
+                    result's faces or raw_result are used.
 
             Returns:
                 EmotionResult object representing emotions present in target image.
         """
 
         assert img_url is not None and isinstance(img_url, str), 'Image url should be a valid string.'
-        result = self._processRequest({'url': img_url}, None, self._make_headers(local=False))
-        return EmotionResult(result, bytearray(requests.get(img_url).content))
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+        if fetch_content is None:
+            fetch_content = self.fetch_content
+        if not self.keep_content:
+            fetch_content = False
+
+        loader = None
+        if fetch_content == 'lazy':
+            loader = lambda: self.fetch_image(img_url)
+        elif fetch_content:
+            # Download the image while the service processes it
+            loader = _http._get_executor().submit(self.fetch_image, img_url, deadline).result
+
+        cache_key = self.cache.key_for_url(img_url) if self.cache is not None else None
+        result = self._cache_get(cache_key)
+        if result is None:
+            request = lambda: self._processRequest({'url': img_url}, None, self._make_headers(local=False), deadline, typed=typed)
+            result = self._hedge.call(request, deadline) if self._hedge else request()
+            self._cache_put(cache_key, result)
+        return EmotionResult(result, source=img_url if loader else None, loader=loader)
+
+
+    def fetch_image(self, img_url, deadline=None):
+        """
+            Downloads a remote image, using the client's image cache if it has one. Concurrent
+            downloads of the same image are combined.
+
+            Parameters:
+                img_url: path to remote image, 'http://example.com/path/to/image'.
+                deadline: time allowed for the download, or None to use the client's default.
+
+            Returns:
+                Content of the image in bytes format.
+        """
+
+        if self.image_cache is not None:
+            content = self.image_cache.get(img_url)
+            if content is not None:
+                return content
+        if deadline is None:
+            deadline = _http.Deadline(self.timeout)
+        try:
+            return self._image_flights.do(img_url, lambda: self._download_image(img_url, deadline), deadline.remaining())
+        except TimeoutError:
+            raise requests.Timeout('deadline exceeded')
+
+
+    def _download_image(self, img_url, deadline):
+        response = _http.request('GET', img_url, deadline, session=self.session)
+        response.raise_for_status()
+        content = response.content
+        if self.image_cache is not None:
+            self.image_cache.put(img_url, content)
+        return content
+
+
+    def process_images(self, images, max_workers=8, timeout=None, output=None, processes=None,
+                       max_side=1024, quality=90):
+        """
+            Processes emotions in many local or remote images concurrently.
+
+            Parameters:
+                images: iterable of local paths and 'http://' or 'https://' URLs. Images are read
+                    as workers become available, so this may be a generator.
+                max_workers: maximum number of images being read or uploaded at once.
+                timeout: seconds allowed for each image, or None to use the client's default.
+                output: path or open text file to write a JSON line to for each image as it
+                    completes, containing its index, item, faces and error.
+                processes: if provided, local images are decoded, reduced to max_side and encoded
+                    at quality in this many worker processes (or one per CPU if True) before they
+                    are uploaded, as by process_image. Images may then also be bytes or numpy
+                    arrays. The client's cache and face detector are used as they are without
+                    worker processes. Requires numpy and opencv.
+                max_side: maximum width and height of images prepared by worker processes.
+                quality: JPEG quality between 0 and 100 of images prepared by worker processes.
+
+            Returns:
+                An iterator of projectoxford.batch.BatchResult in the order the images complete.
+                Each result is an EmotionResult, or the error contains the exception raised while
+                processing that image.
+        """
+
+        def process(image):
+            if _is_url(image):
+                return self.process_image_from_url(image, timeout)
+            return self.process_image_from_path(image, timeout)
+
+        def process_prepared(prepared):
+            try:
+                if prepared.error is not None:
+                    raise prepared.error
+                if prepared.data is None:
+                    return self.process_image_from_url(prepared.item, timeout)
+                # Prepared images use the client's cache and face detector, as the images
+                # processed by threads do
+                cache_key = None
+                if self.cache is not None and isinstance(prepared.item, str):
+                    cache_key = self.cache.key_for_file(prepared.item)
+                result = self._cache_get(cache_key)
+                if result is None:
+                    params = self._detect(prepared.item, *prepared.scale)
+                    if params is False:
+                        result = []
+                    else:
+                        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+                        result = self._processRequest(None, prepared.data, self._make_headers(local=True), deadline, params)
+                        result = _rescale_faces(result, *prepared.scale)
+                    self._cache_put(cache_key, result)
+                return self._make_result(result, prepared.item)
+            finally:
+                prepared.release()
+
+        if processes:
+            prepared = preprocess.prepare_images(images, max_side, quality, None if processes is True else processes,
+                                                 queue_size=max_workers * 2)
+            batches = (BatchResult(r.item.index, r.item.item, r.result, r.error)
+                       for r in imap_unordered(process_prepared, prepared, max_workers))
+        else:
+            batches = imap_unordered(process, images, max_workers)
+
+        close = isinstance(output, str)
+        if close:
+            output = open(output, 'w', encoding='utf-8')
+        try:
+            for r in batches:
+                if output is not None:
+                    output.write(json.dumps({
+                        'index': r.index,
+                        'item': r.item if isinstance(r.item, str) else None,
+                        'faces': None if r.result is None else r.result.raw_result,
+                        'error': None if r.error is None else '{0}: {1}'.format(type(r.error).__name__, r.error),
+                    }))
+                    output.write('\n')
+                yield r
+        finally:
+            if close:
+                output.close()
+
+
+    def process_video(self, video, sample_seconds=1.0, change_threshold=4.0, max_skip_seconds=10.0,
+                      frame_rate=None, max_side=640, min_overlap=0.3, timeout=None):
+        """
+            Processes emotions in a video or stream of frames, only sending frames to the service
+            when the picture has changed. Requires numpy and opencv.
+
+            Parameters:
+                video: path to a video file, or an iterable of numpy arrays in BGR order or of
+                    (seconds, array) tuples.
+                sample_seconds: seconds between frames that are considered, or None to consider
+                    every frame.
+                change_threshold: mean difference in brightness (0-255) from the last processed
+                    frame below which a frame is not sent, and the previous faces are used.
+                max_skip_seconds: maximum seconds between processed frames, or None.
+                frame_rate: frames per second of an iterable of arrays. Ignored for video files
+                    and (seconds, array) tuples.
+                max_side: maximum width and height of the uploaded frames.
+                min_overlap: minimum intersection over union for faces in successive processed
+                    frames to be considered the same person.
+                timeout: seconds allowed for each frame, or None to use the client's default.
+
+            Returns:
+                An iterator of VideoFrame for each considered frame. Faces are raw results with an
+                additional 'trackId' that identifies the same face across frames. Frames that were
+                not processed share the faces of the last processed frame.
+        """
+
+        numpy, cv2 = _import_cv2()
+        tracker = _FaceTracker(min_overlap)
+        next_sample = 0.0
+        last_thumb = last_time = None
+        faces = []
+
+        for index, seconds, frame in _iter_frames(video, frame_rate, lambda t: sample_seconds is None or t >= next_sample):
+            if sample_seconds is not None:
+                next_sample = max(next_sample + sample_seconds, seconds)
+
+            thumb = cv2.resize(cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY) if frame.ndim == 3 else frame,
+                               (32, 32), interpolation=cv2.INTER_AREA).astype(numpy.float32)
+            changed = (last_thumb is None or
+                       float(numpy.abs(thumb - last_thumb).mean()) >= change_threshold or
+                       (max_skip_seconds is not None and seconds - last_time >= max_skip_seconds))
+            if changed:
+                result = self.process_image(frame, max_side=max_side, timeout=timeout)
+                faces = tracker.update(result.raw_result or [])
+                last_thumb, last_time = thumb, seconds
+            yield VideoFrame(index, seconds, faces, changed)
+
+
+    def submit_video(self, video, output_style='aggregate', timeout=None):
+        """
+            Submits a video for emotion recognition, which the service performs in the background.
+
+            Parameters:
+                video: path to a local video, which is streamed to the service, or URL of a remote
+                    video.
+                output_style: 'aggregate' for scores over intervals of the video, or 'perFrame'.
+                timeout: seconds allowed for the upload, or None to use the client's default.
+
+            Returns:
+                A dictionary identifying the operation, to pass to get_video_operation. It
+                contains the operation URL and a fingerprint of the key that submitted it, but not
+                the key itself, so it may be stored.
+        """
+
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+        url = '{0}?outputStyle={1}'.format(self.video_endpoint or endpoints.EMOTION_VIDEO_ENDPOINT, output_style)
+        with metrics.start('emotion.submit_video') as span:
+            if _is_url(video):
+                key, response = self._post(url, {'url': video}, None, self._make_headers(local=False), deadline, span)
+            else:
+                _check_image_path(video)
+                with open(video, 'rb') as video_file:
+                    key, response = self._post(url, None, video_file, self._make_headers(local=True), deadline, span)
+        if response.status_code != 202 or 'Operation-Location' not in response.headers:
+            raise RuntimeError('Error Code: {0}\nMessage: {1}'.format(response.status_code, response.text))
+        return {'url': response.headers['Operation-Location'], 'key': _key_fingerprint(key)}
+
+
+    def get_video_operation(self, operation, timeout=None):
+        """
+            Gets the status of a video submitted by submit_video.
+
+            Parameters:
+                operation: the dictionary returned by submit_video.
+                timeout: seconds allowed for the call, or None to use the client's default.
+
+            Returns:
+                The operation's status dictionary. Its 'status' is one of 'NotStarted', 'Uploading',
+                'Running', 'Failed' or 'Succeeded', and once succeeded, 'processingResult' contains
+                the decoded result. Returns None if the service asks for the request to be
+                delayed.
+        """
+
+        key = next((k for k in self.keys if _key_fingerprint(k) == operation.get('key')), None)
+        if key is None:
+            raise ValueError('The key that submitted this operation is not available.')
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+        with metrics.start('emotion.video_status') as span:
+            response = _http.request('GET', operation['url'], deadline, span, session=self.session,
+                                     headers={'Ocp-Apim-Subscription-Key': key})
+            if response.status_code == 429:
+                span.count('retries')
+                return None
+            if response.status_code != 200:
+                raise RuntimeError('Error Code: {0}\nMessage: {1}'.format(response.status_code, response.text))
+            with span.phase('parse'):
+                status = results.loads(response.content)
+                if isinstance(status.get('processingResult'), str):
+                    status['processingResult'] = results.loads(status['processingResult'])
+        return status
+
+
+    def process_videos(self, videos, state_path=None, max_workers=4, interval=5.0, max_interval=60.0,
+                       output_style='aggregate', timeout=None):
+        """
+            Submits many videos for emotion recognition and waits for their results.
+
+            Parameters:
+                videos: iterable of local paths and URLs of videos.
+                state_path: path of a JSON file recording each video's operation and result. When
+                    the same videos are processed again, for example after the process was
+                    restarted, submitted videos are not submitted again and completed results are
+                    returned immediately.
+                max_workers: maximum number of uploads and polls in progress at once.
+                interval: seconds before an operation is first polled. The interval increases
+                    each time the operation is found to be running, up to max_interval.
+                max_interval: maximum seconds between polls of an operation.
+                output_style: 'aggregate' or 'perFrame'.
+                timeout: seconds allowed for each upload or poll, or None to use the client's
+                    default.
+
+            Returns:
+                An iterator of projectoxford.batch.BatchResult in the order the videos complete.
+                Each result is the decoded processing result, or the error contains the exception
+                raised for that video.
+        """
+
+        def poll(operation):
+            status = self.get_video_operation(operation, timeout)
+            if status is None:
+                return None
+            state = status.get('status', '').lower()
+            if state == 'succeeded':
+                return status.get('processingResult')
+            if state == 'failed':
+                raise RuntimeError('Video processing failed: {0}'.format(status.get('message')))
+            return None
+
+        manager = OperationManager(lambda video: self.submit_video(video, output_style, timeout), poll,
+                                   state_path, max_workers, interval, max_interval)
+        return manager.run(videos)
+
+
+def _key_fingerprint(key):
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _iter_frames(video, frame_rate, wanted):
+    """
+        Yields the index, time in seconds and image of each frame for which wanted(seconds) is
+        True. Frames of video files that are not wanted are not decoded.
+    """
+
+    if isinstance(video, str):
+        numpy, cv2 = _import_cv2()
+        capture = cv2.VideoCapture(video)
+        if not capture.isOpened():
+            raise ValueError('Video could not be opened: {0}'.format(video))
+        try:
+            rate = capture.get(cv2.CAP_PROP_FPS) or frame_rate or 30.0
+            index = 0
+            while capture.grab():
+                seconds = index / rate
+                if wanted(seconds):
+                    ok, frame = capture.retrieve()
+                    if ok:
+                        yield index, seconds, frame
+                index += 1
+        finally:
+            capture.release()
+        return
+
+    for index, item in enumerate(video):
+        if isinstance(item, tuple):
+            seconds, frame = item
+        else:
+            seconds, frame = index / (frame_rate or 1.0), item
+        if wanted(seconds):
+            yield index, seconds, frame
+
+
+def _overlap(a, b):
+    """
+        Returns the intersection over union of two face rectangles.
+    """
+
+    left, top = max(a['left'], b['left']), max(a['top'], b['top'])
+    right = min(a['left'] + a['width'], b['left'] + b['width'])
+    bottom = min(a['top'] + a['height'], b['top'] + b['height'])
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a['width'] * a['height'] + b['width'] * b['height'] - inter
+    return inter / union if union else 0.0
+
+
+class _FaceTracker:
+    """
+        Assigns the same track id to faces in successive results whose rectangles overlap.
+    """
+
+    def __init__(self, min_overlap):
+        self.min_overlap = min_overlap
+        self.faces = []
+        self.next_id = 0
+
+
+    def update(self, faces):
+        pairs = sorted(((_overlap(p['faceRectangle'], f['faceRectangle']), i, j)
+                        for i, p in enumerate(self.faces) for j, f in enumerate(faces)), reverse=True)
+        ids, used = {}, set()
+        for overlap, i, j in pairs:
+            if overlap < self.min_overlap:
+                break
+            if i not in used and j not in ids:
+                ids[j] = self.faces[i]['trackId']
+                used.add(i)
+        for j, face in enumerate(faces):
+            if j not in ids:
+                ids[j] = self.next_id
+                self.next_id += 1
+            face['trackId'] = ids[j]
+        self.faces = faces
+        return faces
+
+
+VideoFrame = namedtuple('VideoFrame', 'index time faces analyzed')
+VideoFrame.__doc__ = """
+    A frame considered by EmotionClient.process_video.
+
+    index:
+        The position of the frame in the video.
+    time:
+        The time of the frame in seconds.
+    faces:
+        A list of raw face results with a 'trackId' for each face.
+    analyzed:
+        True if the frame was sent to the service, or False if the faces were carried forward.
+"""
+
+
+def face_time_series(frames):
+    """
+        Collects the faces from the frames returned by EmotionClient.process_video into a time
+        series for each tracked face.
+
+        Returns:
+            A dictionary mapping each track id to a dictionary of equal length lists 'time',
+            'faceRectangle' and 'scores'.
+    """
+
+    series = OrderedDict()
+    for frame in frames:
+        for face in frame.faces:
+            s = series.setdefault(face['trackId'], {'time': [], 'faceRectangle': [], 'scores': []})
+            s['time'].append(frame.time)
+            s['faceRectangle'].append(face['faceRectangle'])
+            s['scores'].append(face['scores'])
+    return series
+
+
+def _is_url(image):
+    return isinstance(image, str) and image.lower().startswith(('http://', 'https://'))
 
 
 class EmotionResult:
     """
         Represents processed result of an image received from Project Oxford Emotion APIs.
 
-            EmotionResult(raw_result, content)
+            EmotionResult(raw_result, content=None, source=None, loader=None)
 
         raw_result:
-            Raw JSON result received from Project Oxford Emotion APIs.
+            Raw JSON result received from Project Oxford Emotion APIs, or a
+            projectoxford.results.Faces, which is only decoded into a raw result when used.
         content:
             Content of the target image in bytearray format.
+        source:
+            Path of the target image, which is read when content is first used. Ignored if
+            content is provided.
+        loader:
+            Function returning the content of the target image, which is called instead of
+            reading source when content is first used.
     """
 
-    def __init__(self, raw_result, content):
+    def __init__(self, raw_result, content=None, source=None, loader=None):
         assert raw_result is not None, 'Raw result should not be None'
-        assert content is not None, 'Image content should not be None'
 
         self.raw_result = raw_result
-        self.content = content
+        self._content = content
+        self.source = source if content is None else None
+        self._loader = loader if content is None else None
+
+
+    @property
+    def raw_result(self):
+        """
+            Returns:
+                Raw JSON result received from Project Oxford Emotion APIs, decoded when first used.
+        """
+
+        if self._raw_result is None:
+            self._raw_result = self._faces.to_dict()
+        return self._raw_result
+
+
+    @raw_result.setter
+    def raw_result(self, value):
+        if isinstance(value, results.Faces):
+            self._raw_result, self._faces = None, value
+        else:
+            self._raw_result, self._faces = value, None
 
 
     def __repr__(self):
         return str(self.raw_result)
 
 
+    @property
+    def content(self):
+        """
+            Returns:
+                Content of the target image in bytearray format, read from source if necessary.
+        """
+
+        if self._content is None:
+            if self._loader is not None:
+                self._content = bytearray(self._loader())
+                self._loader = None
+            elif self.source is not None:
+                self._content = bytearray(image_to_binary(self.source))
+            else:
+                raise ValueError('Image content is not available for this result.')
+        return self._content
+
+
+    @content.setter
+    def content(self, value):
+        self._content = value
+
+
+    def drop_content(self):
+        """
+            Releases the image content and source. The result can no longer be rendered.
+        """
+
+        self._content = None
+        self.source = None
+        self._loader = None
+
+
     def get_raw_result(self):
         """
             Returns:
@@ -187,6 +1263,18 @@ class EmotionResult:
         return self.raw_result
 
 
+    @property
+    def faces(self):
+        """
+            Returns:
+                A projectoxford.results.Faces sequence with a compact Face object for each face.
+        """
+
+        if self._faces is None:
+            self._faces = results.Faces.from_dict(self._raw_result)
+        return self._faces
+
+
     def get_strongest_emotion(self):
         """
             Returns:
@@ -194,6 +1282,10 @@ class EmotionResult:
                     strongest emotion in each face is returned.
         """
 
+        if self._raw_result is None:
+            strongest = [face.strongest for face in self.faces]
+            return None if not strongest else strongest[0] if len(strongest) == 1 else strongest
+
         num_faces, res = len(self.get_raw_result()), self.get_raw_result()
         if num_faces < 1:
             return None
@@ -225,21 +1317,408 @@ class EmotionResult:
             Draws boxes and text representing each face's emotion.
         """
 
-        import operator, cv2
+        import cv2
 
         img = cv2.cvtColor(cv2.imdecode(arr, -1), cv2.COLOR_BGR2RGB)
+        return _draw_faces(img, result, (255,0,0))
+
 
-        for currFace in result:
-            faceRectangle = currFace['faceRectangle']
-            cv2.rectangle(img,(faceRectangle['left'],faceRectangle['top']),
-                               (faceRectangle['left']+faceRectangle['width'], faceRectangle['top'] + faceRectangle['height']),
-                               color = (255,0,0), thickness = 5)
+    def render_to_file(self, path, quality=90):
+        """
+            Draws emotion results on the target image and writes it to a file without displaying
+            it. Requires numpy and opencv, but not matplotlib.
+
+            Parameters:
+                path: path of the image to write. The extension determines the format.
+                quality: JPEG quality between 0 and 100, if path is a JPEG file.
 
-        for currFace in result:
-            faceRectangle = currFace['faceRectangle']
-            currEmotion = max(iter(currFace['scores'].items()), key=operator.itemgetter(1))[0]
+            Returns:
+                The path that was written.
+        """
+
+        _render_file(self.raw_result, self.content, path, quality)
+        return path
+
+
+def _draw_faces(img, result, color):
+    """
+        Draws a box and the strongest emotion for each face in a single pass.
+    """
+
+    import cv2
+
+    for currFace in result:
+        faceRectangle = currFace['faceRectangle']
+        left, top = faceRectangle['left'], faceRectangle['top']
+        cv2.rectangle(img, (left, top), (left + faceRectangle['width'], top + faceRectangle['height']),
+                      color = color, thickness = 5)
+        scores = currFace['scores']
+        cv2.putText(img, max(scores, key=scores.get), (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+    return img
+
+
+def _render_file(raw_result, content, path, quality, source=None):
+    """
+        Decodes an image from content, or reads it from source, draws the faces in raw_result
+        and writes it to path.
+    """
+
+    numpy, cv2 = _import_cv2()
+    if content is None:
+        img = cv2.imread(source, cv2.IMREAD_COLOR)
+    else:
+        img = cv2.imdecode(numpy.frombuffer(content, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Image could not be decoded.')
+    _draw_faces(img, raw_result, (0,0,255))
+    params = []
+    if os.path.splitext(path)[1].lower() in ('.jpg', '.jpeg'):
+        params = [int(cv2.IMWRITE_JPEG_QUALITY), int(quality)]
+    if not cv2.imwrite(path, img, params):
+        raise ValueError('Image could not be written to {0}.'.format(path))
+
+
+def _render_job(job):
+    """
+        Renders one image in a worker process, returning the exception rather than raising it.
+    """
+
+    try:
+        _render_file(*job)
+    except Exception as ex:
+        return ex
+    return None
+
+
+def render_many(results, outputs, max_workers=None, quality=90, chunksize=8):
+    """
+        Draws emotion results on many images and writes them to files using a pool of processes.
+
+        Parameters:
+            results: iterable of EmotionResult objects. Results for local images are read by the
+                worker processes, and other images are loaded before being sent to them.
+            outputs: directory to write images to, named by their position in results followed by
+                the original file name, or an iterable of output paths matching results. Images
+                are never written over their original file.
+            max_workers: number of processes, or None for one per CPU. With 1, images are
+                rendered in the current process.
+            quality: JPEG quality between 0 and 100 for JPEG outputs.
+            chunksize: number of images sent to a worker process at once.
+
+        Returns:
+            A list of projectoxford.batch.BatchResult in the same order as results. Each result is
+            the path that was written, or the error contains the exception raised for that image.
+    """
+
+    results = list(results)
+    if isinstance(outputs, str):
+        os.makedirs(outputs, exist_ok=True)
+        paths = []
+        for i, r in enumerate(results):
+            if r.source and not _is_url(r.source):
+                stem, ext = os.path.splitext(os.path.basename(r.source))
+                name = '{0}-{1}{2}'.format(i, stem, ext or '.jpg')
+            else:
+                name = 'image-{0}.jpg'.format(i)
+            paths.append(os.path.join(outputs, name))
+    else:
+        paths = list(outputs)
+
+    jobs, errors = [], {}
+    for i, (r, path) in enumerate(zip(results, paths)):
+        if r.source and not _is_url(r.source) and (
+                os.path.normcase(os.path.realpath(path)) == os.path.normcase(os.path.realpath(r.source))):
+            errors[i] = ValueError('Output path is the original image: {0}'.format(path))
+            continue
+        if r._content is None and r._loader is None and r.source:
+            jobs.append((i, (r.raw_result, None, path, quality, r.source)))
+            continue
+        try:
+            jobs.append((i, (r.raw_result, bytes(r.content), path, quality)))
+        except Exception as ex:
+            errors[i] = ex
+
+    if max_workers == 1:
+        for i, job in jobs:
+            errors[i] = _render_job(job)
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            for (i, _), error in zip(jobs, executor.map(_render_job, [job for _, job in jobs], chunksize=chunksize)):
+                errors[i] = error
+
+    return [BatchResult(i, p, None if errors.get(i) else p, errors.get(i)) for i, p in enumerate(paths)]
+
+
+def _import_numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError('Package numpy is not installed.')
+    return numpy
+
+
+class EmotionResultSet:
+    """
+        Stores the faces from many emotion results in compact columns, for computing statistics
+        over large numbers of images. Requires numpy.
+
+            EmotionResultSet(results=None, ids=None)
+
+        results:
+            An iterable of EmotionResult objects or raw results to add.
+        ids:
+            An iterable of identifiers for each result, such as its path. If omitted, the
+            position of each result is used.
+
+        Each face is a row, identified by the index of its image in ids. The image, rects and
+        scores attributes are numpy arrays with one row per face, and scores has a column for
+        each emotion in EMOTIONS.
+    """
+
+    EMOTIONS = results.EMOTIONS
+
+    def __init__(self, results=None, ids=None):
+        self.ids = []
+        self._image = array.array('i')
+        self._rects = array.array('i')
+        self._scores = array.array('f')
+        self._arrays = None
+        if results is not None:
+            self.extend(results, ids)
+
+
+    def __len__(self):
+        return len(self._image)
+
+
+    def __repr__(self):
+        return '<EmotionResultSet of {0} faces in {1} images>'.format(len(self), len(self.ids))
 
-            textToWrite = '{0}'.format(currEmotion)
-            cv2.putText(img, textToWrite, (faceRectangle['left'],faceRectangle['top']-10), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,0,0), 1)
 
-        return img
+    def append(self, result, image_id=None):
+        """
+            Adds the faces from an EmotionResult, a raw result or a projectoxford.results.Faces.
+
+            Parameters:
+                result: the result to add.
+                image_id: identifier for the image. If omitted, the number of images already added.
+        """
+
+        index = len(self.ids)
+        self.ids.append(index if image_id is None else image_id)
+        if isinstance(result, EmotionResult):
+            # Typed results are added without decoding them into raw results
+            result = result.faces if result._raw_result is None else result._raw_result
+        emotions = self.EMOTIONS
+        for face in result or ():
+            if isinstance(face, results.Face):
+                rect, values = (face.left, face.top, face.width, face.height), face.values
+            else:
+                r, scores = face['faceRectangle'], face['scores']
+                rect = (r['left'], r['top'], r['width'], r['height'])
+                values = [scores.get(e, 0.0) for e in emotions]
+            self._image.append(index)
+            self._rects.extend(rect)
+            self._scores.extend(values)
+        self._arrays = None
+
+
+    def extend(self, results, ids=None):
+        """
+            Adds the faces from each of results, with the matching identifier from ids if provided.
+        """
+
+        if ids is None:
+            for result in results:
+                self.append(result)
+        else:
+            for result, image_id in zip(results, ids):
+                self.append(result, image_id)
+
+
+    def _get_arrays(self):
+        if self._arrays is None:
+            numpy = _import_numpy()
+            self._arrays = (
+                numpy.frombuffer(self._image, dtype=numpy.int32).copy(),
+                numpy.frombuffer(self._rects, dtype=numpy.int32).reshape(-1, 4).copy(),
+                numpy.frombuffer(self._scores, dtype=numpy.float32).reshape(-1, len(self.EMOTIONS)).copy(),
+            )
+        return self._arrays
+
+
+    @property
+    def image(self):
+        """
+            Returns:
+                Array containing the index in ids of the image each face was found in.
+        """
+
+        return self._get_arrays()[0]
+
+
+    @property
+    def rects(self):
+        """
+            Returns:
+                Array of the left, top, width and height of each face.
+        """
+
+        return self._get_arrays()[1]
+
+
+    @property
+    def scores(self):
+        """
+            Returns:
+                Array of the score for each emotion of each face.
+        """
+
+        return self._get_arrays()[2]
+
+
+    @property
+    def nbytes(self):
+        """
+            Returns:
+                The number of bytes used by the face columns.
+        """
+
+        return sum(a.itemsize * len(a) for a in (self._image, self._rects, self._scores))
+
+
+    def strongest(self):
+        """
+            Returns:
+                Array containing the index in EMOTIONS of the strongest emotion of each face.
+        """
+
+        return self.scores.argmax(axis=1)
+
+
+    def strongest_names(self):
+        """
+            Returns:
+                List containing the name of the strongest emotion of each face.
+        """
+
+        return [self.EMOTIONS[i] for i in self.strongest().tolist()]
+
+
+    def above(self, threshold, emotion=None):
+        """
+            Returns a boolean array selecting faces with a score of at least threshold.
+
+            Parameters:
+                threshold: the minimum score.
+                emotion: the emotion to test. If omitted, faces where any emotion meets the
+                    threshold are selected.
+        """
+
+        if emotion is None:
+            return (self.scores >= threshold).any(axis=1)
+        return self.scores[:, self.EMOTIONS.index(emotion)] >= threshold
+
+
+    def face_counts(self):
+        """
+            Returns:
+                Array containing the number of faces in each image.
+        """
+
+        numpy = _import_numpy()
+        return numpy.bincount(self.image, minlength=len(self.ids))
+
+
+    def emotion_counts(self):
+        """
+            Returns:
+                Dictionary mapping each emotion to the number of faces where it is strongest.
+        """
+
+        numpy = _import_numpy()
+        counts = numpy.bincount(self.strongest(), minlength=len(self.EMOTIONS))
+        return dict(zip(self.EMOTIONS, counts.tolist()))
+
+
+    def mean_scores(self):
+        """
+            Returns:
+                Dictionary mapping each emotion to its mean score over every face.
+        """
+
+        if not len(self):
+            return dict.fromkeys(self.EMOTIONS, float('nan'))
+        return dict(zip(self.EMOTIONS, self.scores.mean(axis=0).tolist()))
+
+
+    def per_image(self, stat='mean'):
+        """
+            Returns an array with a row for each image and a column for each emotion.
+
+            Parameters:
+                stat: 'mean', 'sum' or 'max' of the scores of the faces in each image. Images
+                    without faces have zero sums and NaN means and maximums.
+        """
+
+        numpy = _import_numpy()
+        image, scores, n = self.image, self.scores, len(self.ids)
+        if stat == 'max':
+            result = numpy.full((n, scores.shape[1]), numpy.nan, dtype=numpy.float32)
+            if len(image):
+                result[numpy.unique(image)] = -numpy.inf
+                numpy.maximum.at(result, image, scores)
+            return result
+        sums = numpy.stack([numpy.bincount(image, weights=scores[:, i], minlength=n)
+                            for i in range(scores.shape[1])], axis=1)
+        if stat == 'sum':
+            return sums
+        if stat == 'mean':
+            with numpy.errstate(invalid='ignore', divide='ignore'):
+                return sums / self.face_counts()[:, None]
+        raise ValueError('stat must be one of mean, sum or max')
+
+
+    def _columns(self):
+        image, rects, scores = self._get_arrays()
+        columns = [('image_id', [self.ids[i] for i in image.tolist()])]
+        columns.extend((name, rects[:, i]) for i, name in enumerate(('left', 'top', 'width', 'height')))
+        columns.extend((name, scores[:, i]) for i, name in enumerate(self.EMOTIONS))
+        return columns
+
+
+    def to_arrow(self):
+        """
+            Returns:
+                A pyarrow.Table with a row for each face.
+        """
+
+        try:
+            import pyarrow
+        except ImportError:
+            raise ImportError('Package pyarrow is not installed.')
+
+        columns = self._columns()
+        return pyarrow.Table.from_arrays([pyarrow.array(c) for _, c in columns], names=[n for n, _ in columns])
+
+
+    def to_parquet(self, path):
+        """
+            Writes a row for each face to a Parquet file. Requires pyarrow.
+        """
+
+        table = self.to_arrow()
+        import pyarrow.parquet
+        pyarrow.parquet.write_table(table, path)
+
+
+    def to_csv(self, path):
+        """
+            Writes a row for each face to a CSV file with a header row.
+        """
+
+        columns = self._columns()
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([n for n, _ in columns])
+            writer.writerows(zip(*[c if isinstance(c, list) else c.tolist() for _, c in columns]))
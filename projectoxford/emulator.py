@@ -0,0 +1,558 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Service Emulator
+
+This module provides a local stand-in for the speech, emotion and LUIS
+services, and a load generator for driving the real clients against
+it. It requires no network access or subscription keys.
+
+    with Emulator(latency=0.05, jitter=0.5, throttle_rate=0.1) as emu:
+        sc = SpeechClient('key', **emu.speech_args())
+        ec = EmotionClient('key', **emu.emotion_args())
+        lc = LuisClient(emu.luis_url())
+        report = generate_load(lambda i: lc.query('hello'), qps=50, duration=10)
+
+Run ``python -m projectoxford.emulator`` to start a server from the
+command line, or ``python -m projectoxford.emulator --load luis`` to
+measure a client against it.
+'''
+
+import argparse
+import array
+import concurrent.futures
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+import urllib.parse as parse
+
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from io import BytesIO
+from socketserver import ThreadingMixIn
+
+from projectoxford.wavefile import WavError, WavWriter, open_wav
+
+__all__ = ['Behavior', 'Emulator', 'generate_load']
+
+_EMOTIONS = ('anger', 'contempt', 'disgust', 'fear', 'happiness', 'neutral', 'sadness', 'surprise')
+
+class Behavior(object):
+    '''Describes how an emulated endpoint responds.
+
+    Behavior(latency=0.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0, retry_after=1)
+
+    latency:
+        The median number of seconds to wait before responding.
+    jitter:
+        The spread of the latency distribution. Latencies are drawn
+        from a log-normal distribution with this sigma, so larger
+        values produce longer tails.
+    failure_rate:
+        The fraction of requests that fail with a 500 response.
+    throttle_rate:
+        The fraction of requests that fail with a 429 response.
+    retry_after:
+        The value of the Retry-After header sent with 429 responses.
+    '''
+
+    def __init__(self, latency=0.0, jitter=0.0, failure_rate=0.0, throttle_rate=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+
+    def __repr__(self):
+        return 'Behavior(latency={!r}, jitter={!r}, failure_rate={!r}, throttle_rate={!r}, retry_after={!r})'.format(
+            self.latency, self.jitter, self.failure_rate, self.throttle_rate, self.retry_after
+        )
+
+    def delay(self, rnd):
+        '''Returns a number of seconds to wait before responding.'''
+        if self.latency <= 0:
+            return 0
+        if self.jitter <= 0:
+            return self.latency
+        return rnd.lognormvariate(math.log(self.latency), self.jitter)
+
+    def outcome(self, rnd):
+        '''Returns 429, 500 or ``None`` for a successful response.'''
+        x = rnd.random()
+        if x < self.throttle_rate:
+            return 429
+        if x < self.throttle_rate + self.failure_rate:
+            return 500
+        return None
+
+def _make_pcm_wav(seconds, sample_rate=16000, frequency=440.0):
+    frames = int(seconds * sample_rate)
+    step = 2 * math.pi * frequency / sample_rate
+    pcm = array.array('h', (int(8000 * math.sin(i * step)) for i in range(frames)))
+    if sys.byteorder == 'big':
+        pcm.byteswap()
+    f = BytesIO()
+    with WavWriter(f, 1, sample_rate, 2, nframes=frames) as w:
+        w.writeframes(pcm)
+    return f.getvalue()
+
+def _faces_for(data, max_faces=3, rects=None):
+    '''Returns a deterministic list of faces for an image. If `rects`
+    is provided in the form of the ``faceRectangles`` parameter, a face
+    is returned for each of those rectangles. Like the service, no more
+    than 64 faces are returned.
+    '''
+    rnd = random.Random(hashlib.md5(data).digest())
+    if rects:
+        rects = [dict(zip(('left', 'top', 'width', 'height'), map(int, r.split(',')))) for r in rects.split(';')]
+    else:
+        rects = []
+        for _ in range(rnd.randint(0, max_faces)):
+            size = rnd.randint(40, 200)
+            rects.append({'left': rnd.randint(0, 600), 'top': rnd.randint(0, 400), 'width': size, 'height': size})
+    faces = []
+    for rect in rects:
+        scores = {e: rnd.random() ** 4 for e in _EMOTIONS}
+        total = sum(scores.values())
+        faces.append({
+            'faceRectangle': rect,
+            'scores': {e: s / total for e, s in scores.items()},
+        })
+    return faces[:64]
+
+_SSML_TEXT_RE = re.compile(r'<voice[^>]*>(.*?)</voice>', re.S)
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, *args):
+        if self.server.emulator.verbose:
+            BaseHTTPRequestHandler.log_message(self, *args)
+
+    def _send(self, status, body=b'', content_type='application/json', headers=()):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in headers:
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, status, message, headers=()):
+        self._send(status, {'error': {'code': str(status), 'message': message}}, headers=headers)
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+            return self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        parts = []
+        while True:
+            size = int(self.rfile.readline().split(b';')[0], 16)
+            if not size:
+                break
+            parts.append(self.rfile.read(size))
+            self.rfile.readline()
+        # Skip any trailers
+        while self.rfile.readline() not in (b'\r\n', b'\n', b''):
+            pass
+        return b''.join(parts)
+
+    def _key_ok(self, key):
+        keys = self.server.emulator.keys
+        return keys is None or key in keys
+
+    def _token_ok(self):
+        return self.headers.get('Authorization', '').startswith('Bearer ')
+
+    def _handle(self, service, respond, authorized=True):
+        emu = self.server.emulator
+        behavior = emu.behaviors[service]
+        with emu._lock:
+            delay = behavior.delay(emu._random)
+            outcome = behavior.outcome(emu._random)
+            emu.counts[service] = emu.counts.get(service, 0) + 1
+        if not authorized:
+            return self._error(401, 'Access denied due to invalid subscription key.')
+        if delay:
+            time.sleep(delay)
+        if outcome == 429:
+            return self._error(429, 'Rate limit is exceeded.', [('Retry-After', str(behavior.retry_after))])
+        if outcome == 500:
+            return self._error(500, 'Internal server error.')
+        respond()
+
+    def do_POST(self):
+        url = parse.urlsplit(self.path)
+        body = self._read_body()
+        emu = self.server.emulator
+
+        if url.path == '/token/issueToken':
+            form = parse.parse_qs(body.decode('utf-8'))
+            key = (form.get('client_secret') or [None])[0]
+            self._handle('token', lambda: self._send(200, {
+                'access_token': 'emulated-token', 'token_type': 'jwt', 'expires_in': str(emu.token_lifetime),
+            }), self._key_ok(key))
+        elif url.path == '/synthesize':
+            m = _SSML_TEXT_RE.search(body.decode('utf-8', 'replace'))
+            text = m.group(1) if m else ''
+            seconds = min(10.0, 0.1 + 0.06 * len(text))
+            self._handle('synthesize', lambda: self._send(200, _make_pcm_wav(seconds), 'audio/wav'),
+                         self._token_ok())
+        elif url.path == '/recognize':
+            try:
+                open_wav(body).close()
+            except WavError as ex:
+                return self._error(400, 'Invalid audio: {}.'.format(ex))
+            self._handle('recognize', lambda: self._send(200, emu.recognition_result()), self._token_ok())
+        elif url.path == '/emotion/v1.0/recognize':
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                data = json.loads(body.decode('utf-8')).get('url', '').encode('utf-8')
+            else:
+                data = body
+            rects = (parse.parse_qs(url.query).get('faceRectangles') or [None])[0]
+            if rects is None and emu.face_rectangles is not None:
+                rects = ';'.join('{left},{top},{width},{height}'.format(**r) for r in emu.face_rectangles)
+            self._handle('emotion', lambda: self._send(200, _faces_for(data, rects=rects)),
+                         self._key_ok(self.headers.get('Ocp-Apim-Subscription-Key')))
+        elif url.path == '/emotion/v1.0/recognizeinvideo':
+            if self.headers.get('Content-Type', '').startswith('application/json'):
+                data = json.loads(body.decode('utf-8')).get('url', '').encode('utf-8')
+            else:
+                data = body
+            key = self.headers.get('Ocp-Apim-Subscription-Key')
+            style = (parse.parse_qs(url.query).get('outputStyle') or ['aggregate'])[0]
+
+            def accept():
+                operation_id = emu._start_operation(key, data, style)
+                self._send(202, b'', headers=[
+                    ('Operation-Location', '{}/emotion/v1.0/operations/{}'.format(emu.url, operation_id)),
+                ])
+            self._handle('video', accept, self._key_ok(key))
+        else:
+            self._error(404, 'Resource not found.')
+
+    def do_GET(self):
+        url = parse.urlsplit(self.path)
+        query = parse.parse_qs(url.query)
+        emu = self.server.emulator
+        if url.path == '/luis/v1/application':
+            text = (query.get('q') or [''])[0]
+            key = (query.get('subscription-key') or [None])[0]
+            self._handle('luis', lambda: self._send(200, emu.luis_result(text)), self._key_ok(key))
+        elif url.path.startswith('/emotion/v1.0/operations/'):
+            key = self.headers.get('Ocp-Apim-Subscription-Key')
+            status = emu.operation_status(url.path.rpartition('/')[2], key)
+            if status is None:
+                return self._error(404, 'Operation not found.')
+            self._handle('video_status', lambda: self._send(200, status), self._key_ok(key))
+        else:
+            self._error(404, 'Resource not found.')
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    request_queue_size = 256
+
+class Emulator(object):
+    '''A local stand-in for the speech, emotion and LUIS services.
+
+    Emulator(host='127.0.0.1', port=0, keys=None, seed=None, **behavior)
+
+    host, port:
+        The address to listen on. If `port` is zero, an unused port is
+        selected.
+    keys:
+        A collection of subscription keys to accept. If omitted, every
+        key is accepted.
+    seed:
+        Seed for the random number generator used for latencies and
+        failures.
+    behavior:
+        Arguments for a `Behavior` applied to every endpoint. Set
+        ``emulator.behaviors[name]`` to configure one of ``'token'``,
+        ``'synthesize'``, ``'recognize'``, ``'emotion'``, ``'video'``,
+        ``'video_status'`` or ``'luis'`` separately.
+
+    Set `face_rectangles` to a list of dictionaries with ``left``,
+    ``top``, ``width`` and ``height`` to return faces at those positions
+    in every image, rather than at random positions.
+
+    Videos submitted for recognition complete `video_seconds` after
+    they are submitted. Operations are kept in memory, so a stopped
+    emulator can be started again without losing them.
+
+    The emulator is started by `start` or by entering a ``with``
+    block, and stopped by `stop` or at the end of the block.
+    '''
+
+    SERVICES = ('token', 'synthesize', 'recognize', 'emotion', 'video', 'video_status', 'luis')
+
+    def __init__(self, host='127.0.0.1', port=0, keys=None, seed=None, **behavior):
+        self.host = host
+        self.port = port
+        self.keys = None if keys is None else set(keys)
+        self.behaviors = {s: Behavior(**behavior) for s in self.SERVICES}
+        self.token_lifetime = 600
+        self.transcript = 'hello world'
+        self.intents = {}
+        self.face_rectangles = None
+        self.video_seconds = 2.0
+        self.counts = {}
+        self._operations = {}
+        self.verbose = False
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    @property
+    def url(self):
+        '''The base URL of the running emulator.'''
+        return 'http://{}:{}'.format(self.host, self.port)
+
+    def start(self):
+        '''Starts the emulator on a background thread.'''
+        self._server = _Server((self.host, self.port), _Handler)
+        self._server.emulator = self
+        self.port = self._server.server_address[1]
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        '''Stops a running emulator.'''
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def speech_args(self):
+        '''Returns keyword arguments for `SpeechClient` that direct it
+        to this emulator.
+        '''
+        return {'endpoint': self.url, 'token_endpoint': self.url + '/token/issueToken'}
+
+    def emotion_args(self):
+        '''Returns keyword arguments for `EmotionClient` that direct it
+        to this emulator.
+        '''
+        return {'endpoint': self.url + '/emotion/v1.0/recognize',
+                'video_endpoint': self.url + '/emotion/v1.0/recognizeinvideo'}
+
+    def luis_url(self, app_id='emulated', key='key'):
+        '''Returns a LUIS URL for `LuisClient` that directs it to this
+        emulator.
+        '''
+        return '{}/luis/v1/application?id={}&subscription-key={}&q='.format(self.url, app_id, key)
+
+    def recognition_result(self):
+        '''Returns the response to a recognition request. By default,
+        the best hypothesis is `transcript` with high confidence,
+        followed by two less likely alternatives.
+        '''
+        words = self.transcript.split()
+        alternatives = [self.transcript, ' '.join(reversed(words)), ' '.join(words[:-1]) or self.transcript]
+        return {
+            'version': '3.0',
+            'header': {'status': 'success', 'name': self.transcript, 'lexical': self.transcript,
+                       'properties': {'requestid': 'emulated', 'HIGHCONF': '1'}},
+            'results': [{
+                'scenario': 'ulm',
+                'name': name,
+                'lexical': name,
+                'confidence': str(round(0.9 - 0.3 * i, 2)),
+                'properties': {'HIGHCONF': '1'} if i == 0 else {'LOWCONF': '1'},
+            } for i, name in enumerate(alternatives)],
+        }
+
+    def _start_operation(self, key, data, style):
+        with self._lock:
+            operation_id = '{:08x}'.format(len(self._operations) + 1)
+            self._operations[operation_id] = (key, time.monotonic(), hashlib.sha256(data).digest(), style)
+        return operation_id
+
+    def operation_status(self, operation_id, key):
+        '''Returns the status of a video recognition operation, or
+        ``None`` if it does not exist or was submitted with another key.
+        '''
+        with self._lock:
+            operation = self._operations.get(operation_id)
+        if operation is None or operation[0] != key:
+            return None
+        _, started, digest, style = operation
+        progress = (time.monotonic() - started) / self.video_seconds if self.video_seconds else 1.0
+        if progress < 1.0:
+            return {'status': 'Running', 'progress': round(progress * 100, 1),
+                    'createdDateTime': '', 'lastActionDateTime': ''}
+
+        fragments = []
+        for start in range(0, 4):
+            faces = _faces_for(digest + bytes([start]))
+            if style == 'aggregate':
+                events = [[{
+                    'windowFaceDistribution': {e: sum(1 for f in faces if max(f['scores'], key=f['scores'].get) == e)
+                                               / max(1, len(faces)) for e in _EMOTIONS},
+                    'windowMeanScores': {e: sum(f['scores'][e] for f in faces) / max(1, len(faces)) for e in _EMOTIONS},
+                }]]
+            else:
+                events = [[{'id': i, 'scores': f['scores']} for i, f in enumerate(faces)]]
+            fragments.append({'start': start * 30000, 'duration': 30000, 'interval': 30000, 'events': events})
+        result = {'version': 1, 'timescale': 30000, 'offset': 0, 'framerate': 30,
+                  'width': 640, 'height': 480, 'fragments': fragments}
+        return {'status': 'Succeeded', 'progress': 100.0, 'createdDateTime': '', 'lastActionDateTime': '',
+                'processingResult': json.dumps(result)}
+
+    def luis_result(self, text):
+        '''Returns the response to a LUIS query. The intent is the first
+        value in `intents` whose key is a word in `text`, or ``'None'``.
+        '''
+        words = re.findall(r'\w+', text.lower())
+        intent, score = 'None', 0.5
+        for word in words:
+            if word in self.intents:
+                intent, score = self.intents[word], 0.95
+                break
+        return {
+            'query': text,
+            'intents': [{'intent': intent, 'score': score}, {'intent': 'None', 'score': 1 - score}],
+            'entities': [{'entity': w, 'type': 'Word', 'startIndex': 0, 'endIndex': len(w) - 1, 'score': 0.8}
+                         for w in words if len(w) > 6],
+        }
+
+def generate_load(fn, qps, duration=10.0, max_workers=32):
+    '''Calls `fn(i)` at a rate of `qps` calls per second for `duration`
+    seconds and returns a dict describing the results.
+
+    Latency is measured from the time each call was scheduled, so
+    calls that are delayed because every worker is busy include the
+    time they spent waiting.
+
+    The result includes ``requests``, ``errors``, ``throughput`` (in
+    successful calls per second) and the ``p50``, ``p95``, ``p99`` and
+    ``max`` latencies in seconds.
+    '''
+    total = max(1, int(qps * duration))
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+
+    def call(i, scheduled):
+        try:
+            fn(i)
+        except Exception as ex:
+            with lock:
+                errors.append(ex)
+            return
+        elapsed = time.perf_counter() - scheduled
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for i in range(total):
+            scheduled = start + i / qps
+            wait = scheduled - time.perf_counter()
+            if wait > 0:
+                time.sleep(wait)
+            pool.submit(call, i, scheduled)
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    def pct(p):
+        if not latencies:
+            return None
+        return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+
+    error_types = {}
+    for ex in errors:
+        name = type(ex).__name__
+        error_types[name] = error_types.get(name, 0) + 1
+
+    return {
+        'target_qps': qps,
+        'requests': total,
+        'errors': len(errors),
+        'error_types': error_types,
+        'duration': elapsed,
+        'throughput': len(latencies) / elapsed,
+        'p50': pct(0.50),
+        'p95': pct(0.95),
+        'p99': pct(0.99),
+        'max': latencies[-1] if latencies else None,
+    }
+
+def _load_target(service, emu):
+    from projectoxford.emotion import EmotionClient
+    from projectoxford.luis import LuisClient
+    from projectoxford.speech import SpeechClient
+
+    if service == 'luis':
+        lc = LuisClient(emu.luis_url())
+        return lambda i: lc.query_raw('utterance {}'.format(i % 100))
+    if service == 'emotion':
+        ec = EmotionClient('key', **emu.emotion_args())
+        image = os.urandom(16 * 1024)
+        return lambda i: ec.process_image(image, max_side=None)
+    sc = SpeechClient('key', **emu.speech_args())
+    if service == 'synthesize':
+        return lambda i: sc.say_to_wav('Hello number {}'.format(i))
+    if service == 'recognize':
+        wav = _make_pcm_wav(1.0)
+        return lambda i: sc.recognize_raw(wav)
+    raise ValueError('unknown service: ' + service)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m projectoxford.emulator', description=__doc__.partition('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.0, help='median response time in seconds')
+    parser.add_argument('--jitter', type=float, default=0.0, help='sigma of the log-normal latency distribution')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='fraction of requests that return 500')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction of requests that return 429')
+    parser.add_argument('--load', choices=('synthesize', 'recognize', 'emotion', 'luis'),
+                        help='drive a client against the emulator and print a report')
+    parser.add_argument('--qps', type=float, default=20.0, help='target calls per second for --load')
+    parser.add_argument('--duration', type=float, default=10.0, help='seconds to run --load for')
+    parser.add_argument('--workers', type=int, default=32, help='maximum concurrent calls for --load')
+    parser.add_argument('--verbose', '-v', action='store_true', help='log every request')
+    args = parser.parse_args(argv)
+
+    emu = Emulator(args.host, args.port, latency=args.latency, jitter=args.jitter,
+                   failure_rate=args.failure_rate, throttle_rate=args.throttle_rate)
+    emu.verbose = args.verbose
+    if not args.load:
+        emu.start()
+        print('Emulating Project Oxford services at', emu.url)
+        print('Press Ctrl+C to stop.')
+        try:
+            while True:
+                time.sleep(3600)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            emu.stop()
+        return
+
+    with emu:
+        report = generate_load(_load_target(args.load, emu), args.qps, args.duration, args.workers)
+    report['service'] = args.load
+    json.dump(report, sys.stdout, indent=2)
+    print()
+
+if __name__ == '__main__':
+    main()
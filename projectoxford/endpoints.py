@@ -1 +1,4 @@
+SPEECH_ENDPOINT = 'https://speech.platform.bing.com'
+SPEECH_TOKEN_ENDPOINT = 'https://oxford-speech.cloudapp.net/token/issueToken'
 EMOTION_ENDPOINT = 'https://api.projectoxford.ai/emotion/v1.0/recognize'
+EMOTION_VIDEO_ENDPOINT = 'https://api.projectoxford.ai/emotion/v1.0/recognizeinvideo'
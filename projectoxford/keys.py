@@ -0,0 +1,204 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Subscription Key Pools
+
+This module allows clients to spread their requests across multiple
+subscription keys (or complete endpoint URLs, in the case of LUIS).
+Keys that are rejected or throttled by the service are temporarily
+ejected from the pool, so that adding keys increases the available
+throughput.
+'''
+
+import collections
+import threading
+import time
+
+__all__ = ['KeyPool']
+
+class _KeyState(object):
+    __slots__ = ('key', 'token', 'token_expires', 'inflight', 'calls',
+                 'ejected_until', 'last_used')
+
+    def __init__(self, key):
+        self.key = key
+        self.token = None
+        self.token_expires = None
+        self.inflight = 0
+        self.calls = collections.deque()
+        self.ejected_until = 0
+        self.last_used = 0
+
+class KeyPool(object):
+    '''A pool of subscription keys or endpoints shared by a client.
+
+    KeyPool(keys, quota=None, period=1.0, eject_seconds=60.0)
+
+    keys:
+        A sequence of subscription keys or endpoint URLs.
+    quota:
+        The number of calls each key may make every `period` seconds.
+        If omitted, keys are selected by the number of calls that are
+        currently in progress.
+    period:
+        The length of the quota window in seconds.
+    eject_seconds:
+        The number of seconds a key is removed from the pool after the
+        service rejects it. Throttled keys are removed for the number
+        of seconds requested by the service, if any.
+    '''
+
+    def __init__(self, keys, quota=None, period=1.0, eject_seconds=60.0):
+        if isinstance(keys, str):
+            keys = [keys]
+        keys = list(keys)
+        if not keys:
+            raise ValueError('at least one key is required')
+        self.quota = quota
+        self.period = period
+        self.eject_seconds = eject_seconds
+        self._states = collections.OrderedDict((k, _KeyState(k)) for k in keys)
+        self._lock = threading.Condition()
+
+    @classmethod
+    def coerce(cls, keys):
+        '''Returns `keys` if it is already a `KeyPool`, or a new pool
+        containing the key or sequence of keys.
+        '''
+        if isinstance(keys, cls):
+            return keys
+        return cls(keys)
+
+    def __len__(self):
+        return len(self._states)
+
+    def __iter__(self):
+        return iter(self._states)
+
+    def __repr__(self):
+        return '<KeyPool of {} keys, {} healthy>'.format(len(self), len(self.healthy()))
+
+    def state(self, key):
+        '''Returns the internal state object for `key`. Clients use
+        this to cache per-key values such as authorization tokens.
+        '''
+        return self._states[key]
+
+    def healthy(self):
+        '''Returns a list of keys that are not currently ejected.'''
+        now = time.monotonic()
+        with self._lock:
+            return [s.key for s in self._states.values() if s.ejected_until <= now]
+
+    def _remaining(self, s, now):
+        while s.calls and s.calls[0] <= now - self.period:
+            s.calls.popleft()
+        if self.quota is None:
+            return -s.inflight
+        return self.quota - len(s.calls) - s.inflight
+
+    def acquire(self, timeout=None):
+        '''Selects the healthy key with the most remaining quota and
+        marks it as in use. Every call to `acquire` must be matched by
+        a call to `release`.
+
+        If every key has been ejected or has exhausted its quota, this
+        function blocks until one becomes available. If `timeout`
+        seconds elapse first, `RuntimeError` is raised.
+        '''
+        end = None if timeout is None else time.monotonic() + timeout
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                best, best_remaining = None, None
+                wake = None
+                for s in self._states.values():
+                    if s.ejected_until > now:
+                        wake = min(wake or s.ejected_until, s.ejected_until)
+                        continue
+                    remaining = self._remaining(s, now)
+                    if self.quota is not None and remaining <= 0:
+                        if s.calls:
+                            t = s.calls[0] + self.period
+                            wake = min(wake or t, t)
+                        continue
+                    if (best is None or remaining > best_remaining or
+                        (remaining == best_remaining and s.last_used < best.last_used)):
+                        best, best_remaining = s, remaining
+                if best is not None:
+                    best.inflight += 1
+                    best.calls.append(now)
+                    best.last_used = now
+                    return best.key
+
+                if end is not None:
+                    if now >= end:
+                        raise RuntimeError('no subscription key available')
+                    wake = min(wake or end, end)
+                self._lock.wait(None if wake is None else max(0, wake - now))
+
+    def release(self, key, status_code=None, retry_after=None):
+        '''Marks a key previously returned from `acquire` as no longer
+        in use.
+
+        status_code:
+            The HTTP status returned by the service, if any. Keys that
+            receive 429 responses are ejected from the pool. Keys that
+            receive 401 or 403 responses are ejected unless no other
+            key is available.
+        retry_after:
+            The number of seconds the service requested before the key
+            is used again. Overrides `eject_seconds` for this key.
+
+        Returns ``True`` if the key was ejected, in which case the
+        request may be retried with another key.
+        '''
+        with self._lock:
+            s = self._states[key]
+            s.inflight = max(0, s.inflight - 1)
+            ejected = False
+            if status_code == 429:
+                seconds = min(1.0, self.eject_seconds) if retry_after is None else retry_after
+                s.ejected_until = time.monotonic() + seconds
+                ejected = True
+            elif status_code in (401, 403):
+                ejected = self._eject_rejected(s, retry_after)
+            self._lock.notify_all()
+            return ejected
+
+    def _eject_rejected(self, s, seconds=None):
+        # A rejected key is only ejected while another key remains, so
+        # that a pool of invalid keys fails quickly rather than waiting
+        # for them to return.
+        now = time.monotonic()
+        if not any(o.ejected_until <= now for o in self._states.values() if o is not s):
+            return False
+        s.ejected_until = now + (self.eject_seconds if seconds is None else seconds)
+        return True
+
+    def eject(self, key, seconds=None):
+        '''Removes `key` from the pool for `seconds`, or for the
+        default `eject_seconds`, unless it is the only available key.
+
+        Returns ``True`` if the key was ejected.
+        '''
+        with self._lock:
+            return self._eject_rejected(self._states[key], seconds)
+
+    def restore(self, key):
+        '''Returns an ejected key to the pool immediately.'''
+        with self._lock:
+            self._states[key].ejected_until = 0
+            self._lock.notify_all()
+
+def _retry_after(response):
+    '''Returns the number of seconds in a response's Retry-After header,
+    or ``None`` if it is missing or not a number.
+    '''
+    try:
+        return float(response.headers['Retry-After'])
+    except (LookupError, TypeError, ValueError):
+        return None
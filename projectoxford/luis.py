@@ -13,25 +13,254 @@ See https://www.projectoxford.ai/luis to start using LUIS and create a
 deployed web service.
 '''
 
+import collections
+import itertools
+import json
+import re
 import requests
-import time
+import threading
+import concurrent.futures
 import urllib.parse as parse
 
+from projectoxford import _http, metrics
+from projectoxford.results import LuisResult
+from projectoxford.batch import BatchResult, imap_unordered
+from projectoxford.cache import SingleFlight, TTLCache
+from projectoxford.keys import KeyPool, _retry_after
+
+_SUBSCRIPTION_KEY_RE = re.compile(r'(?<=[?&]subscription-key=)[^&]*')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+def normalize_text(text):
+    '''Returns `text` in the form used to identify repeated queries:
+    lowercase, with surrounding whitespace and punctuation removed and
+    internal whitespace collapsed.
+    '''
+    return _WHITESPACE_RE.sub(' ', text.lower()).strip(' .,!?;:\'"')
+
+_WORD_RE = re.compile(r'\w+')
+
+# Features shared by more utterances than this are only used to find
+# candidates when a query has no rarer feature
+_MAX_POSTINGS = 1000
+# The maximum number of utterances compared with each query
+_MAX_CANDIDATES = 2000
+
+def _features(text):
+    '''Returns the set of words, word pairs and character trigrams in
+    normalized text.
+    '''
+    words = _WORD_RE.findall(text)
+    features = set(words)
+    features.update(a + ' ' + b for a, b in zip(words, words[1:]))
+    padded = ' ' + text + ' '
+    features.update('#' + padded[i:i + 3] for i in range(len(padded) - 2))
+    return features
+
+class IntentIndex(object):
+    '''A local nearest-neighbour index of utterances previously resolved
+    by LUIS, used to answer repeated or similar queries without calling
+    the service.
+
+    IntentIndex(max_entries=100000)
+
+    Utterances are compared by the overlap of their words, word pairs
+    and character trigrams. Candidates are found through the query's
+    rarest features, so features common to many utterances do not make
+    each lookup scan the whole index. Add responses with `add` or `add_response`,
+    find the closest utterance with `lookup`, and persist the index
+    with `save` and `load`.
+
+    max_entries:
+        The maximum number of utterances to retain. When exceeded, the
+        oldest utterances are removed.
+    '''
+
+    def __init__(self, max_entries=100000):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._postings = collections.defaultdict(set)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __repr__(self):
+        return '<IntentIndex of {} utterances>'.format(len(self))
+
+    def add(self, text, response):
+        '''Adds or replaces the utterance `text` with the top intent and
+        the entities from a `LuisClient.query_raw` response, which may
+        be a dict or a `projectoxford.results.LuisResult`.
+
+        Responses without an intent are ignored.
+        '''
+        if isinstance(response, LuisResult):
+            intent = response.intent
+            if intent is None:
+                return
+            entities = [(e.text, e.type) for e in response.entities]
+        else:
+            try:
+                intent = response['intents'][0]['intent']
+            except LookupError:
+                return
+            entities = [(e['entity'], e['type']) for e in response.get('entities', ())]
+        key = normalize_text(text)
+        features = _features(key)
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (intent, entities, features)
+            for f in features:
+                self._postings[f].add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def add_response(self, response):
+        '''Adds a `LuisClient.query_raw` response using its ``query``
+        as the utterance.
+        '''
+        if isinstance(response, LuisResult):
+            self.add(response.query, response)
+        else:
+            self.add(response['query'], response)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        for f in entry[2]:
+            postings = self._postings[f]
+            postings.discard(key)
+            if not postings:
+                del self._postings[f]
+
+    def lookup(self, text):
+        '''Returns a tuple containing the similarity between 0 and 1,
+        the intent, a list of entities and a list of each entity's type
+        for the utterance closest to `text`, or ``None`` if no utterance
+        shares any features with it.
+        '''
+        key = normalize_text(text)
+        features = _features(key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                intent, entities = entry[0], entry[1]
+                return 1.0, intent, [e[0] for e in entities], [e[1] for e in entities]
+
+            postings = sorted((self._postings[f] for f in features if f in self._postings), key=len)
+            candidates = {}
+            for i, keys in enumerate(postings):
+                if i and len(keys) > _MAX_POSTINGS:
+                    break
+                for candidate in itertools.islice(keys, _MAX_CANDIDATES - len(candidates)):
+                    candidates[candidate] = self._entries[candidate]
+                if len(candidates) >= _MAX_CANDIDATES:
+                    break
+
+        # Entries are never modified once added, so they are scored
+        # without holding the lock
+        if not candidates:
+            return None
+        best, best_score = None, 0.0
+        for entry in candidates.values():
+            other = entry[2]
+            shared = len(features & other)
+            score = shared / (len(features) + len(other) - shared)
+            if score > best_score:
+                best, best_score = entry, score
+        intent, entities, _ = best
+
+        return best_score, intent, [e[0] for e in entities], [e[1] for e in entities]
+
+    def save(self, path):
+        '''Writes the index to the file at `path` as JSON.'''
+        with self._lock:
+            data = [{'text': k, 'intent': v[0], 'entities': v[1]} for k, v in self._entries.items()]
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': 1, 'max_entries': self.max_entries, 'utterances': data}, f)
+
+    @classmethod
+    def load(cls, path):
+        '''Returns an index read from a file previously written by
+        `save`.
+        '''
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        index = cls(data.get('max_entries', 100000))
+        for u in data['utterances']:
+            index.add(u['text'], {
+                'intents': [{'intent': u['intent']}],
+                'entities': [{'entity': e, 'type': t} for e, t in u['entities']],
+            })
+        return index
+
 class LuisClient(object):
     '''Provides access to a Project Oxford LUIS web service.
 
-    LuisClient(url)
+    LuisClient(url, keys=None, timeout=None, hedge=None, cache=None, session=None,
+               intent_index=None, index_threshold=0.9)
 
     url:
         The URL provided by LUIS for your service. This URL must be
-        complete, including the trailing ``&q=``.
+        complete, including the trailing ``&q=``. To spread requests
+        across multiple endpoints, pass a sequence of URLs or a
+        `projectoxford.keys.KeyPool` of URLs.
+    keys:
+        An optional sequence of subscription keys. Each key replaces
+        the ``subscription-key`` in `url` to create a pool of
+        endpoints.
+    timeout:
+        The default number of seconds allowed for each query, including
+        any retries. This value can be overridden on individual calls.
+    hedge:
+        If ``True`` or a percentile between 0 and 1, queries that take
+        longer than that fraction of recent queries are sent again and
+        the first response is used.
+    cache:
+        If ``True`` or a `projectoxford.cache.TTLCache`, responses are
+        cached by their normalized text and identical queries made
+        while one is in progress share its response. ``True`` caches
+        up to 4096 responses for five minutes.
+    session:
+        A `requests.Session` to send queries with. If omitted, the
+        client creates its own so that connections are reused.
+    intent_index:
+        An `IntentIndex` that is updated with every response from the
+        service and consulted by `query` before calling the service.
+    index_threshold:
+        The similarity required for `query` to answer from
+        `intent_index` rather than calling the service.
     '''
-    def __init__(self, url):
-        self.url = url
-        if not url.endswith('&q='):
-            raise ValueError('url is expected to end with "&q="')
+    def __init__(self, url, keys=None, timeout=None, hedge=None, cache=None, session=None,
+                 intent_index=None, index_threshold=0.9):
+        if isinstance(url, KeyPool):
+            urls = list(url)
+        elif isinstance(url, str):
+            urls = [url]
+        else:
+            urls = list(url)
+        if keys:
+            if len(urls) != 1 or not _SUBSCRIPTION_KEY_RE.search(urls[0]):
+                raise ValueError('keys may only be used with a single url containing "subscription-key="')
+            urls = [_SUBSCRIPTION_KEY_RE.sub(lambda m, k=k: k, urls[0]) for k in keys]
+        for u in urls:
+            if not u.endswith('&q='):
+                raise ValueError('url is expected to end with "&q="')
+        self.url = urls[0]
+        self.urls = url if isinstance(url, KeyPool) and not keys else KeyPool(urls)
+        self.timeout = timeout
+        self._hedge = _http.Hedge.coerce(hedge)
+        if cache is True:
+            cache = TTLCache(maxsize=4096, ttl=300)
+        self.cache = cache if cache is not False else None
+        self._flights = SingleFlight()
+        self.session = session or _http.new_session()
+        self.intent_index = intent_index
+        self.index_threshold = index_threshold
 
-    def query_raw(self, text):
+    def query_raw(self, text, timeout=None, typed=False):
         '''Queries the LUIS web service with the provided text and
         returns the complete response JSON as a dict.
 
@@ -39,26 +268,234 @@ class LuisClient(object):
 
         text:
             The text to submit (maximum 500 characters).
+        timeout:
+            The number of seconds allowed for the query, including any
+            retries. If omitted, uses the default for this client.
+            `requests.Timeout` is raised if the query does not complete
+            in time.
+        typed:
+            If True, returns a `projectoxford.results.LuisResult`
+            that is only decoded when its intents or entities are used.
         '''
-        r = requests.get(self.url + parse.quote(text))
-        r.raise_for_status()
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+        with metrics.start('luis.query') as span:
+            if self.cache is None:
+                r = self._query(text, deadline, span)
+            else:
+                key = normalize_text(text)
+                r = self.cache.get(key)
+                if r is None:
+                    try:
+                        r = self._flights.do(key, lambda: self._query_and_cache(key, text, deadline, span),
+                                             deadline.remaining())
+                    except TimeoutError:
+                        raise requests.Timeout('deadline exceeded')
+                else:
+                    span.count('cache_hits')
+
+            if typed:
+                return r
+            # Results are stored encoded, so every caller receives its
+            # own copy of the response
+            with span.phase('parse'):
+                return r.to_dict()
 
-        return r.json()
+    def _query_and_cache(self, key, text, deadline, span):
+        r = self._query(text, deadline, span)
+        self.cache.put(key, r)
+        return r
+
+    def _query(self, text, deadline, span=metrics.NULL_SPAN):
+        if self._hedge:
+            r = self._hedge.call(lambda: self._get(text, deadline, span), deadline)
+        else:
+            r = self._get(text, deadline, span)
+        if self.intent_index is not None:
+            self.intent_index.add(text, r)
+        return r
+
+    def _get(self, text, deadline, span=metrics.NULL_SPAN):
+        q = parse.quote(text)
+        attempts = 0
+        while True:
+            url, r = _http.acquire(self.urls, deadline), None
+            try:
+                r = _http.request('GET', url + q, deadline, span, session=self.session)
+            finally:
+                if r is None:
+                    self.urls.release(url)
+                else:
+                    ejected = self.urls.release(url, r.status_code, _retry_after(r))
+            if ejected and attempts < len(self.urls):
+                attempts += 1
+                span.count('retries')
+                continue
+            break
+        r.raise_for_status()
+        return LuisResult(r.content)
 
     def query(self, text):
         '''Queries the LUIS web service with the provided text and
         returns a 3-tuple containing the intent, a list of recognized
         entities, and a list of each entity's type.
 
+        If the client has an `intent_index` containing a sufficiently
+        similar utterance whose entities all appear in `text`, the
+        result is returned without calling the service.
+
         text:
             The text to submit (maximum 500 characters).
         '''
-        r = self.query_raw(text)
-        try:
-            intent = r['intents'][0]['intent']
-        except LookupError:
+        if self.intent_index is not None:
+            match = self.intent_index.lookup(text)
+            if match and match[0] >= self.index_threshold:
+                score, intent, names, types = match
+                normalized = normalize_text(text)
+                if all(normalize_text(n) in normalized for n in names):
+                    with metrics.start('luis.query') as span:
+                        span.count('cache_hits')
+                    return intent, names, types
+
+        r = self.query_raw(text, typed=True)
+        if r.intent is None:
             raise ValueError('cannot determine intent')
 
-        names = [e['entity'] for e in r['entities']]
-        types = [e['type'] for e in r['entities']]
-        return intent, names, types
+        names = [e.text for e in r.entities]
+        types = [e.type for e in r.entities]
+        return r.intent, names, types
+
+    def query_many(self, texts, max_workers=8, timeout=None):
+        '''Queries the LUIS web service with each of the provided texts
+        concurrently and returns a list of
+        `projectoxford.batch.BatchResult` in the same order as `texts`.
+
+        Each result's `result` contains the complete response JSON as a
+        dict, or its `error` contains the exception raised by that
+        query. Identical texts are only submitted once.
+
+        texts:
+            An iterable of texts to submit (maximum 500 characters
+            each).
+        max_workers:
+            The maximum number of queries in progress at once.
+        timeout:
+            The number of seconds allowed for each query. If omitted,
+            uses the default for this client.
+        '''
+        texts = list(texts)
+        unique = list(collections.OrderedDict.fromkeys(texts))
+        responses = {}
+        for r in imap_unordered(lambda text: self.query_raw(text, timeout, typed=True), unique, max_workers):
+            responses[r.item] = r
+
+        results = []
+        for i, text in enumerate(texts):
+            r = responses[text]
+            result = None if r.result is None else r.result.to_dict()
+            results.append(BatchResult(i, text, result, r.error))
+        return results
+
+Understanding = collections.namedtuple('Understanding', 'text level intent score result recognition')
+Understanding.__doc__ = '''The outcome of `understand`.
+
+text:
+    The recognized text that was chosen.
+level:
+    The recognition confidence of `text`: ``'high'``, ``'mid'``,
+    ``'low'`` or ``None``.
+intent:
+    The name of the most likely intent for `text`.
+score:
+    The score of `intent` between 0 and 1, or ``None``.
+result:
+    The `projectoxford.results.LuisResult` for `text`.
+recognition:
+    The `projectoxford.results.Recognition` containing every
+    hypothesis.
+'''
+
+def understand(speech, luis, wav=None, locale=None, n_best=3, timeout=None):
+    '''Recognizes speech and returns the intent of the hypothesis that
+    LUIS scores most highly, as an `Understanding`.
+
+    The `n_best` most likely hypotheses are queried concurrently, so
+    the call takes one recognition and one round of LUIS queries. A
+    hypothesis that was not heard with high confidence is still used
+    if its intent is the clearest, rather than asking again.
+
+    speech:
+        A `projectoxford.speech.SpeechClient`.
+    luis:
+        A `LuisClient`. Create both clients with the same `session` to
+        share one connection pool.
+    wav:
+        The audio to recognize, as accepted by
+        `projectoxford.speech.SpeechClient.recognize_raw`. If omitted,
+        a beep is played and the user's default microphone records up
+        to 30 seconds of audio.
+    locale:
+        The locale to recognize. If omitted, uses the default for
+        `speech`.
+    n_best:
+        The maximum number of hypotheses to query.
+    timeout:
+        The number of seconds allowed for recognition and every query.
+        If omitted, uses the default for `speech`.
+
+    Hypotheses whose most likely intent is ``'None'`` are only chosen
+    when no other hypothesis has an intent. Ties are resolved in favour
+    of the more likely hypothesis. Queries that fail are ignored unless
+    every query fails, in which case the first error is raised.
+    '''
+    if not wav:
+        wav = speech._record()
+    deadline = _http.Deadline(speech.timeout if timeout is None else timeout)
+    recognition = speech.recognize_raw(wav, locale, deadline.remaining(), typed=True)
+    hypotheses = [h for h in recognition.hypotheses if h.text][:n_best]
+    if not hypotheses:
+        raise ValueError('unable to recognize speech')
+
+    texts = list(collections.OrderedDict.fromkeys(h.text for h in hypotheses))
+    # The shared executor is not used, because hedged queries submit
+    # their attempts to it and could wait on each other
+    executor = concurrent.futures.ThreadPoolExecutor(max(1, len(texts) - 1))
+    try:
+        futures = [executor.submit(luis.query_raw, text, deadline.remaining(), True) for text in texts[1:]]
+        # The most likely hypothesis is queried on this thread
+        responses = {}
+        try:
+            responses[texts[0]] = luis.query_raw(texts[0], deadline.remaining(), True)
+            first_error = None
+        except Exception as ex:
+            first_error = ex
+        concurrent.futures.wait(futures, deadline.remaining())
+    finally:
+        executor.shutdown(wait=False)
+    for text, f in zip(texts[1:], futures):
+        if not f.done():
+            f.cancel()
+        elif f.exception() is None:
+            responses[text] = f.result()
+        elif first_error is None:
+            first_error = f.exception()
+    if not responses:
+        raise first_error or requests.Timeout('deadline exceeded')
+
+    def rank(i):
+        r = responses.get(hypotheses[i].text)
+        top = r.intents[0] if r is not None and r.intents else None
+        if top is None:
+            return (False, False, 0, -i)
+        return (True, top.name != 'None', top.score or 0, -i)
+
+    best = hypotheses[max(range(len(hypotheses)), key=rank)]
+    r = responses[best.text]
+    top = r.intents[0] if r.intents else None
+    return Understanding(
+        best.text,
+        best.level,
+        top and top.name,
+        top and top.score,
+        r,
+        recognition,
+    )
@@ -0,0 +1,262 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Metrics Module
+
+This module reports timing and volume information for every service
+call and audio operation made by this library.
+
+Register a callback with `add_hook` to receive a `Span` as each
+operation completes, or call `enable_prometheus` to aggregate spans
+into metrics in the Prometheus text format. When no hooks are
+registered, the library does not collect any information.
+
+Each span records the time spent in these phases, where applicable:
+
+token:
+    Obtaining an authorization token.
+wait:
+    Connecting, sending the request and waiting for the response
+    headers. These are not reported separately by the underlying
+    HTTP library.
+download:
+    Receiving the response body.
+parse:
+    Decoding the response.
+record, play:
+    Recording or playing audio.
+detect:
+    Detecting faces locally before calling the emotion service.
+
+And these counters, where applicable:
+
+bytes_sent, bytes_received:
+    Size of request and response bodies.
+retries:
+    Number of requests that were sent again.
+throttled:
+    Number of 429 responses received.
+cache_hits:
+    Number of results returned without contacting the service.
+skipped:
+    Number of images not sent because no faces were detected locally.
+truncated:
+    Number of mosaics sent again because the response may have been
+    truncated at the maximum number of faces.
+'''
+
+import sys
+import threading
+import time
+
+__all__ = ['Span', 'add_hook', 'remove_hook', 'start',
+           'PrometheusCollector', 'enable_prometheus']
+
+_hooks = []
+_hooks_lock = threading.Lock()
+
+def add_hook(callback):
+    '''Registers `callback` to be called with a `Span` whenever an
+    operation completes. Callbacks may be called from any thread and
+    should return quickly. Exceptions raised by callbacks are passed to
+    `sys.excepthook` rather than to the caller of the operation.
+    '''
+    global _hooks
+    with _hooks_lock:
+        _hooks = _hooks + [callback]
+
+def remove_hook(callback):
+    '''Unregisters a callback previously passed to `add_hook`.'''
+    global _hooks
+    with _hooks_lock:
+        _hooks = [h for h in _hooks if h != callback]
+
+class _Phase(object):
+    __slots__ = ('span', 'name', 'start')
+
+    def __init__(self, span, name):
+        self.span = span
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.span.add(self.name, time.perf_counter() - self.start)
+
+class Span(object):
+    '''Information about one completed operation.
+
+    operation:
+        The name of the operation, such as ``'speech.synthesize'``.
+    phases:
+        A dict mapping phase names to the total seconds spent in each.
+    counters:
+        A dict mapping counter names to their values.
+    duration:
+        The total number of seconds taken by the operation.
+    error:
+        The exception raised by the operation, if any.
+    '''
+    __slots__ = ('operation', 'phases', 'counters', 'duration', 'error',
+                 '_start', '_lock')
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.phases = {}
+        self.counters = {}
+        self.duration = None
+        self.error = None
+        self._start = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return '<Span {} {:.3f}s phases={} counters={}>'.format(
+            self.operation, self.duration or 0, self.phases, self.counters
+        )
+
+    def __bool__(self):
+        return True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, tb):
+        self.finish(exc_value)
+
+    def phase(self, name):
+        '''Returns a context manager that adds the time spent within it
+        to phase `name`.
+        '''
+        return _Phase(self, name)
+
+    def add(self, name, seconds):
+        '''Adds `seconds` to phase `name`.'''
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    def count(self, name, value=1):
+        '''Adds `value` to counter `name`.'''
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def finish(self, error=None):
+        '''Completes the operation and passes it to every hook.'''
+        self.duration = time.perf_counter() - self._start
+        self.error = error
+        for hook in _hooks:
+            try:
+                hook(self)
+            except Exception:
+                # Instrumentation must never change the outcome of the
+                # operation being measured
+                sys.excepthook(*sys.exc_info())
+
+class _NullSpan(object):
+    '''A span that discards everything, used when no hooks are
+    registered.
+    '''
+    __slots__ = ()
+
+    def __bool__(self):
+        return False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+    def phase(self, name):
+        return self
+
+    def add(self, name, seconds):
+        pass
+
+    def count(self, name, value=1):
+        pass
+
+    def finish(self, error=None):
+        pass
+
+NULL_SPAN = _NullSpan()
+
+def start(operation):
+    '''Returns a new `Span` for `operation`, or a span that discards
+    everything if no hooks are registered. The span should be used as
+    a context manager or explicitly finished.
+    '''
+    if not _hooks:
+        return NULL_SPAN
+    return Span(operation)
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class PrometheusCollector(object):
+    '''Aggregates spans into counters that can be exported in the
+    Prometheus text format.
+
+    Register an instance with `add_hook`, and call `export` to obtain
+    the current values.
+    '''
+
+    def __init__(self, prefix='projectoxford'):
+        self.prefix = prefix
+        self._lock = threading.Lock()
+        self._calls = {}
+        self._errors = {}
+        self._duration = {}
+        self._phases = {}
+        self._counters = {}
+
+    def __call__(self, span):
+        op = span.operation
+        with self._lock:
+            self._calls[op] = self._calls.get(op, 0) + 1
+            if span.error is not None:
+                self._errors[op] = self._errors.get(op, 0) + 1
+            self._duration[op] = self._duration.get(op, 0) + span.duration
+            for name, seconds in span.phases.items():
+                key = op, name
+                self._phases[key] = self._phases.get(key, 0) + seconds
+            for name, value in span.counters.items():
+                key = op, name
+                self._counters[key] = self._counters.get(key, 0) + value
+
+    def export(self):
+        '''Returns the current values in the Prometheus text format.'''
+        p = self.prefix
+        lines = []
+        with self._lock:
+            lines.append('# TYPE {}_calls_total counter'.format(p))
+            for op, n in sorted(self._calls.items()):
+                lines.append('{}_calls_total{{operation="{}"}} {}'.format(p, _escape(op), n))
+            lines.append('# TYPE {}_errors_total counter'.format(p))
+            for op, n in sorted(self._errors.items()):
+                lines.append('{}_errors_total{{operation="{}"}} {}'.format(p, _escape(op), n))
+            lines.append('# TYPE {}_duration_seconds_total counter'.format(p))
+            for op, n in sorted(self._duration.items()):
+                lines.append('{}_duration_seconds_total{{operation="{}"}} {:.6f}'.format(p, _escape(op), n))
+            lines.append('# TYPE {}_phase_seconds_total counter'.format(p))
+            for (op, name), n in sorted(self._phases.items()):
+                lines.append('{}_phase_seconds_total{{operation="{}",phase="{}"}} {:.6f}'.format(
+                    p, _escape(op), _escape(name), n
+                ))
+            names = sorted({name for _, name in self._counters})
+            for name in names:
+                lines.append('# TYPE {}_{}_total counter'.format(p, name))
+                for (op, n2), n in sorted(self._counters.items()):
+                    if n2 == name:
+                        lines.append('{}_{}_total{{operation="{}"}} {}'.format(p, name, _escape(op), n))
+        return '\n'.join(lines) + '\n'
+
+def enable_prometheus(prefix='projectoxford'):
+    '''Registers and returns a new `PrometheusCollector`.'''
+    collector = PrometheusCollector(prefix)
+    add_hook(collector)
+    return collector
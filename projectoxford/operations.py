@@ -0,0 +1,168 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Long-Running Operations
+
+This module provides the helper used by the clients to submit
+operations that the service completes in the background, and to poll
+them until their results are available.
+'''
+
+import concurrent.futures
+import heapq
+import json
+import os
+import tempfile
+import time
+
+from projectoxford.batch import BatchResult
+
+__all__ = ['OperationManager']
+
+class OperationManager(object):
+    '''Submits long-running operations and polls them until they
+    complete, sharing a bounded number of threads between submissions
+    and polls.
+
+    OperationManager(submit, poll, state_path=None, max_workers=4,
+                     interval=1.0, max_interval=30.0, backoff=1.5)
+
+    submit:
+        A function taking an item and returning the location of its
+        operation. Locations must be serializable as JSON.
+    poll:
+        A function taking a location and returning ``None`` while the
+        operation is running, or its result once it has completed.
+        It raises an exception if the operation failed.
+    state_path:
+        A file to record each item's operation and result in. When an
+        item that was previously submitted is run again, its operation
+        is polled or its result returned rather than submitting it
+        again, so an interrupted process can resume.
+    max_workers:
+        The maximum number of submissions and polls in progress at
+        once.
+    interval:
+        The number of seconds before an operation is first polled.
+    max_interval:
+        The maximum number of seconds between polls of an operation.
+    backoff:
+        The factor the interval is multiplied by after each poll that
+        finds an operation still running.
+    '''
+
+    def __init__(self, submit, poll, state_path=None, max_workers=4,
+                 interval=1.0, max_interval=30.0, backoff=1.5):
+        self.submit = submit
+        self.poll = poll
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.interval = interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.state = self._load_state()
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path, 'r', encoding='utf-8') as f:
+            return json.load(f).get('operations', {})
+
+    def _save_state(self):
+        if not self.state_path:
+            return
+        directory = os.path.dirname(os.path.abspath(self.state_path))
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'operations': self.state}, f)
+            os.replace(tmp, self.state_path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except OSError:
+                pass
+            raise
+
+    def run(self, items, key=str):
+        '''Submits each of `items` that has not already been submitted
+        and yields a `projectoxford.batch.BatchResult` for each as its
+        operation completes.
+
+        key:
+            A function returning the string that identifies an item in
+            the state file.
+        '''
+        items = list(items)
+        keys = [key(item) for item in items]
+        delays = {}
+        due = []
+        pending = {}
+        seq = 0
+
+        executor = concurrent.futures.ThreadPoolExecutor(self.max_workers)
+        try:
+            for i, (item, k) in enumerate(zip(items, keys)):
+                entry = self.state.get(k)
+                status = entry and entry.get('status')
+                if status == 'succeeded':
+                    yield BatchResult(i, item, entry.get('result'), None)
+                elif status == 'running':
+                    delays[i] = self.interval
+                    heapq.heappush(due, (time.monotonic(), seq, i))
+                    seq += 1
+                else:
+                    pending[executor.submit(self.submit, item)] = ('submit', i)
+
+            while due or pending:
+                now = time.monotonic()
+                while due and due[0][0] <= now:
+                    i = heapq.heappop(due)[2]
+                    pending[executor.submit(self.poll, self.state[keys[i]]['location'])] = ('poll', i)
+
+                timeout = max(0, due[0][0] - now) if due else None
+                if not pending:
+                    time.sleep(timeout)
+                    continue
+                done, _ = concurrent.futures.wait(pending, timeout=timeout,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                for f in done:
+                    kind, i = pending.pop(f)
+                    k = keys[i]
+                    error = f.exception()
+                    if error is not None:
+                        self.state[k] = {'status': 'failed', 'error': '{}: {}'.format(type(error).__name__, error)}
+                        self._save_state()
+                        yield BatchResult(i, items[i], None, error)
+                    elif kind == 'submit':
+                        self.state[k] = {'status': 'running', 'location': f.result()}
+                        self._save_state()
+                        delays[i] = self.interval
+                        heapq.heappush(due, (time.monotonic() + self.interval, seq, i))
+                        seq += 1
+                    elif f.result() is None:
+                        delays[i] = min(self.max_interval, delays[i] * self.backoff)
+                        heapq.heappush(due, (time.monotonic() + delays[i], seq, i))
+                        seq += 1
+                    else:
+                        result = f.result()
+                        self.state[k] = {'status': 'succeeded', 'location': self.state[k]['location'],
+                                         'result': result}
+                        self._save_state()
+                        yield BatchResult(i, items[i], result, None)
+        finally:
+            # Record operations that were submitted but not yet
+            # reported, so that they are not submitted again
+            for f in pending:
+                f.cancel()
+            executor.shutdown(wait=True)
+            submitted = False
+            for f, (kind, i) in pending.items():
+                if kind == 'submit' and not f.cancelled() and f.exception() is None:
+                    self.state[keys[i]] = {'status': 'running', 'location': f.result()}
+                    submitted = True
+            if submitted:
+                self._save_state()
@@ -0,0 +1,172 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Image Preprocessing
+
+This module decodes, resizes and encodes images for upload in a pool
+of processes, so that this work uses every core rather than competing
+with the threads sending requests.
+
+Encoded images are returned through shared memory where it is
+available (Python 3.8 and later, except on Windows), so they are not
+copied between processes. Decoding and resizing requires numpy and
+opencv.
+'''
+
+import concurrent.futures
+import itertools
+import os
+
+try:
+    from multiprocessing import shared_memory
+    from multiprocessing import resource_tracker
+except ImportError:
+    shared_memory = None
+
+__all__ = ['PreparedImage', 'prepare_images']
+
+class PreparedImage(object):
+    '''An image that has been prepared for upload.
+
+    index:
+        The position of the image in the input.
+    item:
+        The input item.
+    data:
+        The encoded image as a bytes-like object, or ``None`` if the
+        item was not prepared, such as a URL, or preparation failed.
+    scale:
+        A tuple of the factors to multiply x and y coordinates in the
+        encoded image by to obtain coordinates in the original image.
+    error:
+        The exception raised while preparing the image, or ``None``.
+
+    Call `release` once `data` is no longer needed.
+    '''
+    __slots__ = ('index', 'item', 'data', 'scale', 'error', '_shm')
+
+    def __init__(self, index, item, data=None, scale=(1.0, 1.0), error=None, shm=None):
+        self.index = index
+        self.item = item
+        self.data = data
+        self.scale = scale
+        self.error = error
+        self._shm = shm
+
+    def __repr__(self):
+        return '<PreparedImage {} {} bytes>'.format(self.index, 0 if self.data is None else len(self.data))
+
+    def release(self):
+        '''Releases the shared memory holding `data`.'''
+        shm, self._shm = self._shm, None
+        if isinstance(self.data, memoryview):
+            self.data.release()
+        self.data = None
+        if shm is not None:
+            try:
+                shm.close()
+            except BufferError:
+                # A view of the buffer is still referenced elsewhere. The
+                # mapping is closed when that view is collected.
+                pass
+            shm.unlink()
+
+def _is_url(item):
+    return isinstance(item, str) and item.lower().startswith(('http://', 'https://'))
+
+def _prepare(job):
+    '''Runs in a worker process: prepares one image and returns the
+    name of the shared memory block containing it, or its bytes.
+    '''
+    from projectoxford.emotion import _prepare_image
+
+    index, item, max_side, quality, share = job
+    if isinstance(item, str):
+        with open(item, 'rb') as f:
+            item = f.read()
+    data, fx, fy = _prepare_image(item, max_side, quality)
+    if not share:
+        return index, bytes(data), None, (fx, fy)
+
+    shm = shared_memory.SharedMemory(create=True, size=max(1, len(data)))
+    try:
+        shm.buf[:len(data)] = data
+    finally:
+        shm.close()
+    # The parent process owns the block from now on
+    resource_tracker.unregister(getattr(shm, '_name', '/' + shm.name), 'shared_memory')
+    return index, shm.name, len(data), (fx, fy)
+
+def _attach(result):
+    index, data, size, scale = result
+    if size is None:
+        return data, scale, None
+    shm = shared_memory.SharedMemory(name=data)
+    return shm.buf[:size], scale, shm
+
+def prepare_images(images, max_side=1024, quality=90, processes=None, queue_size=16, executor=None):
+    '''Prepares images for upload in a pool of processes and yields a
+    `PreparedImage` for each as it is ready.
+
+    Images larger than `max_side` are reduced and encoded as JPEG at
+    `quality`. Smaller encoded images are passed on unchanged.
+
+    images:
+        An iterable of local paths, encoded images as bytes, or numpy
+        arrays in BGR order. URLs are yielded without being prepared.
+    processes:
+        The number of worker processes, or ``None`` for one per CPU.
+    queue_size:
+        The maximum number of prepared images waiting to be consumed
+        or being prepared. Preparation pauses while the consumer is
+        busy, which bounds memory use.
+    executor:
+        An existing process pool to use. If omitted, a new pool is
+        created and shut down when iteration ends.
+    '''
+    # Shared memory on Windows is destroyed when the worker closes it,
+    # before this process can attach to it
+    share = shared_memory is not None and os.name != 'nt'
+    own_executor = executor is None
+    if own_executor:
+        executor = concurrent.futures.ProcessPoolExecutor(processes or os.cpu_count())
+    pending = {}
+    try:
+        it = enumerate(images)
+
+        def fill(count):
+            for index, item in itertools.islice(it, count):
+                if _is_url(item):
+                    future = concurrent.futures.Future()
+                    future.set_result(None)
+                else:
+                    future = executor.submit(_prepare, (index, item, max_side, quality, share))
+                pending[future] = (index, item)
+
+        fill(queue_size)
+        while pending:
+            done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for f in done:
+                index, item = pending.pop(f)
+                if f.exception() is not None:
+                    prepared = PreparedImage(index, item, error=f.exception())
+                elif f.result() is None:
+                    prepared = PreparedImage(index, item)
+                else:
+                    data, scale, shm = _attach(f.result())
+                    prepared = PreparedImage(index, item, data, scale, shm=shm)
+                fill(1)
+                yield prepared
+    finally:
+        # Release blocks prepared for images that will not be consumed
+        for f in pending:
+            f.cancel()
+        for f in pending:
+            if not f.cancelled() and f.exception() is None and f.result() is not None:
+                data, scale, shm = _attach(f.result())
+                PreparedImage(0, None, data, scale, shm=shm).release()
+        if own_executor:
+            executor.shutdown(wait=True)
@@ -0,0 +1,305 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Typed Results
+
+This module provides compact, read-only views of service responses and
+the JSON decoder used by every client.
+
+Typed results keep the encoded response and only decode it when one of
+their attributes is first used. The decoded dictionary is not retained;
+call `to_dict` to obtain a new copy of it. Results created with
+`from_dict` keep the object they were given instead.
+'''
+
+import copy
+import json
+
+__all__ = ['set_json_decoder', 'loads', 'Hypothesis', 'Recognition', 'Face', 'Faces',
+           'Intent', 'Entity', 'LuisResult', 'EMOTIONS']
+
+def _json_loads(data):
+    if isinstance(data, (bytes, bytearray)):
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+_loads = _json_loads
+
+def _find_decoder():
+    for name in ('orjson', 'ujson', 'rapidjson'):
+        try:
+            return __import__(name).loads
+        except ImportError:
+            pass
+    return _json_loads
+
+def set_json_decoder(loads=None):
+    '''Sets the function used to decode JSON responses and returns the
+    previous function.
+
+    loads:
+        A function taking `bytes` and returning the decoded object. If
+        omitted, the fastest installed of ``orjson``, ``ujson`` and
+        ``rapidjson`` is used, falling back to the standard library.
+    '''
+    global _loads
+    previous = _loads
+    _loads = loads or _find_decoder()
+    return previous
+
+def loads(data):
+    '''Decodes `data` (a `bytes` or `str`) with the current JSON
+    decoder.
+    '''
+    return _loads(data)
+
+class _Lazy(object):
+    __slots__ = ('_content', '_parsed', '_value')
+
+    def __init__(self, content):
+        self._content = content
+        self._parsed = None
+        self._value = None
+
+    @classmethod
+    def from_dict(cls, value):
+        '''Returns a result containing the decoded response `value`. The
+        value is parsed directly, and is only encoded if `content` is
+        used.
+        '''
+        result = cls(None)
+        result._value = value
+        return result
+
+    @property
+    def content(self):
+        '''The response as it was received from the service.'''
+        if self._content is None:
+            self._content = json.dumps(self._value, separators=(',', ':')).encode('utf-8')
+        return self._content
+
+    def to_dict(self):
+        '''Returns the complete response as a newly decoded object.'''
+        if self._content is None:
+            return copy.deepcopy(self._value)
+        return _loads(self._content)
+
+    def _get(self):
+        if self._parsed is None:
+            self._parsed = self._parse(self._value if self._content is None else self.to_dict())
+        return self._parsed
+
+    def __repr__(self):
+        return '<{} {!r}>'.format(type(self).__name__, self._get())
+
+class _Record(object):
+    __slots__ = ()
+
+    def __eq__(self, other):
+        return type(self) is type(other) and all(getattr(self, n) == getattr(other, n) for n in self.__slots__)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return hash(tuple(getattr(self, n) for n in self.__slots__))
+
+    def __repr__(self):
+        return '{}({})'.format(type(self).__name__, ', '.join(
+            '{}={!r}'.format(n, getattr(self, n)) for n in self.__slots__
+        ))
+
+class Hypothesis(_Record):
+    '''One possible transcription of recognized speech.
+
+    text:
+        The display form of the transcription.
+    lexical:
+        The lexical form of the transcription.
+    confidence:
+        The service's confidence between 0 and 1, or ``None``.
+    level:
+        One of ``'high'``, ``'mid'`` or ``'low'``, or ``None``.
+    '''
+    __slots__ = ('text', 'lexical', 'confidence', 'level')
+
+    def __init__(self, text, lexical=None, confidence=None, level=None):
+        self.text = text
+        self.lexical = lexical
+        self.confidence = confidence
+        self.level = level
+
+    @classmethod
+    def from_dict(cls, value):
+        props = value.get('properties') or {}
+        level = None
+        for name, key in (('high', 'HIGHCONF'), ('mid', 'MIDCONF'), ('low', 'LOWCONF')):
+            if props.get(key):
+                level = name
+                break
+        confidence = value.get('confidence')
+        return cls(
+            value.get('name'),
+            value.get('lexical'),
+            None if confidence is None else float(confidence),
+            level,
+        )
+
+class Recognition(_Lazy):
+    '''The response to a speech recognition request, as a sequence of
+    `Hypothesis` objects with the most likely first.
+    '''
+    __slots__ = ()
+
+    def _parse(self, value):
+        return (
+            (value.get('header') or {}).get('status'),
+            tuple(Hypothesis.from_dict(r) for r in value.get('results') or ()),
+        )
+
+    @property
+    def status(self):
+        '''The status reported by the service, such as ``'success'``.'''
+        return self._get()[0]
+
+    @property
+    def hypotheses(self):
+        '''A tuple of `Hypothesis` objects.'''
+        return self._get()[1]
+
+    @property
+    def best(self):
+        '''The most likely `Hypothesis`, or ``None``.'''
+        h = self._get()[1]
+        return h[0] if h else None
+
+    def __len__(self):
+        return len(self._get()[1])
+
+    def __iter__(self):
+        return iter(self._get()[1])
+
+    def __getitem__(self, index):
+        return self._get()[1][index]
+
+EMOTIONS = ('anger', 'contempt', 'disgust', 'fear', 'happiness', 'neutral', 'sadness', 'surprise')
+
+class Face(_Record):
+    '''A face detected by the emotion service.
+
+    left, top, width, height:
+        The rectangle containing the face, in pixels.
+    values:
+        A tuple of the score for each emotion in `EMOTIONS`.
+    '''
+    __slots__ = ('left', 'top', 'width', 'height', 'values')
+
+    def __init__(self, left, top, width, height, values):
+        self.left = left
+        self.top = top
+        self.width = width
+        self.height = height
+        self.values = values
+
+    @classmethod
+    def from_dict(cls, value):
+        rect = value['faceRectangle']
+        scores = value['scores']
+        return cls(
+            rect['left'], rect['top'], rect['width'], rect['height'],
+            tuple(float(scores.get(e, 0.0)) for e in EMOTIONS),
+        )
+
+    @property
+    def scores(self):
+        '''A dictionary mapping each emotion to its score.'''
+        return dict(zip(EMOTIONS, self.values))
+
+    @property
+    def strongest(self):
+        '''The emotion with the highest score.'''
+        return EMOTIONS[max(range(len(EMOTIONS)), key=self.values.__getitem__)]
+
+class Faces(_Lazy):
+    '''The response to an emotion recognition request, as a sequence of
+    `Face` objects.
+    '''
+    __slots__ = ()
+
+    def _parse(self, value):
+        return tuple(Face.from_dict(f) for f in value or ())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __getitem__(self, index):
+        return self._get()[index]
+
+class Intent(_Record):
+    '''An intent recognized by LUIS and its score between 0 and 1.'''
+    __slots__ = ('name', 'score')
+
+    def __init__(self, name, score=None):
+        self.name = name
+        self.score = score
+
+class Entity(_Record):
+    '''An entity recognized by LUIS.
+
+    text:
+        The text of the entity.
+    type:
+        The name of the entity's type.
+    start, end:
+        The index of the first and last characters of the entity in
+        the query.
+    score:
+        The score between 0 and 1, or ``None``.
+    '''
+    __slots__ = ('text', 'type', 'start', 'end', 'score')
+
+    def __init__(self, text, type, start=None, end=None, score=None):
+        self.text = text
+        self.type = type
+        self.start = start
+        self.end = end
+        self.score = score
+
+class LuisResult(_Lazy):
+    '''The response to a LUIS query.'''
+    __slots__ = ()
+
+    def _parse(self, value):
+        return (
+            value.get('query'),
+            tuple(Intent(i['intent'], i.get('score')) for i in value.get('intents') or ()),
+            tuple(Entity(e['entity'], e['type'], e.get('startIndex'), e.get('endIndex'), e.get('score'))
+                  for e in value.get('entities') or ()),
+        )
+
+    @property
+    def query(self):
+        '''The text that was submitted.'''
+        return self._get()[0]
+
+    @property
+    def intents(self):
+        '''A tuple of `Intent` objects with the most likely first.'''
+        return self._get()[1]
+
+    @property
+    def entities(self):
+        '''A tuple of `Entity` objects.'''
+        return self._get()[2]
+
+    @property
+    def intent(self):
+        '''The name of the most likely intent, or ``None``.'''
+        i = self._get()[1]
+        return i[0].name if i else None
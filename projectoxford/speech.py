@@ -12,6 +12,7 @@ See https://www.projectoxford.ai/speech to obtain an API key.
 '''
 
 import base64
+import hashlib
 import requests
 import time
 import uuid
@@ -19,6 +20,10 @@ import sys
 
 import projectoxford.audio as audio
 
+from projectoxford import _http, endpoints, metrics, results, wavefile
+from projectoxford.cache import DiskCache, SingleFlight, TTLCache
+from projectoxford.keys import KeyPool, _retry_after
+
 _API_SCOPE = "https://speech.platform.bing.com"
 
 _SYNTHESIZE_TEMPLATE = '''<speak version='1.0' xml:lang='{locale}'>
@@ -124,64 +129,240 @@ def join_or(items, sep=', ', last_sep=' or '):
     return join_and(items, sep, last_sep)
 
 
+def _recognize_content_type(wav):
+    '''Returns the Content-Type header for recognizing an open wave
+    file.
+    '''
+    return '; '.join((
+        'audio/wav',
+        'codec="audio/pcm"',
+        'samplerate=8000',
+        'sourcerate={}'.format(wav.getframerate()),
+        'trustsourcerate=true'
+    ))
+
+def _recognize_params(locale):
+    '''Returns the query string for a recognition request.'''
+    return '&'.join((
+        'scenarios=ulm',
+        'appid=D4D52672-91D7-4C74-8AD8-42B1D98141A5',
+        'locale={}'.format(locale),
+        'device.os="Windows OS"',
+        'version=3.0',
+        'format=json',
+        'instanceid=565D69FF-E928-4B7E-87DA-9A750B96D9E3',
+        'requestid={}'.format(uuid.uuid4())
+    ))
+
 class LowConfidenceError(ValueError):
     '''Thrown when a speech recognition operation returned with low
     confidence. ``args[0]`` contains the best guess at what was said.
     '''
     pass
 
+class RecognitionCache(object):
+    '''Caches speech recognition responses by locale and audio, so
+    that identical audio is only recognized once.
+
+    Audio is identified by a hash of its sample format and samples, so
+    wave files that differ only in their headers or metadata chunks
+    share a response.
+
+    RecognitionCache(maxsize=1024, directory=None, max_bytes=268435456, ttl=None)
+
+    maxsize:
+        The maximum number of responses kept in memory.
+    directory:
+        A directory to also store responses in, so that they persist
+        between processes.
+    max_bytes:
+        The maximum total size of the responses stored in `directory`.
+    ttl:
+        The number of seconds a response remains valid. If ``None``,
+        responses do not expire.
+    '''
+
+    def __init__(self, maxsize=1024, directory=None, max_bytes=256 * 1024 * 1024, ttl=None):
+        self.memory = TTLCache(maxsize, ttl)
+        self.disk = DiskCache(directory, max_bytes, ttl) if directory else None
+
+    def __repr__(self):
+        return '<RecognitionCache {!r} {!r}>'.format(self.memory, self.disk)
+
+    def key_for(self, wav, locale):
+        '''Returns the cache key for recognizing `wav` in `locale`.
+
+        wav:
+            Any value accepted by `recognize_raw`. Streams that cannot
+            seek are read to the end.
+        '''
+        digest = hashlib.sha256()
+        with audio._open_wav(wav) as w:
+            digest.update('{}/{}/{}\n'.format(w.getnchannels(), w.getsampwidth(), w.getframerate()).encode('ascii'))
+            if w.data is not None:
+                digest.update(w.data)
+            else:
+                start = w.tell()
+                for block in w.iterframes(65536):
+                    digest.update(block)
+                if w.seekable():
+                    w.setpos(start)
+        return '{}:{}'.format(locale, digest.hexdigest())
+
+    def get(self, key):
+        '''Returns the encoded response for `key`, or ``None``.'''
+        content = self.memory.get(key)
+        if content is None and self.disk is not None:
+            text = self.disk.get(key)
+            if text is not None:
+                content = text.encode('utf-8')
+                self.memory.put(key, content)
+        return content
+
+    def put(self, key, content):
+        '''Stores the encoded response `content` for `key`.'''
+        self.memory.put(key, content)
+        if self.disk is not None:
+            self.disk.put(key, content.decode('utf-8'))
+
 class SpeechClient(object):
     '''Provides access to the Project Oxford Speech APIs.
 
-    SpeechClient(key, locale='en-US', gender='Female', tee_print=sys.stdout)
+    SpeechClient(key, locale='en-US', gender='Female', timeout=None, hedge=None,
+                 endpoint=None, token_endpoint=None, recognition_cache=None, session=None)
 
     key:
         The API key for your subscription. Visit
-        https://www.projectoxford.ai/speech to obtain one.
+        https://www.projectoxford.ai/speech to obtain one. To spread
+        requests across multiple subscriptions, pass a sequence of
+        keys or a `projectoxford.keys.KeyPool`.
     locale:
         The locale for both voice and speech recognition. This value
         can be overridden on individual calls to `say`.
     gender:
         The gender of the voice. This value can be overridden on
         individual calls to `say`.
+    timeout:
+        The default number of seconds allowed for each call, including
+        obtaining a token and any retries. This value can be
+        overridden on individual calls.
+    hedge:
+        If ``True`` or a percentile between 0 and 1, synthesis requests
+        that take longer than that fraction of recent requests are
+        sent again and the first response is used.
+    endpoint:
+        The base URL of the speech service. If omitted, uses
+        `projectoxford.endpoints.SPEECH_ENDPOINT`.
+    token_endpoint:
+        The URL used to obtain authorization tokens. If omitted, uses
+        `projectoxford.endpoints.SPEECH_TOKEN_ENDPOINT`.
+    recognition_cache:
+        If ``True`` or a `RecognitionCache`, successful recognition
+        responses are cached by locale and audio, and identical audio
+        recognized while a request is in progress shares its response.
+        ``True`` caches up to 1024 responses in memory.
+    session:
+        A `requests.Session` to send requests with. If omitted, the
+        client creates its own so that connections are reused. Pass
+        the same session to a `projectoxford.luis.LuisClient` to share
+        one connection pool between them.
     '''
 
-    def __init__(self, key, locale='en-US', gender='Female'):
+    def __init__(self, key, locale='en-US', gender='Female', timeout=None, hedge=None,
+                 endpoint=None, token_endpoint=None, recognition_cache=None, session=None):
         self.key = key
+        self.keys = KeyPool.coerce(key)
         self.client_id = uuid.uuid4().hex
-        self.token = None
-        self.token_expires = None
         self.locale = locale
         self.gender = gender
+        self.timeout = timeout
+        self._hedge = _http.Hedge.coerce(hedge)
+        self.endpoint = endpoint
+        self.token_endpoint = token_endpoint
+        if recognition_cache is True:
+            recognition_cache = RecognitionCache()
+        self.recognition_cache = recognition_cache if recognition_cache is not False else None
+        self._recognition_flights = SingleFlight()
+        self.session = session or _http.new_session()
 
         self.quiet_threshold = None
 
-    def _get_token(self):
-        if self.token is None or self.token_expires < time.clock():
-            r = requests.post(
-                'https://oxford-speech.cloudapp.net/token/issueToken',
-                data={
-                    'grant_type':'client_credentials',
-                    'client_id': self.client_id,
-                    'client_secret': self.key,
-                    'scope': _API_SCOPE
-                }
-            )
-            try:
-                r.raise_for_status()
-            except requests.HTTPError:
-                raise RuntimeError('unable to obtain authorization token')
+    def _get_token(self, key, deadline=None, span=metrics.NULL_SPAN):
+        state = self.keys.state(key)
+        if state.token is None or state.token_expires < time.monotonic():
+            with span.phase('token'):
+                return self._issue_token(key, state, deadline)
+        return state.token
+
+    def _issue_token(self, key, state, deadline):
+        r = _http.request(
+            'POST',
+            self.token_endpoint or endpoints.SPEECH_TOKEN_ENDPOINT,
+            deadline,
+            session=self.session,
+            data={
+                'grant_type':'client_credentials',
+                'client_id': self.client_id,
+                'client_secret': key,
+                'scope': _API_SCOPE
+            }
+        )
+        try:
+            r.raise_for_status()
+        except requests.HTTPError:
+            if r.status_code in (401, 403):
+                self.keys.eject(key)
+            raise RuntimeError('unable to obtain authorization token')
 
-            self.token = r.json()
+        token = results.loads(r.content)
+        try:
+            state.token_expires = time.monotonic() + int(token['expires_in'])
+            state.token = token['access_token']
+        except (ValueError, LookupError):
+            state.token = None
+            state.token_expires = None
+            raise RuntimeError('unable to obtain authorization token')
+
+        return state.token
+
+    def _post(self, url, data, headers, deadline, span=metrics.NULL_SPAN):
+        '''Posts a request using the best available key in the pool,
+        retrying with another key if the service rejects or throttles
+        the one that was used.
+        '''
+        # Bodies read from streams can only be sent once
+        replayable = data is None or isinstance(data, (bytes, str)) or hasattr(data, 'seek')
+        attempts = 0
+        while True:
+            if hasattr(data, 'seek'):
+                data.seek(0)
+            key = _http.acquire(self.keys, deadline)
+            r = None
             try:
-                self.token['access_token']
-                self.token_expires = time.clock() + int(self.token['expires_in'])
-            except (ValueError, LookupError):
-                self.token = None
-                self.token_expires = None
-                raise RuntimeError('unable to obtain authorization token')
-
-        return self.token['access_token']
+                h = dict(headers)
+                try:
+                    h['Authorization'] = 'Bearer ' + self._get_token(key, deadline, span)
+                except RuntimeError:
+                    # The key is only ejected if another key may succeed
+                    if key in self.keys.healthy() or attempts >= len(self.keys):
+                        raise
+                    attempts += 1
+                    span.count('retries')
+                    continue
+                r = _http.request('POST', url, deadline, span, session=self.session, data=data, headers=h)
+            finally:
+                if r is None:
+                    self.keys.release(key)
+                else:
+                    ejected = self.keys.release(key, r.status_code, _retry_after(r))
+            if r.status_code in (401, 403):
+                self.keys.state(key).token = None
+            if ejected and attempts < len(self.keys) and replayable:
+                attempts += 1
+                span.count('retries')
+                continue
+            r.raise_for_status()
+            return r
 
     def calibrate_audio_recording(self):
         '''Determines the quiet threshold for the current user's
@@ -252,7 +433,7 @@ class SpeechClient(object):
         if text.strip():
             audio.play(self.say_to_wav(text, locale, gender))
 
-    def say_to_wav(self, text, locale=None, gender=None, filename=None):
+    def say_to_wav(self, text, locale=None, gender=None, filename=None, timeout=None):
         '''Converts the provided text to speech and returns the
         contents of a wave file as bytes.
 
@@ -267,6 +448,11 @@ class SpeechClient(object):
         filename:
             Path to a file to write the wave file to. If omitted, no
             file is written.
+        timeout:
+            The number of seconds allowed for the call, including any
+            retries. If omitted, uses the default for this client.
+            `requests.Timeout` is raised if the call does not complete
+            in time.
         '''
         if locale is None:
             locale = self.locale
@@ -282,20 +468,24 @@ class SpeechClient(object):
         except LookupError:
             raise ValueError('no voice available for {} {}'.format(gender, locale))
 
-        r = requests.post(
-            _API_SCOPE + '/synthesize',
-            data=_SYNTHESIZE_TEMPLATE.format(locale=locale, gender=gender, voice=voice, text=text),
-            headers={
-                'Content-Type': 'text/ssml+xml',
-                'X-Microsoft-OutputFormat': 'riff-16khz-16bit-mono-pcm',
-                'X-Search-AppId': '40c496aba8e54b429be4429db5caf4a1',
-                'X-Search-ClientID': self.client_id,
-                'Authorization': 'Bearer ' + self._get_token(),
-            },
-        )
-        r.raise_for_status()
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
+        with metrics.start('speech.synthesize') as span:
+            post = lambda: self._post(
+                (self.endpoint or endpoints.SPEECH_ENDPOINT) + '/synthesize',
+                data=_SYNTHESIZE_TEMPLATE.format(locale=locale, gender=gender, voice=voice, text=text),
+                headers={
+                    'Content-Type': 'text/ssml+xml',
+                    'X-Microsoft-OutputFormat': 'riff-16khz-16bit-mono-pcm',
+                    'X-Search-AppId': '40c496aba8e54b429be4429db5caf4a1',
+                    'X-Search-ClientID': self.client_id,
+                },
+                deadline=deadline,
+                span=span,
+            )
+            r = self._hedge.call(post, deadline) if self._hedge else post()
 
-        wav = r.content
+        # Streamed responses may have placeholder sizes in their header
+        wav = wavefile.normalize(r.content)
 
         if filename:
             with open(filename, 'wb') as f:
@@ -309,9 +499,11 @@ class SpeechClient(object):
         audio. Returns a string containing the recognized text.
 
         wav:
-            An open `wave.Wave_read` object, a `bytes` object
-            containing a wave file, or a valid argument to
-            `wave.open`. If omitted, a beep will be played and the
+            A `bytes` object or other buffer containing a wave file,
+            the path to a wave file, a binary file object or socket to
+            read a wave file from, or an open `wave.Wave_read` or
+            `projectoxford.wavefile.WavReader` object. If omitted, a
+            beep will be played and the
             user's default microphone will record up to 30 seconds of
             audio.
         locale:
@@ -324,25 +516,29 @@ class SpeechClient(object):
             low confidence results will be returned as normal.
         '''
         if not wav:
-            if self.quiet_threshold is None:
-                self.calibrate_audio_recording()
-            audio.play(_BEEP_ON_WAV)
-            wav = audio.record(seconds=30, quiet_seconds=1, quiet_threshold=self.quiet_threshold)
-            audio.play(_BEEP_OFF_WAV)
-        res = self.recognize_raw(wav, locale)
-        try:
-            best = res['results'][0]
-            if best['properties'].get('HIGHCONF'):
-                return best['name']
-            if best['properties'].get('MIDCONF') or best['properties'].get('LOWCONF'):
+            wav = self._record()
+        best = self.recognize_raw(wav, locale, typed=True).best
+        if best is not None:
+            if best.level == 'high':
+                return best.text
+            if best.level in ('mid', 'low'):
                 if require_high_confidence:
-                    raise LowConfidenceError(best['name'])
-                return best['name']
-        except LookupError:
-            pass
+                    raise LowConfidenceError(best.text)
+                return best.text
         raise ValueError('unable to recognize speech')
 
-    def recognize_raw(self, wav, locale=None):
+    def _record(self):
+        '''Plays a beep and records up to 30 seconds of audio from the
+        user's default microphone.
+        '''
+        if self.quiet_threshold is None:
+            self.calibrate_audio_recording()
+        audio.play(_BEEP_ON_WAV)
+        wav = audio.record(seconds=30, quiet_seconds=1, quiet_threshold=self.quiet_threshold)
+        audio.play(_BEEP_OFF_WAV)
+        return wav
+
+    def recognize_raw(self, wav, locale=None, timeout=None, typed=False):
         '''Converts a wave file to text, and returns the complete
         response JSON as a dictionary from the server.
 
@@ -350,53 +546,84 @@ class SpeechClient(object):
         for the schema of the response.
 
         wav:
-            An open `wave.Wave_read` object, a `bytes` object
-            containing a wave file, or a valid argument to
-            `wave.open`.
+            A `bytes` object or other buffer containing a wave file,
+            the path to a wave file, a binary file object or socket to
+            read a wave file from, or an open `wave.Wave_read` or
+            `projectoxford.wavefile.WavReader` object. Files are
+            memory mapped and streams are sent as they are read,
+            without being copied into memory.
         locale:
             The locale to use. If omitted, uses the default for this
             client.
+        timeout:
+            The number of seconds allowed for the call, including any
+            retries. If omitted, uses the default for this client.
+            `requests.Timeout` is raised if the call does not complete
+            in time.
+        typed:
+            If True, returns a `projectoxford.results.Recognition`
+            that is only decoded when its hypotheses are used.
         '''
         if locale is None:
             locale = self.locale
         if locale not in LOCALES:
             raise ValueError('unsupported locale: ' + locale)
 
+        deadline = _http.Deadline(self.timeout if timeout is None else timeout)
         with audio._open_wav(wav) as w:
             if w.getnchannels() != 1:
                 raise ValueError('can only recognize single channel audio')
 
-            content_type = '; '.join((
-                'audio/wav',
-                'codec="audio/pcm"',
-                'samplerate=8000',
-                'sourcerate={}'.format(w.getframerate()),
-                'trustsourcerate=true'
-            ))
-
-        params = '&'.join((
-            'scenarios=ulm',
-            'appid=D4D52672-91D7-4C74-8AD8-42B1D98141A5',
-            'locale={}'.format(locale),
-            'device.os="Windows OS"',
-            'version=3.0',
-            'format=json',
-            'instanceid=565D69FF-E928-4B7E-87DA-9A750B96D9E3',
-            'requestid={}'.format(uuid.uuid4())
-        ))
-
-        r = requests.post(
-            _API_SCOPE + '/recognize?' + params,
-            data=wav,
-            headers={
-                'Content-Type': content_type,
-                'Accept': 'application/json;text/xml',
-                'Authorization': 'Bearer ' + self._get_token(),
-            },
-        )
-        r.raise_for_status()
-
-        return r.json()
+            if self.recognition_cache is not None and w.data is None:
+                # Streams are read into memory so that they can be
+                # hashed before they are sent
+                body = w.body()
+                parts = iter(body.read, b'') if hasattr(body, 'read') else body
+                w = wavefile.open_wav(b''.join(parts))
+            return self._recognize(w, locale, deadline, typed)
+
+    def _recognize(self, w, locale, deadline, typed):
+        content_type = _recognize_content_type(w)
+        body = w.body()
+        with metrics.start('speech.recognize') as span:
+            recognize = lambda: self._post(
+                (self.endpoint or endpoints.SPEECH_ENDPOINT) + '/recognize?' + _recognize_params(locale),
+                data=body,
+                headers={
+                    'Content-Type': content_type,
+                    'Accept': 'application/json;text/xml',
+                },
+                deadline=deadline,
+                span=span,
+            ).content
+
+            if self.recognition_cache is None:
+                content = recognize()
+            else:
+                key = self.recognition_cache.key_for(w, locale)
+                content = self.recognition_cache.get(key)
+                if content is None:
+                    try:
+                        content = self._recognition_flights.do(
+                            key, lambda: self._recognize_and_cache(key, recognize), deadline.remaining()
+                        )
+                    except TimeoutError:
+                        raise requests.Timeout('deadline exceeded')
+                else:
+                    span.count('cache_hits')
+
+            if typed:
+                return results.Recognition(content)
+            with span.phase('parse'):
+                return results.loads(content)
+
+    def _recognize_and_cache(self, key, recognize):
+        content = recognize()
+        # Failed recognitions may succeed when retried, so only
+        # successful responses are stored
+        if results.Recognition(content).status == 'success':
+            self.recognition_cache.put(key, content)
+        return content
 
 _BEEP_ON_WAV = base64.b64decode(
     b'UklGRiIaAABXQVZFZm10IBAAAAABAAEAESsAACJWAAACABAAZGF0Yf4ZAAAAAAAABAAIACAADwAiAAIA'
@@ -0,0 +1,75 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import itertools
+import threading
+import time
+import unittest
+
+import requests
+
+from projectoxford.batch import imap_unordered
+from projectoxford.emulator import Emulator
+from projectoxford.luis import LuisClient
+
+class ImapUnorderedTests(unittest.TestCase):
+    def test_results_and_errors(self):
+        def fn(x):
+            if x == 3:
+                raise ValueError(x)
+            return x * 2
+
+        results = sorted(imap_unordered(fn, range(6), max_workers=2))
+        self.assertEqual([0, 1, 2, 3, 4, 5], [r.index for r in results])
+        self.assertEqual([0, 2, 4, None, 8, 10], [r.result for r in results])
+        self.assertIsInstance(results[3].error, ValueError)
+
+    def test_concurrency_is_bounded(self):
+        active = [0, 0]
+        lock = threading.Lock()
+
+        def fn(x):
+            with lock:
+                active[0] += 1
+                active[1] = max(active)
+            time.sleep(0.01)
+            with lock:
+                active[0] -= 1
+
+        list(imap_unordered(fn, range(20), max_workers=3))
+        self.assertLessEqual(active[1], 3)
+
+    def test_items_are_read_lazily(self):
+        read = []
+
+        def items():
+            for i in itertools.count():
+                read.append(i)
+                yield i
+
+        it = imap_unordered(lambda x: x, items(), max_workers=2)
+        next(it)
+        it.close()
+        self.assertLess(len(read), 10)
+
+class QueryManyTests(unittest.TestCase):
+    def test_order_and_duplicates(self):
+        with Emulator() as emu:
+            emu.intents = {'on': 'On', 'off': 'Off'}
+            texts = ['lights on', 'lights off', 'lights on', 'hello']
+            results = LuisClient(emu.luis_url()).query_many(texts, max_workers=2)
+            self.assertEqual(3, emu.counts['luis'])
+            self.assertEqual(list(range(4)), [r.index for r in results])
+            self.assertEqual(texts, [r.item for r in results])
+            self.assertEqual(['On', 'Off', 'On', 'None'], [r.result['intents'][0]['intent'] for r in results])
+            self.assertIsNot(results[0].result, results[2].result)
+
+    def test_errors_are_captured(self):
+        with Emulator(failure_rate=1.0) as emu:
+            results = LuisClient(emu.luis_url()).query_many(['a', 'b'])
+            self.assertEqual([None, None], [r.result for r in results])
+            self.assertTrue(all(isinstance(r.error, requests.HTTPError) for r in results))
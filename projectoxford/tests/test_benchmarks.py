@@ -0,0 +1,37 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from projectoxford import benchmarks
+
+class BenchmarkTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_report(self):
+        path = os.path.join(self.directory, 'results.json')
+        benchmarks.main(['--repeat', '1', '--number', '1', '--calls', '2', '-o', path])
+        with open(path, 'r', encoding='utf-8') as f:
+            report = json.load(f)
+        self.assertIn('version', report)
+        names = {r['name'] for r in report['results']}
+        for name in ('audio.is_quiet', 'audio.open_wav', 'speech.ssml', 'emotion.get_strongest_emotion',
+                     'speech.recognize_raw', 'emotion.process_image_from_path', 'luis.query'):
+            self.assertIn(name, names)
+        for r in report['results']:
+            self.assertLessEqual(r['min'], r['p50'])
+            self.assertLessEqual(r['p50'], r['p99'])
+        end_to_end = [r for r in report['results'] if 'throughput' in r]
+        self.assertEqual([2] * len(end_to_end), [r['repeat'] for r in end_to_end])
@@ -0,0 +1,142 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+
+import requests
+
+from projectoxford.cache import DiskCache, SingleFlight, TTLCache
+from projectoxford.emulator import Emulator
+from projectoxford.luis import LuisClient
+
+class TTLCacheTests(unittest.TestCase):
+    def test_least_recently_used_is_removed(self):
+        cache = TTLCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        cache.get('a')
+        cache.put('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(3, cache.get('c'))
+
+    def test_entries_expire(self):
+        cache = TTLCache(ttl=0.05)
+        cache.put('a', 1)
+        self.assertIn('a', cache)
+        time.sleep(0.1)
+        self.assertNotIn('a', cache)
+
+class DiskCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_entries_persist(self):
+        DiskCache(self.directory).put('a', {'value': [1, 2]})
+        self.assertEqual({'value': [1, 2]}, DiskCache(self.directory).get('a'))
+
+class SingleFlightTests(unittest.TestCase):
+    def _run(self, fn, count=5):
+        flights = SingleFlight()
+        outcomes = [None] * count
+
+        def call(i):
+            try:
+                outcomes[i] = flights.do('key', fn)
+            except Exception as ex:
+                outcomes[i] = ex
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(count)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return outcomes
+
+    def test_concurrent_calls_share_one_result(self):
+        calls = []
+
+        def fn():
+            calls.append(1)
+            time.sleep(0.2)
+            return object()
+
+        outcomes = self._run(fn)
+        self.assertEqual(1, len(calls))
+        self.assertTrue(all(o is outcomes[0] for o in outcomes))
+
+    def test_waiters_raise_their_own_error(self):
+        def fn():
+            time.sleep(0.2)
+            raise ValueError('failed')
+
+        outcomes = self._run(fn)
+        self.assertTrue(all(isinstance(o, ValueError) and o.args == ('failed',) for o in outcomes))
+        self.assertEqual(len(outcomes), len(set(map(id, outcomes))))
+        leader = [o for o in outcomes if o.__cause__ is None]
+        self.assertEqual(1, len(leader))
+        self.assertTrue(all(o.__cause__ is leader[0] for o in outcomes if o is not leader[0]))
+
+    def test_timeout(self):
+        flights = SingleFlight()
+        started = threading.Event()
+        t = threading.Thread(target=flights.do, args=('key', lambda: started.set() or time.sleep(0.5)))
+        t.start()
+        started.wait()
+        self.assertRaises(TimeoutError, flights.do, 'key', lambda: None, 0.05)
+        t.join()
+
+class QueryCacheTests(unittest.TestCase):
+    def test_identical_queries_are_coalesced_and_cached(self):
+        with Emulator(latency=0.2) as emu:
+            lc = LuisClient(emu.luis_url(), cache=True)
+            texts = ['Hello', 'hello', ' hello! '] * 3
+            results = [None] * len(texts)
+
+            def query(i):
+                results[i] = lc.query_raw(texts[i])
+
+            threads = [threading.Thread(target=query, args=(i,)) for i in range(len(texts))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(1, emu.counts['luis'])
+            self.assertTrue(all(r == results[0] for r in results))
+            # Each caller receives its own copy
+            self.assertEqual(len(results), len(set(map(id, results))))
+
+            lc.query_raw('HELLO')
+            self.assertEqual(1, emu.counts['luis'])
+            lc.query_raw('goodbye')
+            self.assertEqual(2, emu.counts['luis'])
+
+    def test_coalesced_errors_keep_their_response(self):
+        with Emulator(keys=['key'], latency=0.2) as emu:
+            lc = LuisClient(emu.luis_url(key='other'), cache=True)
+            errors = [None] * 3
+
+            def query(i):
+                try:
+                    lc.query_raw('hello')
+                except requests.HTTPError as ex:
+                    errors[i] = ex
+
+            threads = [threading.Thread(target=query, args=(i,)) for i in range(len(errors))]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(1, emu.counts['luis'])
+            self.assertEqual([401] * 3, [e.response.status_code for e in errors])
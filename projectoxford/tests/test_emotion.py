@@ -0,0 +1,473 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import contextlib
+import csv
+import io
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = numpy = None
+
+from projectoxford import metrics, results
+from projectoxford.emotion import (MAX_FACES, EmotionCache, EmotionClient, EmotionResult, EmotionResultSet,
+                                  FaceDetector, face_time_series, render_many)
+from projectoxford.emulator import Emulator
+
+_FACE = {'faceRectangle': {'left': 5, 'top': 5, 'width': 20, 'height': 20}, 'scores': {'happiness': 1.0}}
+
+@unittest.skipUnless(cv2, 'requires numpy and opencv')
+class RenderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _image(self, *parts):
+        path = os.path.join(self.directory, *parts)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        cv2.imwrite(path, numpy.zeros((50, 50, 3), dtype=numpy.uint8))
+        return path
+
+    def test_outputs_with_the_same_name_do_not_collide(self):
+        sources = [self._image('a', 'face.jpg'), self._image('b', 'face.jpg')]
+        results = [EmotionResult([_FACE], source=s) for s in sources]
+        out = os.path.join(self.directory, 'out')
+        rendered = render_many(results, out, max_workers=1)
+        self.assertEqual([None, None], [r.error for r in rendered])
+        self.assertEqual(['0-face.jpg', '1-face.jpg'], sorted(os.listdir(out)))
+        self.assertEqual([os.path.join(out, n) for n in ('0-face.jpg', '1-face.jpg')], [r.result for r in rendered])
+
+    def test_source_is_never_overwritten(self):
+        source = self._image('face.png')
+        with open(source, 'rb') as f:
+            original = f.read()
+        results = [EmotionResult([_FACE], source=source), EmotionResult([_FACE], source=source)]
+        other = os.path.join(self.directory, 'other.png')
+        rendered = render_many(results, [os.path.join(self.directory, '.', 'face.png'), other], max_workers=1)
+        self.assertIsInstance(rendered[0].error, ValueError)
+        self.assertIsNone(rendered[1].error)
+        self.assertTrue(os.path.exists(other))
+        with open(source, 'rb') as f:
+            self.assertEqual(original, f.read())
+
+        rendered = render_many(results[:1], self.directory, max_workers=1)
+        self.assertIsNone(rendered[0].error)
+        self.assertEqual(os.path.join(self.directory, '0-face.png'), rendered[0].result)
+
+@unittest.skipUnless(cv2, 'requires numpy and opencv')
+class MosaicTests(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator()
+        self.emulator.start()
+        self.client = EmotionClient('key', **self.emulator.emotion_args())
+        self.counters = {}
+        metrics.add_hook(self._record)
+
+    def tearDown(self):
+        metrics.remove_hook(self._record)
+        self.emulator.stop()
+
+    def _record(self, span):
+        for name, value in span.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def test_faces_are_mapped_to_their_images(self):
+        # Tiles are 100 pixels with 16 pixels of padding, so a mosaic of
+        # four images has tiles at 0 and 116 in each direction
+        self.emulator.face_rectangles = [
+            {'left': 10, 'top': 20, 'width': 30, 'height': 30},
+            {'left': 121, 'top': 121, 'width': 40, 'height': 40},
+            # Centred in the padding, so not attributed to any image
+            {'left': 98, 'top': 10, 'width': 20, 'height': 20},
+        ]
+        images = [numpy.zeros((200, 200, 3), dtype=numpy.uint8)] + [numpy.zeros((100, 100, 3), dtype=numpy.uint8)] * 3
+        results = self.client.process_mosaic(images, tile_size=100, padding=16)
+        self.assertEqual(1, self.emulator.counts['emotion'])
+        rects = [[f['faceRectangle'] for f in r.raw_result] for r in results]
+        self.assertEqual([
+            # The first image was halved to fit its tile
+            [{'left': 20, 'top': 40, 'width': 60, 'height': 60}],
+            [],
+            [],
+            [{'left': 5, 'top': 5, 'width': 40, 'height': 40}],
+        ], rects)
+
+    def test_mosaics_hold_at_most_max_faces_images(self):
+        images = [numpy.zeros((8, 8, 3), dtype=numpy.uint8)] * (MAX_FACES + 1)
+        results = self.client.process_mosaic(images, tile_size=8, padding=2)
+        self.assertEqual(MAX_FACES + 1, len(results))
+        self.assertEqual(2, self.emulator.counts['emotion'])
+
+    def test_full_mosaic_is_split_and_sent_again(self):
+        self.emulator.face_rectangles = [{'left': i % 8, 'top': i // 8, 'width': 4, 'height': 4}
+                                         for i in range(MAX_FACES)]
+        images = [numpy.zeros((100, 100, 3), dtype=numpy.uint8)] * 2
+        results = self.client.process_mosaic(images, tile_size=100, padding=16)
+        self.assertEqual(3, self.emulator.counts['emotion'])
+        self.assertEqual(1, self.counters.get('truncated'))
+        self.assertEqual([MAX_FACES, MAX_FACES], [len(r.raw_result) for r in results])
+
+class ThrottleTests(unittest.TestCase):
+    def test_throttled_requests_are_retried_quietly(self):
+        with Emulator(seed=1, throttle_rate=0.5, retry_after=0) as emu:
+            client = EmotionClient('key', **emu.emotion_args())
+            output = io.StringIO()
+            with contextlib.redirect_stdout(output):
+                for i in range(5):
+                    client.process_image(bytes([i]) * 64, max_side=None)
+            self.assertGreater(emu.counts['emotion'], 5)
+            self.assertEqual('', output.getvalue())
+
+class ProcessImagesTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.emulator = Emulator()
+        self.emulator.start()
+        self.client = EmotionClient('key', **self.emulator.emotion_args())
+
+    def tearDown(self):
+        self.emulator.stop()
+        shutil.rmtree(self.directory)
+
+    def test_results_errors_and_output(self):
+        paths = []
+        for i in range(4):
+            paths.append(os.path.join(self.directory, '{}.jpg'.format(i)))
+            with open(paths[-1], 'wb') as f:
+                f.write(bytes([i]) * 256)
+        missing = os.path.join(self.directory, 'missing.jpg')
+        output = os.path.join(self.directory, 'faces.jsonl')
+        results = sorted(self.client.process_images(paths + [missing], max_workers=2, output=output))
+        self.assertEqual(paths + [missing], [r.item for r in results])
+        self.assertEqual([None] * 4, [r.error for r in results[:4]])
+        self.assertIsNotNone(results[4].error)
+        self.assertEqual(4, self.emulator.counts['emotion'])
+
+        with open(output, 'r', encoding='utf-8') as f:
+            lines = sorted((json.loads(line) for line in f), key=lambda r: r['index'])
+        self.assertEqual([r.result.raw_result for r in results[:4]], [r['faces'] for r in lines[:4]])
+        self.assertIsNone(lines[4]['faces'])
+        self.assertTrue(lines[4]['error'])
+
+    def _write_images(self, count):
+        data = cv2.imencode('.png', numpy.zeros((400, 800, 3), dtype=numpy.uint8))[1].tobytes()
+        paths = []
+        for i in range(count):
+            paths.append(os.path.join(self.directory, 'same-{}.png'.format(i)))
+            with open(paths[-1], 'wb') as f:
+                f.write(data)
+        return paths
+
+    def test_worker_processes_use_cache(self):
+        paths = self._write_images(3)
+        client = EmotionClient('key', cache=True, **self.emulator.emotion_args())
+        first = sorted(client.process_images(paths, processes=2, max_side=200))
+        sent = self.emulator.counts['emotion']
+        second = sorted(client.process_images(paths, processes=2, max_side=200))
+        self.assertEqual(sent, self.emulator.counts['emotion'])
+        self.assertEqual([r.result.raw_result for r in first], [r.result.raw_result for r in second])
+
+    def test_worker_processes_use_face_detector(self):
+        paths = self._write_images(3)
+        client = EmotionClient('key', face_detector=_FixedDetector([]), **self.emulator.emotion_args())
+        results = list(client.process_images(paths, processes=2, max_side=200))
+        self.assertEqual([[]] * 3, [r.result.raw_result for r in results])
+        self.assertNotIn('emotion', self.emulator.counts)
+
+        detector = _FixedDetector([(100, 40, 200, 200)])
+        client = EmotionClient('key', face_detector=detector, **self.emulator.emotion_args())
+        results = list(client.process_images(paths[:1], processes=2, max_side=200))
+        # The emulator returns a face for each rectangle it was sent, which was reduced
+        # with the image and is scaled back to the original image
+        self.assertEqual([{'left': 100, 'top': 40, 'width': 200, 'height': 200}],
+                         [f['faceRectangle'] for f in results[0].result.raw_result])
+        self.assertEqual(paths[:1], detector.images)
+        self.assertEqual(1, self.emulator.counts['emotion'])
+
+class ContentTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'image.jpg')
+        with open(self.path, 'wb') as f:
+            f.write(b'image data')
+        self.emulator = Emulator()
+        self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        shutil.rmtree(self.directory)
+
+    def test_local_content_is_read_when_used(self):
+        client = EmotionClient('key', **self.emulator.emotion_args())
+        r = client.process_image_from_path(self.path)
+        self.assertEqual(self.path, r.source)
+        self.assertIsNone(r._content)
+        self.assertEqual(b'image data', bytes(r.content))
+        r.drop_content()
+        self.assertRaises(ValueError, getattr, r, 'content')
+
+    def test_content_is_not_kept(self):
+        client = EmotionClient('key', keep_content=False, **self.emulator.emotion_args())
+        r = client.process_image_from_path(self.path)
+        self.assertIsNone(r.source)
+        self.assertRaises(ValueError, getattr, r, 'content')
+
+    def test_remote_content_is_downloaded_when_used(self):
+        url = self.emulator.url + '/images/missing.jpg'
+        client = EmotionClient('key', **self.emulator.emotion_args())
+        r = client.process_image_from_url(url)
+        self.assertEqual(url, r.source)
+        # The emulator does not serve images, so using the content fails
+        self.assertRaises(requests.HTTPError, getattr, r, 'content')
+
+        client.image_cache.put(url, b'cached')
+        r = client.process_image_from_url(url)
+        self.assertEqual(b'cached', bytes(r.content))
+
+    def test_remote_content_is_not_downloaded(self):
+        url = self.emulator.url + '/images/missing.jpg'
+        client = EmotionClient('key', fetch_content=False, **self.emulator.emotion_args())
+        r = client.process_image_from_url(url)
+        self.assertIsNone(r.source)
+        self.assertRaises(ValueError, getattr, r, 'content')
+
+class TypedResultTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'image.jpg')
+        with open(self.path, 'wb') as f:
+            f.write(b'image data')
+        self.emulator = Emulator()
+        self.emulator.start()
+        self.emulator.face_rectangles = [_FACE['faceRectangle']]
+
+    def tearDown(self):
+        self.emulator.stop()
+        shutil.rmtree(self.directory)
+
+    def test_response_is_decoded_when_used(self):
+        client = EmotionClient('key', **self.emulator.emotion_args())
+        r = client.process_image_from_path(self.path, typed=True)
+        self.assertIsInstance(r.faces, results.Faces)
+        self.assertIsNone(r._raw_result)
+        self.assertEqual([(5, 5, 20, 20)], [(f.left, f.top, f.width, f.height) for f in r.faces])
+        self.assertEqual(r.faces[0].strongest, r.get_strongest_emotion())
+        EmotionResultSet([r])
+        self.assertIsNone(r._raw_result)
+        self.assertEqual(client.process_image_from_path(self.path).raw_result, r.raw_result)
+        self.assertEqual(r.raw_result, r.faces.to_dict())
+
+        r = client.process_image_from_url(self.emulator.url + '/a.jpg', fetch_content=False, typed=True)
+        self.assertEqual(1, len(r.faces))
+
+    def test_typed_results_are_cached(self):
+        client = EmotionClient('key', cache=True, **self.emulator.emotion_args())
+        first = client.process_image_from_path(self.path, typed=True)
+        second = client.process_image_from_path(self.path, typed=True)
+        self.assertEqual(1, self.emulator.counts['emotion'])
+        self.assertEqual(first.raw_result, second.raw_result)
+
+@unittest.skipUnless(cv2, 'requires numpy and opencv')
+class ProcessImageTests(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator()
+        self.emulator.start()
+        self.emulator.face_rectangles = [{'left': 100, 'top': 50, 'width': 200, 'height': 100}]
+        self.client = EmotionClient('key', **self.emulator.emotion_args())
+
+    def tearDown(self):
+        self.emulator.stop()
+
+    def test_large_image_is_reduced_and_faces_rescaled(self):
+        image = numpy.zeros((1024, 2048, 3), dtype=numpy.uint8)
+        r = self.client.process_image(image, max_side=512)
+        self.assertEqual([{'left': 400, 'top': 200, 'width': 800, 'height': 400}],
+                         [f['faceRectangle'] for f in r.raw_result])
+        # The result renders the original image
+        self.assertEqual(image.shape, cv2.imdecode(numpy.frombuffer(bytes(r.content), numpy.uint8), 1).shape)
+
+    def test_small_and_encoded_images_are_sent_unchanged(self):
+        encoded = cv2.imencode('.png', numpy.zeros((100, 100, 3), dtype=numpy.uint8))[1].tobytes()
+        for image in (encoded, bytearray(encoded)):
+            r = self.client.process_image(image)
+            self.assertEqual([{'left': 100, 'top': 50, 'width': 200, 'height': 100}],
+                             [f['faceRectangle'] for f in r.raw_result])
+        self.assertRaises(ValueError, self.client.process_image, b'not an image')
+        self.assertEqual(2, self.emulator.counts['emotion'])
+
+class CacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.emulator = Emulator()
+        self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        shutil.rmtree(self.directory)
+
+    def _write(self, name, data):
+        path = os.path.join(self.directory, name)
+        with open(path, 'wb') as f:
+            f.write(data)
+        return path
+
+    def test_identical_images_are_sent_once(self):
+        client = EmotionClient('key', cache=True, **self.emulator.emotion_args())
+        first = client.process_image_from_path(self._write('a.jpg', b'same image'))
+        second = client.process_image_from_path(self._write('b.jpg', b'same image'))
+        self.assertEqual(1, self.emulator.counts['emotion'])
+        self.assertEqual(first.raw_result, second.raw_result)
+        self.assertIsNot(first.raw_result, second.raw_result)
+        client.process_image_from_path(self._write('c.jpg', b'other image'))
+        self.assertEqual(2, self.emulator.counts['emotion'])
+
+    def test_results_persist_in_directory(self):
+        path = self._write('a.jpg', b'image')
+        cache = os.path.join(self.directory, 'cache')
+        EmotionClient('key', cache=EmotionCache(directory=cache), **self.emulator.emotion_args()).process_image_from_path(path)
+        EmotionClient('key', cache=EmotionCache(directory=cache), **self.emulator.emotion_args()).process_image_from_path(path)
+        self.assertEqual(1, self.emulator.counts['emotion'])
+
+    @unittest.skipUnless(cv2, 'requires numpy and opencv')
+    def test_resized_copy_reuses_scaled_result(self):
+        self.emulator.face_rectangles = [{'left': 40, 'top': 20, 'width': 80, 'height': 80}]
+        image = numpy.tile(numpy.arange(0, 256, 2, dtype=numpy.uint8), (128, 2))
+        image = cv2.cvtColor(image, cv2.COLOR_GRAY2BGR)
+        large = self._write('large.png', cv2.imencode('.png', image)[1].tobytes())
+        small = self._write('small.jpg', cv2.imencode('.jpg', cv2.resize(image, (128, 64)))[1].tobytes())
+
+        client = EmotionClient('key', cache=EmotionCache(max_distance=6), **self.emulator.emotion_args())
+        client.process_image_from_path(large)
+        r = client.process_image_from_path(small)
+        self.assertEqual(1, self.emulator.counts['emotion'])
+        self.assertEqual([{'left': 20, 'top': 10, 'width': 40, 'height': 40}], [f['faceRectangle'] for f in r.raw_result])
+
+def _face(left, **scores):
+    return {'faceRectangle': {'left': left, 'top': 0, 'width': 10, 'height': 10}, 'scores': scores}
+
+@unittest.skipUnless(numpy, 'requires numpy')
+class ResultSetTests(unittest.TestCase):
+    def setUp(self):
+        self.set = EmotionResultSet([
+            EmotionResult([_face(1, happiness=0.75, anger=0.25), _face(2, anger=1.0)]),
+            [],
+            results.Faces.from_dict([_face(3, happiness=0.5, neutral=0.5)]),
+        ], ids=['a', 'b', 'c'])
+
+    def test_columns(self):
+        self.assertEqual(3, len(self.set))
+        self.assertEqual([0, 0, 2], self.set.image.tolist())
+        self.assertEqual([1, 2, 3], self.set.rects[:, 0].tolist())
+        self.assertEqual(['happiness', 'anger', 'happiness'], self.set.strongest_names())
+        self.assertEqual([2, 0, 1], self.set.face_counts().tolist())
+        self.assertEqual(2, self.set.emotion_counts()['happiness'])
+        self.assertEqual([True, True, False], self.set.above(0.7).tolist())
+        self.assertEqual([False, True, False], self.set.above(0.5, 'anger').tolist())
+        self.assertAlmostEqual(1.25 / 3, self.set.mean_scores()['happiness'], places=6)
+
+    def test_per_image(self):
+        happiness = EmotionResultSet.EMOTIONS.index('happiness')
+        for stat, expected in (('sum', [0.75, 0.0, 0.5]), ('mean', [0.375, None, 0.5]), ('max', [0.75, None, 0.5])):
+            values = self.set.per_image(stat)[:, happiness].tolist()
+            self.assertEqual(expected, [None if v != v else v for v in values], stat)
+        self.assertRaises(ValueError, self.set.per_image, 'median')
+
+    def test_to_csv(self):
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'faces.csv')
+            self.set.to_csv(path)
+            with open(path, 'r', encoding='utf-8', newline='') as f:
+                rows = list(csv.DictReader(f))
+        finally:
+            shutil.rmtree(directory)
+        self.assertEqual(['a', 'a', 'c'], [r['image_id'] for r in rows])
+        self.assertEqual(1.0, float(rows[1]['anger']))
+
+@unittest.skipUnless(cv2, 'requires numpy and opencv')
+class VideoTests(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator()
+        self.emulator.start()
+        self.emulator.face_rectangles = [{'left': 10, 'top': 10, 'width': 40, 'height': 40}]
+        self.client = EmotionClient('key', **self.emulator.emotion_args())
+
+    def tearDown(self):
+        self.emulator.stop()
+
+    def test_unchanged_frames_are_not_sent(self):
+        black = numpy.zeros((64, 64, 3), dtype=numpy.uint8)
+        white = numpy.full((64, 64, 3), 255, dtype=numpy.uint8)
+        frames = list(self.client.process_video([black] * 15 + [white] * 15, frame_rate=10))
+        self.assertEqual([0, 10, 20], [f.index for f in frames])
+        self.assertEqual([0.0, 1.0, 2.0], [f.time for f in frames])
+        self.assertEqual([True, False, True], [f.analyzed for f in frames])
+        self.assertEqual(2, self.emulator.counts['emotion'])
+        # The same face is tracked across frames
+        self.assertEqual([[0], [0], [0]], [[face['trackId'] for face in f.faces] for f in frames])
+        series = face_time_series(frames)
+        self.assertEqual([0], list(series))
+        self.assertEqual([0.0, 1.0, 2.0], series[0]['time'])
+
+    def test_frames_are_sent_after_max_skip_seconds(self):
+        black = numpy.zeros((64, 64, 3), dtype=numpy.uint8)
+        frames = list(self.client.process_video(((t / 2, black) for t in range(8)), max_skip_seconds=1.5))
+        self.assertEqual([0.0, 1.0, 2.0, 3.0], [f.time for f in frames])
+        self.assertEqual([True, False, True, False], [f.analyzed for f in frames])
+
+class _FixedDetector(object):
+    def __init__(self, faces):
+        self.faces = faces
+        self.images = []
+
+    def detect(self, image):
+        self.images.append(image)
+        return self.faces
+
+@unittest.skipUnless(cv2, 'requires numpy and opencv')
+class FaceDetectorTests(unittest.TestCase):
+    def setUp(self):
+        self.emulator = Emulator()
+        self.emulator.start()
+        self.counters = {}
+        metrics.add_hook(self._record)
+
+    def tearDown(self):
+        metrics.remove_hook(self._record)
+        self.emulator.stop()
+
+    def _record(self, span):
+        for name, value in span.counters.items():
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def test_images_without_faces_are_not_sent(self):
+        client = EmotionClient('key', face_detector=True, **self.emulator.emotion_args())
+        self.assertIsInstance(client.face_detector, FaceDetector)
+        r = client.process_image(numpy.zeros((200, 200, 3), dtype=numpy.uint8))
+        self.assertEqual([], r.raw_result)
+        self.assertNotIn('emotion', self.emulator.counts)
+        self.assertEqual(1, self.counters['skipped'])
+
+    def test_detected_faces_are_sent_in_upload_coordinates(self):
+        detector = _FixedDetector([(100, 40, 200, 200)])
+        client = EmotionClient('key', face_detector=detector, **self.emulator.emotion_args())
+        r = client.process_image(numpy.zeros((1024, 2048, 3), dtype=numpy.uint8), max_side=512)
+        # The emulator returns a face for each rectangle it was sent
+        self.assertEqual([{'left': 100, 'top': 40, 'width': 200, 'height': 200}],
+                         [f['faceRectangle'] for f in r.raw_result])
+        self.assertEqual(1, len(detector.images))
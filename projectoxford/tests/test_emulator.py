@@ -0,0 +1,95 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import os
+import random
+import shutil
+import tempfile
+import time
+import unittest
+import unittest.mock
+
+import requests
+
+from projectoxford.emulator import Behavior, Emulator, _load_target, generate_load
+from projectoxford.luis import LuisClient
+from projectoxford.speech import SpeechClient
+
+class BehaviorTests(unittest.TestCase):
+    def test_outcomes(self):
+        rnd = random.Random(0)
+        self.assertEqual({None}, {Behavior().outcome(rnd) for _ in range(100)})
+        self.assertEqual({429}, {Behavior(throttle_rate=1.0).outcome(rnd) for _ in range(100)})
+        self.assertEqual({500}, {Behavior(failure_rate=1.0).outcome(rnd) for _ in range(100)})
+        self.assertEqual({429, 500}, {Behavior(0, 0, 0.5, 0.5).outcome(rnd) for _ in range(100)})
+
+    def test_delay(self):
+        rnd = random.Random(0)
+        self.assertEqual(0, Behavior().delay(rnd))
+        self.assertEqual(0.5, Behavior(latency=0.5).delay(rnd))
+        delays = {Behavior(latency=0.5, jitter=1.0).delay(rnd) for _ in range(10)}
+        self.assertEqual(10, len(delays))
+
+class EmulatorTests(unittest.TestCase):
+    def test_speech_and_luis(self):
+        with Emulator(keys=['key']) as emu:
+            emu.transcript = 'good morning'
+            emu.intents = {'morning': 'Greeting'}
+            sc = SpeechClient('key', **emu.speech_args())
+            wav = sc.say_to_wav('good morning')
+            self.assertEqual(b'RIFF', wav[:4])
+            self.assertEqual('good morning', sc.recognize(wav))
+            self.assertEqual('Greeting', LuisClient(emu.luis_url()).query('good morning')[0])
+            self.assertEqual(1, emu.counts['synthesize'])
+            self.assertEqual(1, emu.counts['recognize'])
+
+    def test_invalid_key_is_rejected(self):
+        with Emulator(keys=['key']) as emu:
+            lc = LuisClient(emu.luis_url(key='other'))
+            with self.assertRaises(requests.HTTPError) as cm:
+                lc.query_raw('hello')
+            self.assertEqual(401, cm.exception.response.status_code)
+
+    def test_per_service_behavior(self):
+        with Emulator() as emu:
+            emu.behaviors['luis'] = Behavior(failure_rate=1.0)
+            self.assertRaises(requests.HTTPError, LuisClient(emu.luis_url()).query_raw, 'hello')
+            sc = SpeechClient('key', **emu.speech_args())
+            self.assertEqual(b'RIFF', sc.say_to_wav('hello')[:4])
+
+    def test_latency(self):
+        with Emulator(latency=0.2) as emu:
+            start = time.monotonic()
+            LuisClient(emu.luis_url()).query_raw('hello')
+            self.assertGreaterEqual(time.monotonic() - start, 0.2)
+
+class LoadTests(unittest.TestCase):
+    def test_generate_load(self):
+        calls = []
+
+        def fn(i):
+            calls.append(i)
+            if i % 2:
+                raise KeyError(i)
+
+        report = generate_load(fn, qps=100, duration=0.1)
+        self.assertEqual(list(range(10)), sorted(calls))
+        self.assertEqual(10, report['requests'])
+        self.assertEqual(5, report['errors'])
+        self.assertEqual({'KeyError': 5}, report['error_types'])
+        self.assertLessEqual(report['p50'], report['max'])
+
+    def test_load_targets_leave_no_files(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with unittest.mock.patch.object(tempfile, 'tempdir', directory), Emulator() as emu:
+                for service in ('luis', 'emotion', 'synthesize', 'recognize'):
+                    report = generate_load(_load_target(service, emu), qps=50, duration=0.1)
+                    self.assertEqual(0, report['errors'], service)
+            self.assertEqual([], os.listdir(directory))
+        finally:
+            shutil.rmtree(directory)
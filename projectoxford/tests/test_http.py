@@ -0,0 +1,108 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import threading
+import time
+import unittest
+
+import requests
+
+from projectoxford import _http
+from projectoxford.emulator import Emulator
+from projectoxford.luis import LuisClient
+
+class DeadlineTests(unittest.TestCase):
+    def test_unlimited(self):
+        d = _http.Deadline()
+        self.assertIsNone(d.remaining())
+        self.assertEqual((_http.CONNECT_TIMEOUT, _http.READ_TIMEOUT), d.timeout())
+        d.check()
+
+    def test_timeout_never_exceeds_remaining(self):
+        connect, read = _http.Deadline(2.0).timeout()
+        self.assertLessEqual(connect, 2.0)
+        self.assertLessEqual(read, 2.0)
+
+    def test_expired(self):
+        d = _http.Deadline(0.01)
+        time.sleep(0.02)
+        self.assertRaises(requests.Timeout, d.check)
+        self.assertRaises(requests.Timeout, d.timeout)
+
+    def test_query_exceeding_deadline_times_out(self):
+        with Emulator(latency=1.0) as emu:
+            lc = LuisClient(emu.luis_url(), timeout=0.2)
+            start = time.monotonic()
+            self.assertRaises(requests.Timeout, lc.query_raw, 'hello')
+            self.assertLess(time.monotonic() - start, 0.9)
+
+class HedgeTests(unittest.TestCase):
+    def test_coerce(self):
+        self.assertIsNone(_http.Hedge.coerce(None))
+        self.assertIsNone(_http.Hedge.coerce(False))
+        self.assertEqual(0.95, _http.Hedge.coerce(True).percentile)
+        self.assertEqual(0.5, _http.Hedge.coerce(0.5).percentile)
+        self.assertRaises(ValueError, _http.Hedge, 1.5)
+
+    def test_no_duplicate_until_enough_samples(self):
+        hedge = _http.Hedge(min_samples=3)
+        self.assertIsNone(hedge.delay())
+        calls = []
+        for _ in range(3):
+            hedge.call(lambda: calls.append(1))
+        self.assertEqual(3, len(calls))
+        self.assertIsNotNone(hedge.delay())
+
+    def test_slow_call_is_duplicated(self):
+        hedge = _http.Hedge(percentile=0.5, min_samples=1)
+        hedge.record(0.01)
+        calls = []
+        lock = threading.Lock()
+
+        def fn():
+            with lock:
+                calls.append(1)
+                first = len(calls) == 1
+            if first:
+                time.sleep(1.0)
+                return 'slow'
+            return 'fast'
+
+        start = time.monotonic()
+        self.assertEqual('fast', hedge.call(fn))
+        self.assertLess(time.monotonic() - start, 0.9)
+        self.assertEqual(2, len(calls))
+
+    def test_first_error_raised_when_every_attempt_fails(self):
+        hedge = _http.Hedge(percentile=0.5, min_samples=1)
+        hedge.record(0.01)
+        errors = iter([KeyError('first'), KeyError('second')])
+        lock = threading.Lock()
+
+        def fn():
+            with lock:
+                error = next(errors)
+            time.sleep(0.05)
+            raise error
+
+        with self.assertRaises(KeyError) as cm:
+            hedge.call(fn)
+        self.assertIn(cm.exception.args[0], ('first', 'second'))
+
+    def test_deadline_bounds_hedged_call(self):
+        hedge = _http.Hedge(percentile=0.5, min_samples=1)
+        hedge.record(0.01)
+        start = time.monotonic()
+        self.assertRaises(requests.Timeout, hedge.call, lambda: time.sleep(1.0), _http.Deadline(0.2))
+        self.assertLess(time.monotonic() - start, 0.9)
+
+    def test_hedged_client_against_slow_service(self):
+        with Emulator(latency=0.01) as emu:
+            lc = LuisClient(emu.luis_url(), hedge=_http.Hedge(percentile=0.5, min_samples=5))
+            for _ in range(10):
+                self.assertEqual('None', lc.query_raw('hello', typed=True).intent)
+            self.assertGreaterEqual(emu.counts['luis'], 10)
@@ -0,0 +1,79 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import time
+import unittest
+
+import requests
+
+from projectoxford.emulator import Emulator
+from projectoxford.keys import KeyPool
+from projectoxford.luis import LuisClient
+
+class KeyPoolTests(unittest.TestCase):
+    def test_throttled_key_is_ejected_for_retry_after(self):
+        pool = KeyPool(['a', 'b'])
+        key = pool.acquire()
+        self.assertTrue(pool.release(key, 429, retry_after=30))
+        self.assertEqual([k for k in ['a', 'b'] if k != key], pool.healthy())
+        other = pool.acquire()
+        self.assertNotEqual(key, other)
+        pool.release(other)
+
+    def test_throttled_key_without_retry_after_returns_quickly(self):
+        pool = KeyPool(['a'], eject_seconds=0.1)
+        pool.release(pool.acquire(), 429)
+        self.assertEqual([], pool.healthy())
+        start = time.monotonic()
+        pool.release(pool.acquire(timeout=5))
+        self.assertLess(time.monotonic() - start, 1.0)
+
+    def test_rejected_key_is_ejected_while_another_remains(self):
+        pool = KeyPool(['a', 'b'])
+        self.assertTrue(pool.release(pool.acquire(), 401))
+        remaining = pool.healthy()
+        self.assertEqual(1, len(remaining))
+        # The last healthy key is kept so that invalid pools fail quickly
+        self.assertFalse(pool.release(pool.acquire(), 403))
+        self.assertEqual(remaining, pool.healthy())
+
+    def test_restore(self):
+        pool = KeyPool(['a', 'b'])
+        pool.release('a', 429, retry_after=60)
+        pool.restore('a')
+        self.assertEqual(['a', 'b'], pool.healthy())
+
+    def test_acquire_times_out_when_every_key_is_ejected(self):
+        pool = KeyPool(['a'])
+        pool.release(pool.acquire(), 429, retry_after=60)
+        self.assertRaises(RuntimeError, pool.acquire, timeout=0.1)
+
+    def test_quota_limits_calls_per_period(self):
+        pool = KeyPool(['a'], quota=2, period=0.3)
+        start = time.monotonic()
+        for _ in range(3):
+            pool.release(pool.acquire())
+        self.assertGreaterEqual(time.monotonic() - start, 0.25)
+
+class KeyPoolServiceTests(unittest.TestCase):
+    def test_invalid_key_is_ejected_and_query_retried(self):
+        with Emulator(keys=['good']) as emu:
+            lc = LuisClient(emu.luis_url(key='KEY'), keys=['bad', 'good'])
+            for _ in range(4):
+                self.assertEqual('hello', lc.query_raw('hello')['query'])
+            healthy = lc.urls.healthy()
+            self.assertEqual(1, len(healthy))
+            self.assertIn('subscription-key=good', healthy[0])
+
+    def test_throttled_keys_honour_retry_after(self):
+        with Emulator(throttle_rate=1.0, retry_after=30) as emu:
+            lc = LuisClient(emu.luis_url(key='KEY'), keys=['a', 'b'], timeout=0.5)
+            # Each key is tried once, then the query waits for a key to
+            # return until its deadline passes
+            self.assertRaises(requests.Timeout, lc.query_raw, 'hello')
+            self.assertEqual([], lc.urls.healthy())
+            self.assertEqual(2, emu.counts['luis'])
@@ -0,0 +1,117 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import requests
+
+from projectoxford import _http
+from projectoxford.emulator import Emulator, _make_pcm_wav
+from projectoxford.luis import IntentIndex, LuisClient, understand
+from projectoxford.speech import SpeechClient
+
+def _response(intent, entities=()):
+    return {
+        'intents': [{'intent': intent, 'score': 0.9}],
+        'entities': [{'entity': e, 'type': t} for e, t in entities],
+    }
+
+class IntentIndexTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_exact_and_similar_lookup(self):
+        index = IntentIndex()
+        index.add('Turn on the kitchen lights', _response('LightsOn', [('kitchen', 'Room')]))
+        index.add('What is the weather like', _response('Weather'))
+        self.assertEqual((1.0, 'LightsOn', ['kitchen'], ['Room']), index.lookup('turn on the kitchen lights!'))
+        score, intent, _, _ = index.lookup('turn on the kitchen light')
+        self.assertEqual('LightsOn', intent)
+        self.assertLess(score, 1.0)
+        self.assertIsNone(index.lookup('zzz'))
+
+    def test_responses_without_intent_are_ignored(self):
+        index = IntentIndex()
+        index.add('hello', {'intents': []})
+        self.assertEqual(0, len(index))
+
+    def test_oldest_entries_are_removed(self):
+        index = IntentIndex(max_entries=2)
+        for text in ('one', 'two', 'three'):
+            index.add(text, _response(text))
+        self.assertEqual(2, len(index))
+        self.assertNotEqual('one', (index.lookup('one') or (0, None))[1])
+
+    def test_save_and_load(self):
+        index = IntentIndex(max_entries=10)
+        index.add('turn on the lights', _response('LightsOn', [('lights', 'Device')]))
+        index.add('play some music', _response('Play'))
+        path = os.path.join(self.directory, 'index.json')
+        index.save(path)
+
+        loaded = IntentIndex.load(path)
+        self.assertEqual(10, loaded.max_entries)
+        self.assertEqual(2, len(loaded))
+        self.assertEqual(index.lookup('turn on the lights'), loaded.lookup('turn on the lights'))
+        self.assertEqual('Play', loaded.lookup('play music')[1])
+
+    def test_common_features_do_not_hide_the_closest_utterance(self):
+        index = IntentIndex()
+        for i in range(3000):
+            index.add('please turn on the light number {}'.format(i), _response('On{}'.format(i)))
+        self.assertEqual('On1234', index.lookup('please turn on the light numbr 1234')[1])
+        self.assertIsNotNone(index.lookup('please turn on the light'))
+
+    def test_client_answers_from_index(self):
+        with Emulator() as emu:
+            emu.intents = {'lights': 'LightsOn'}
+            lc = LuisClient(emu.luis_url(), intent_index=IntentIndex())
+            self.assertEqual('LightsOn', lc.query('turn on the lights')[0])
+            self.assertEqual(1, emu.counts['luis'])
+            self.assertEqual('LightsOn', lc.query('Turn on the lights.')[0])
+            self.assertEqual(1, emu.counts['luis'])
+
+class UnderstandTests(unittest.TestCase):
+    def test_hypothesis_with_the_clearest_intent_is_chosen(self):
+        with Emulator() as emu:
+            # The emulator also offers 'beta alpha' and 'alpha' as less
+            # likely hypotheses
+            emu.transcript = 'alpha beta'
+            emu.intents = {'alpha': 'None', 'beta': 'Beta'}
+            sc = SpeechClient('key', **emu.speech_args())
+            lc = LuisClient(emu.luis_url())
+            u = understand(sc, lc, _make_pcm_wav(0.5))
+            self.assertEqual(('beta alpha', 'low', 'Beta'), (u.text, u.level, u.intent))
+            self.assertEqual(3, emu.counts['luis'])
+            self.assertEqual('alpha beta', u.recognition.best.text)
+
+            u = understand(sc, lc, _make_pcm_wav(0.5), n_best=1)
+            self.assertEqual(('alpha beta', 'None'), (u.text, u.intent))
+
+    def test_hedged_queries(self):
+        with Emulator(latency=0.05) as emu:
+            emu.transcript = 'alpha beta'
+            emu.intents = {'beta': 'Beta'}
+            hedge = _http.Hedge(percentile=0.5, min_samples=1)
+            hedge.record(0.001)
+            sc = SpeechClient('key', **emu.speech_args())
+            lc = LuisClient(emu.luis_url(), hedge=hedge)
+            self.assertEqual('Beta', understand(sc, lc, _make_pcm_wav(0.5), timeout=5).intent)
+
+    def test_error_raised_when_every_query_fails(self):
+        with Emulator() as emu:
+            emu.transcript = 'alpha beta'
+            emu.behaviors['luis'].failure_rate = 1.0
+            sc = SpeechClient('key', **emu.speech_args())
+            lc = LuisClient(emu.luis_url())
+            self.assertRaises(requests.HTTPError, understand, sc, lc, _make_pcm_wav(0.5))
@@ -0,0 +1,122 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import contextlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from projectoxford.__main__ import main
+from projectoxford.emulator import Emulator
+
+class BulkJobTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.manifest = os.path.join(self.directory, 'manifest.txt')
+        self.output = os.path.join(self.directory, 'output.jsonl')
+        self.emulator = Emulator()
+        self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        shutil.rmtree(self.directory)
+
+    def _write_manifest(self, lines):
+        with open(self.manifest, 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+
+    def _main(self, *args):
+        stderr = io.StringIO()
+        with contextlib.redirect_stderr(stderr):
+            try:
+                return main(['luis', self.manifest, '--url', self.emulator.luis_url()] + list(args)), ''
+            except SystemExit as ex:
+                return ex.code, stderr.getvalue()
+
+    def _records(self):
+        with open(self.output, 'r', encoding='utf-8') as f:
+            return [json.loads(line) for line in f]
+
+    def test_interrupted_job_resumes(self):
+        self._write_manifest(['utterance {}'.format(i) for i in range(5)])
+        self.assertEqual((0, ''), self._main('-o', self.output))
+        self.assertEqual(5, self.emulator.counts['luis'])
+
+        # Keep two journalled items and leave a partly written record
+        with open(self.output + '.state', 'rb') as f:
+            lines = f.read().split(b'\n')
+        kept = [json.loads(line.decode('utf-8')) for line in lines[1:3]]
+        with open(self.output + '.state', 'wb') as f:
+            f.write(b'\n'.join(lines[:3]) + b'\n{"id": ')
+        with open(self.output, 'ab') as f:
+            f.write(b'{"id": 9, "text"')
+
+        self.assertEqual((0, ''), self._main('-o', self.output))
+        self.assertEqual(8, self.emulator.counts['luis'])
+        records = self._records()
+        self.assertEqual([1, 2, 3, 4, 5], sorted(r['id'] for r in records))
+        self.assertEqual([e['id'] for e in kept], [r['id'] for r in records[:2]])
+
+        self.assertEqual((0, ''), self._main('-o', self.output))
+        self.assertEqual(8, self.emulator.counts['luis'])
+
+    def test_failed_items_are_retried_on_request(self):
+        self._write_manifest(['one', 'two'])
+        self.emulator.behaviors['luis'].failure_rate = 1.0
+        self.assertEqual((1, ''), self._main('-o', self.output))
+        self.emulator.behaviors['luis'].failure_rate = 0.0
+        self.assertEqual((0, ''), self._main('-o', self.output))
+        self.assertEqual(2, self.emulator.counts['luis'])
+        self.assertEqual((0, ''), self._main('-o', self.output, '--retry-errors'))
+        self.assertEqual(4, self.emulator.counts['luis'])
+        self.assertEqual([None, None], [r['error'] for r in self._records()[-2:]])
+
+    def test_output_without_state_is_not_overwritten(self):
+        self._write_manifest(['one'])
+        with open(self.output, 'w', encoding='utf-8') as f:
+            f.write('precious\n')
+        code, message = self._main('-o', self.output)
+        self.assertEqual(2, code)
+        self.assertIn('--force', message)
+        with open(self.output, 'r', encoding='utf-8') as f:
+            self.assertEqual('precious\n', f.read())
+
+        self.assertEqual((0, ''), self._main('-o', self.output, '--force'))
+        self.assertEqual(['one'], [r['text'] for r in self._records()])
+
+    def test_manifest_ids(self):
+        self._write_manifest(['{"id": "a", "text": "one"}', '{"id": 7, "text": "two"}'])
+        self.assertEqual((0, ''), self._main('-o', self.output))
+        self.assertEqual([7, 'a'], sorted((r['id'] for r in self._records()), key=str))
+
+        for id in ('[1]', '{"a": 1}', 'true', '1.5'):
+            self._write_manifest(['{{"id": {}, "text": "one"}}'.format(id)])
+            code, message = self._main()
+            self.assertEqual(2, code, id)
+            self.assertIn('line 1 of', message)
+
+        self._write_manifest(['{"id": "a", "text": "one"}', '{"id": "a", "text": "two"}'])
+        code, message = self._main()
+        self.assertEqual(2, code)
+        self.assertIn('repeats id', message)
+
+    def test_rate(self):
+        self._write_manifest(['one', 'two'])
+        for rate in ('0', '-1', '2.5'):
+            code, message = self._main('--rate', rate)
+            self.assertEqual(2, code, rate)
+            self.assertIn('--rate', message)
+
+        # Rates below one call per second are not rounded to zero
+        start = time.monotonic()
+        self.assertEqual((0, ''), self._main('-o', self.output, '--rate', '0.9'))
+        self.assertGreaterEqual(time.monotonic() - start, 1.0)
+        self.assertEqual(2, len(self._records()))
@@ -0,0 +1,95 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import unittest
+import unittest.mock
+
+import requests
+
+from projectoxford import metrics
+from projectoxford.emulator import Emulator
+from projectoxford.luis import LuisClient
+
+class MetricsTests(unittest.TestCase):
+    def setUp(self):
+        self.spans = []
+        metrics.add_hook(self.spans.append)
+
+    def tearDown(self):
+        metrics.remove_hook(self.spans.append)
+
+    def test_no_span_without_hooks(self):
+        metrics.remove_hook(self.spans.append)
+        self.assertIs(metrics.NULL_SPAN, metrics.start('op'))
+        self.assertFalse(metrics.start('op'))
+
+    def test_span(self):
+        with metrics.start('op') as span:
+            with span.phase('work'):
+                pass
+            span.count('items', 2)
+            span.count('items')
+        self.assertEqual([span], self.spans)
+        self.assertEqual(3, span.counters['items'])
+        self.assertIn('work', span.phases)
+        self.assertIsNotNone(span.duration)
+        self.assertIsNone(span.error)
+
+    def test_error_is_recorded(self):
+        with self.assertRaises(KeyError):
+            with metrics.start('op'):
+                raise KeyError('x')
+        self.assertIsInstance(self.spans[0].error, KeyError)
+
+    def test_hook_errors_do_not_escape(self):
+        def broken(span):
+            raise ValueError('broken hook')
+
+        metrics.add_hook(broken)
+        try:
+            with unittest.mock.patch('sys.excepthook') as excepthook:
+                with metrics.start('op'):
+                    pass
+                with self.assertRaises(KeyError):
+                    with metrics.start('op'):
+                        raise KeyError('x')
+        finally:
+            metrics.remove_hook(broken)
+        self.assertEqual(2, len(self.spans))
+        self.assertEqual([ValueError, ValueError], [c[0][0] for c in excepthook.call_args_list])
+
+    def test_service_calls_are_reported(self):
+        with Emulator() as emu:
+            lc = LuisClient(emu.luis_url())
+            lc.query_raw('hello')
+            emu.behaviors['luis'].failure_rate = 1.0
+            self.assertRaises(requests.HTTPError, lc.query_raw, 'hello')
+        self.assertEqual(['luis.query', 'luis.query'], [s.operation for s in self.spans])
+        ok, failed = self.spans
+        self.assertGreater(ok.counters['bytes_received'], 0)
+        self.assertIn('wait', ok.phases)
+        self.assertIn('parse', ok.phases)
+        self.assertIsNone(ok.error)
+        self.assertIsInstance(failed.error, requests.HTTPError)
+
+class PrometheusTests(unittest.TestCase):
+    def test_export(self):
+        collector = metrics.enable_prometheus('test')
+        try:
+            with metrics.start('a "b"') as span:
+                span.add('wait', 0.5)
+                span.count('retries')
+            with self.assertRaises(ValueError):
+                with metrics.start('a "b"'):
+                    raise ValueError()
+        finally:
+            metrics.remove_hook(collector)
+        text = collector.export()
+        self.assertIn('test_calls_total{operation="a \\"b\\""} 2\n', text)
+        self.assertIn('test_errors_total{operation="a \\"b\\""} 1\n', text)
+        self.assertIn('test_phase_seconds_total{operation="a \\"b\\"",phase="wait"} 0.500000\n', text)
+        self.assertIn('# TYPE test_retries_total counter\ntest_retries_total{operation="a \\"b\\""} 1\n', text)
@@ -0,0 +1,97 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+from projectoxford.emotion import EmotionClient
+from projectoxford.emulator import Emulator
+from projectoxford.operations import OperationManager
+
+class OperationManagerTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.state_path = os.path.join(self.directory, 'state.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _manager(self, submitted, polls_until_done=2):
+        polls = {}
+        lock = threading.Lock()
+
+        def submit(item):
+            with lock:
+                submitted.append(item)
+            return 'op-' + item
+
+        def poll(location):
+            with lock:
+                polls[location] = polls.get(location, 0) + 1
+                if polls[location] < polls_until_done:
+                    return None
+            if location == 'op-bad':
+                raise RuntimeError('failed')
+            return location.upper()
+
+        return OperationManager(submit, poll, self.state_path, interval=0.01, max_interval=0.02)
+
+    def test_results_and_errors(self):
+        submitted = []
+        results = {r.item: r for r in self._manager(submitted).run(['a', 'b', 'bad'])}
+        self.assertEqual(['a', 'b', 'bad'], sorted(submitted))
+        self.assertEqual('OP-A', results['a'].result)
+        self.assertEqual('OP-B', results['b'].result)
+        self.assertIsInstance(results['bad'].error, RuntimeError)
+
+    def test_interrupted_run_resumes_without_submitting_again(self):
+        submitted = []
+        it = self._manager(submitted, polls_until_done=3).run(['a', 'b', 'c'])
+        first = next(it)
+        it.close()
+        self.assertEqual(['a', 'b', 'c'], sorted(submitted))
+
+        submitted = []
+        results = list(self._manager(submitted).run(['a', 'b', 'c', 'd']))
+        self.assertEqual(['d'], submitted)
+        self.assertEqual({'a': 'OP-A', 'b': 'OP-B', 'c': 'OP-C', 'd': 'OP-D'},
+                         {r.item: r.result for r in results})
+        self.assertEqual(first.result, {r.item: r.result for r in results}[first.item])
+
+class VideoOperationTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_process_videos_resumes(self):
+        state_path = os.path.join(self.directory, 'videos.json')
+        videos = ['https://example.com/a.mp4', 'https://example.com/b.mp4']
+        with Emulator() as emu:
+            emu.video_seconds = 0.2
+            client = EmotionClient('key', **emu.emotion_args())
+            it = client.process_videos(videos, state_path, interval=0.05, max_interval=0.1)
+            first = next(it)
+            it.close()
+            self.assertIsNone(first.error)
+            self.assertEqual(2, emu.counts['video'])
+
+            client = EmotionClient('key', **emu.emotion_args())
+            results = list(client.process_videos(videos, state_path, interval=0.05, max_interval=0.1))
+            self.assertEqual(2, emu.counts['video'])
+            self.assertEqual(sorted(videos), sorted(r.item for r in results))
+            self.assertTrue(all(r.error is None and r.result['fragments'] for r in results))
+
+    def test_operation_requires_the_submitting_key(self):
+        with Emulator() as emu:
+            operation = EmotionClient('a', **emu.emotion_args()).submit_video('https://example.com/a.mp4')
+            other = EmotionClient('b', **emu.emotion_args())
+            self.assertRaises(ValueError, other.get_video_operation, operation)
@@ -0,0 +1,78 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import cv2
+    import numpy
+except ImportError:
+    cv2 = numpy = None
+
+from projectoxford.emotion import EmotionClient
+from projectoxford.emulator import Emulator
+from projectoxford.preprocess import prepare_images
+
+@unittest.skipUnless(cv2, 'requires numpy and opencv')
+class PrepareImagesTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.large = numpy.zeros((400, 800, 3), dtype=numpy.uint8)
+        self.small = cv2.imencode('.png', numpy.zeros((50, 50, 3), dtype=numpy.uint8))[1].tobytes()
+        self.path = os.path.join(self.directory, 'image.png')
+        cv2.imwrite(self.path, self.large)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def _shared_blocks(self):
+        try:
+            return set(os.listdir('/dev/shm'))
+        except OSError:
+            return set()
+
+    def test_prepare(self):
+        before = self._shared_blocks()
+        images = [self.large, self.small, self.path, 'https://example.com/a.jpg', b'not an image']
+        prepared = sorted(prepare_images(images, max_side=200, processes=2), key=lambda p: p.index)
+        try:
+            self.assertEqual(list(range(5)), [p.index for p in prepared])
+            for p in prepared[0], prepared[2]:
+                self.assertIsNone(p.error)
+                self.assertEqual((4.0, 4.0), p.scale)
+                decoded = cv2.imdecode(numpy.frombuffer(p.data, dtype=numpy.uint8), cv2.IMREAD_COLOR)
+                self.assertEqual((100, 200, 3), decoded.shape)
+            self.assertEqual(self.small, bytes(prepared[1].data))
+            self.assertEqual((1.0, 1.0), prepared[1].scale)
+            self.assertIsNone(prepared[3].data)
+            self.assertIsNone(prepared[3].error)
+            self.assertIsInstance(prepared[4].error, ValueError)
+        finally:
+            for p in prepared:
+                p.release()
+        self.assertEqual(before, self._shared_blocks())
+
+    def test_abandoned_images_are_released(self):
+        before = self._shared_blocks()
+        it = prepare_images([self.large] * 6, max_side=200, processes=2, queue_size=4)
+        next(it).release()
+        it.close()
+        self.assertEqual(before, self._shared_blocks())
+
+    def test_process_images_in_worker_processes(self):
+        with Emulator() as emu:
+            emu.face_rectangles = [{'left': 10, 'top': 10, 'width': 50, 'height': 50}]
+            client = EmotionClient('key', **emu.emotion_args())
+            results = sorted(client.process_images([self.path, self.small], processes=2, max_side=400))
+            self.assertEqual([None, None], [r.error for r in results])
+            self.assertEqual([{'left': 20, 'top': 20, 'width': 100, 'height': 100}],
+                             [f['faceRectangle'] for f in results[0].result.raw_result])
+            self.assertEqual([{'left': 10, 'top': 10, 'width': 50, 'height': 50}],
+                             [f['faceRectangle'] for f in results[1].result.raw_result])
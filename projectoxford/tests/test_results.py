@@ -0,0 +1,93 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import json
+import unittest
+import unittest.mock
+
+from projectoxford import results
+from projectoxford.emulator import Emulator, _make_pcm_wav
+from projectoxford.luis import LuisClient
+from projectoxford.speech import SpeechClient
+
+class RecordTests(unittest.TestCase):
+    def test_face(self):
+        face = results.Face.from_dict({
+            'faceRectangle': {'left': 1, 'top': 2, 'width': 3, 'height': 4},
+            'scores': {'happiness': 0.75, 'neutral': 0.25},
+        })
+        self.assertEqual((1, 2, 3, 4), (face.left, face.top, face.width, face.height))
+        self.assertEqual('happiness', face.strongest)
+        self.assertEqual(0.0, face.scores['anger'])
+        self.assertEqual(face, results.Face(1, 2, 3, 4, face.values))
+        self.assertEqual(hash(face), hash(results.Face(1, 2, 3, 4, face.values)))
+
+    def test_faces(self):
+        faces = results.Faces(b'[]')
+        self.assertEqual(0, len(faces))
+        faces = results.Faces.from_dict([{
+            'faceRectangle': {'left': 0, 'top': 0, 'width': 10, 'height': 10},
+            'scores': {'anger': 1.0},
+        }])
+        self.assertEqual(['anger'], [f.strongest for f in faces])
+        self.assertEqual(10, faces[0].width)
+
+    def test_from_dict_is_not_encoded_again(self):
+        value = [{'faceRectangle': {'left': 0, 'top': 0, 'width': 10, 'height': 10}, 'scores': {'anger': 1.0}}]
+        with unittest.mock.patch.object(results.json, 'dumps', side_effect=AssertionError):
+            faces = results.Faces.from_dict(value)
+            self.assertEqual(['anger'], [f.strongest for f in faces])
+            self.assertEqual(value, faces.to_dict())
+            self.assertIsNot(value, faces.to_dict())
+        self.assertEqual(value, json.loads(faces.content.decode('utf-8')))
+
+    def test_to_dict_returns_a_new_copy(self):
+        r = results.LuisResult.from_dict({'query': 'hi', 'intents': [], 'entities': []})
+        d = r.to_dict()
+        d['query'] = 'changed'
+        self.assertEqual('hi', r.to_dict()['query'])
+        self.assertIsNone(r.intent)
+
+    def test_json_decoder(self):
+        calls = []
+
+        def loads(data):
+            calls.append(data)
+            return json.loads(data)
+
+        previous = results.set_json_decoder(loads)
+        try:
+            self.assertEqual({'a': 1}, results.loads(b'{"a": 1}'))
+        finally:
+            results.set_json_decoder(previous)
+        self.assertEqual([b'{"a": 1}'], calls)
+
+class TypedResponseTests(unittest.TestCase):
+    def test_luis(self):
+        with Emulator() as emu:
+            emu.intents = {'weather': 'GetWeather'}
+            lc = LuisClient(emu.luis_url())
+            r = lc.query_raw('what is the weather tomorrow', typed=True)
+            self.assertIsInstance(r, results.LuisResult)
+            self.assertEqual('what is the weather tomorrow', r.query)
+            self.assertEqual('GetWeather', r.intent)
+            self.assertEqual(0.95, r.intents[0].score)
+            self.assertEqual([('weather', 'Word'), ('tomorrow', 'Word')], [(e.text, e.type) for e in r.entities])
+            self.assertEqual(lc.query_raw('what is the weather tomorrow'), r.to_dict())
+
+    def test_recognition(self):
+        with Emulator() as emu:
+            emu.transcript = 'turn on the lights'
+            sc = SpeechClient('key', **emu.speech_args())
+            r = sc.recognize_raw(_make_pcm_wav(0.5), typed=True)
+            self.assertIsInstance(r, results.Recognition)
+            self.assertEqual('success', r.status)
+            self.assertEqual('turn on the lights', r.best.text)
+            self.assertEqual('high', r.best.level)
+            self.assertEqual(3, len(r))
+            self.assertEqual(['high', 'low', 'low'], [h.level for h in r])
+            self.assertAlmostEqual(0.9, r[0].confidence)
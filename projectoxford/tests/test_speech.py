@@ -0,0 +1,95 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+import requests
+
+from projectoxford.emulator import Emulator, _make_pcm_wav
+from projectoxford.speech import RecognitionCache, SpeechClient
+
+def _with_list_chunk(wav):
+    '''Returns `wav` with a metadata chunk inserted before its data.'''
+    assert wav[12:16] == b'fmt '
+    fmt_end = 20 + struct.unpack('<I', wav[16:20])[0]
+    chunk = b'LIST' + struct.pack('<I', 8) + b'INFOtest'
+    body = wav[12:fmt_end] + chunk + wav[fmt_end:]
+    return b'RIFF' + struct.pack('<I', len(body) + 4) + b'WAVE' + body
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._data.readinto(b)
+
+class SpeechTests(unittest.TestCase):
+    def test_token_is_reused(self):
+        with Emulator() as emu:
+            sc = SpeechClient('key', **emu.speech_args())
+            sc.say_to_wav('one')
+            sc.recognize_raw(_make_pcm_wav(0.2))
+            self.assertEqual(1, emu.counts['token'])
+
+    def test_say_to_wav_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            with Emulator() as emu:
+                path = os.path.join(directory, 'out.wav')
+                SpeechClient('key', **emu.speech_args()).say_to_wav('hello', filename=path)
+                with open(path, 'rb') as f:
+                    self.assertEqual(b'RIFF', f.read(4))
+        finally:
+            shutil.rmtree(directory)
+
+class RecognitionCacheTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.emulator = Emulator()
+        self.emulator.start()
+
+    def tearDown(self):
+        self.emulator.stop()
+        shutil.rmtree(self.directory)
+
+    def test_same_audio_is_recognized_once_per_locale(self):
+        sc = SpeechClient('key', recognition_cache=True, **self.emulator.speech_args())
+        wav = _make_pcm_wav(0.5)
+        first = sc.recognize_raw(wav)
+        self.assertEqual(first, sc.recognize_raw(_with_list_chunk(wav)))
+        self.assertEqual(first, sc.recognize_raw(io.BytesIO(wav)))
+        self.assertEqual(first, sc.recognize_raw(_Unseekable(wav)))
+        self.assertEqual(1, self.emulator.counts['recognize'])
+        sc.recognize_raw(wav, 'en-GB')
+        self.assertEqual(2, self.emulator.counts['recognize'])
+        sc.recognize_raw(_make_pcm_wav(0.6))
+        self.assertEqual(3, self.emulator.counts['recognize'])
+
+    def test_failures_are_not_cached(self):
+        sc = SpeechClient('key', recognition_cache=True, timeout=1, **self.emulator.speech_args())
+        self.emulator.behaviors['recognize'].failure_rate = 1.0
+        self.assertRaises(requests.RequestException, sc.recognize_raw, _make_pcm_wav(0.5))
+        self.emulator.behaviors['recognize'].failure_rate = 0.0
+        failed = self.emulator.counts['recognize']
+        sc.recognize_raw(_make_pcm_wav(0.5))
+        sc.recognize_raw(_make_pcm_wav(0.5))
+        self.assertEqual(failed + 1, self.emulator.counts['recognize'])
+
+    def test_responses_persist_in_directory(self):
+        for _ in range(2):
+            cache = RecognitionCache(directory=self.directory)
+            sc = SpeechClient('key', recognition_cache=cache, **self.emulator.speech_args())
+            self.assertEqual('hello world', sc.recognize(_make_pcm_wav(0.5)))
+        self.assertEqual(1, self.emulator.counts['recognize'])
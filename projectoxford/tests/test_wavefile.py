@@ -0,0 +1,162 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+
+import io
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+import wave
+
+from projectoxford.wavefile import (UNKNOWN_SIZE, WAVE_FORMAT_IEEE_FLOAT, WavError, WavReader,
+                                    WavWriter, normalize, open_wav)
+
+FRAMES = bytes(range(200))
+
+def _make_wav(frames=FRAMES, channels=1, sample_rate=16000, sample_width=2):
+    f = io.BytesIO()
+    w = wave.open(f, 'wb')
+    w.setnchannels(channels)
+    w.setsampwidth(sample_width)
+    w.setframerate(sample_rate)
+    w.writeframes(frames)
+    w.close()
+    return f.getvalue()
+
+def _streamed(wav):
+    '''Returns `wav` with the placeholder sizes written when streaming.'''
+    return wav[:4] + struct.pack('<I', UNKNOWN_SIZE) + wav[8:40] + struct.pack('<I', UNKNOWN_SIZE) + wav[44:]
+
+class _Unseekable(io.RawIOBase):
+    def __init__(self, data):
+        self._data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        return self._data.readinto(b)
+
+class WavReaderTests(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_buffer(self):
+        wav = _make_wav()
+        with open_wav(wav) as r:
+            self.assertEqual((1, 2, 16000, 100), (r.getnchannels(), r.getsampwidth(), r.getframerate(), r.getnframes()))
+            frames = r.readframes(10)
+            self.assertIsInstance(frames, memoryview)
+            self.assertEqual(FRAMES[:20], frames)
+            self.assertEqual(FRAMES[20:], b''.join(r.iterframes(7)))
+            r.setpos(50)
+            self.assertEqual(FRAMES[100:], r.readframes(1000))
+            self.assertRaises(WavError, r.setpos, 101)
+            r.rewind()
+            self.assertIs(wav, r.body())
+
+    def test_path_is_memory_mapped(self):
+        path = os.path.join(self.directory, 'test.wav')
+        with open(path, 'wb') as f:
+            f.write(_make_wav())
+        with open_wav(path) as r:
+            self.assertEqual(FRAMES, r.data)
+            frames = r.readframes(100)
+        self.assertEqual(FRAMES, frames)
+
+    def test_extra_chunks_and_truncation(self):
+        wav = _make_wav()
+        chunk = b'LIST' + struct.pack('<I', 5) + b'INFOx\0'
+        body = wav[12:36] + chunk + wav[36:-11]
+        with open_wav(b'RIFF' + struct.pack('<I', len(body) + 4) + b'WAVE' + body) as r:
+            self.assertEqual(94, r.nframes)
+            self.assertEqual(FRAMES[:188], r.data)
+
+    def test_seekable_stream(self):
+        with open_wav(io.BytesIO(_make_wav())) as r:
+            self.assertIsNone(r.data)
+            self.assertEqual(100, r.nframes)
+            self.assertEqual(FRAMES[:20], r.readframes(10))
+            self.assertEqual(FRAMES[20:], b''.join(r.iterframes(7)))
+            r.setpos(90)
+            self.assertEqual(FRAMES[180:], r.readframes(1000))
+
+    def test_unseekable_stream_of_unknown_length(self):
+        with open_wav(_Unseekable(_streamed(_make_wav()) + b'\x01')) as r:
+            self.assertFalse(r.seekable())
+            self.assertIsNone(r.nframes)
+            self.assertEqual(0, r.getnframes())
+            self.assertRaises(WavError, r.rewind)
+            body = b''.join(r.body(block_size=16))
+            self.assertEqual(FRAMES, body[44:])
+            self.assertEqual(UNKNOWN_SIZE, struct.unpack_from('<I', body, 40)[0])
+            self.assertEqual(100, r.tell())
+
+    def test_wave_read(self):
+        w = wave.open(io.BytesIO(_make_wav(channels=2)))
+        with open_wav(w) as r:
+            self.assertEqual(2, r.channels)
+            self.assertEqual(50, r.nframes)
+            self.assertEqual(FRAMES, r.data)
+
+    def test_invalid_files(self):
+        self.assertRaises(WavError, open_wav, b'RIFF')
+        self.assertRaises(WavError, open_wav, b'RIFF\0\0\0\0AVI LIST\0\0\0\0')
+        self.assertRaises(WavError, open_wav, _make_wav()[:36])
+        self.assertRaises(WavError, open_wav, _Unseekable(b'RIFF\0\0\0\0WAVE'))
+        path = os.path.join(self.directory, 'empty.wav')
+        open(path, 'wb').close()
+        self.assertRaises(WavError, open_wav, path)
+
+    def test_body(self):
+        with open_wav(bytearray(_make_wav())) as r:
+            r.setpos(10)
+            body = r.body()
+            self.assertEqual(224, len(body))
+            data = b''.join(iter(lambda: body.read(100), b''))
+            body.seek(0)
+            self.assertEqual(data, b''.join(iter(body.read, b'')))
+        with open_wav(data) as r:
+            self.assertEqual(90, r.nframes)
+            self.assertEqual(FRAMES[20:], r.data)
+
+class WavWriterTests(unittest.TestCase):
+    def test_sizes_are_corrected(self):
+        f = io.BytesIO()
+        with WavWriter(f, channels=2, sample_rate=8000) as w:
+            w.writeframes(FRAMES[:100])
+            w.writeframes(memoryview(FRAMES)[100:])
+            self.assertEqual(50, w.getnframes())
+        r = wave.open(io.BytesIO(f.getvalue()))
+        self.assertEqual((2, 2, 8000, 50), (r.getnchannels(), r.getsampwidth(), r.getframerate(), r.getnframes()))
+        self.assertEqual(FRAMES, r.readframes(50))
+
+    def test_unseekable_file_has_placeholder_sizes(self):
+        f = io.BytesIO()
+        f.seekable = lambda: False
+        with WavWriter(f) as w:
+            w.writeframes(FRAMES[:4])
+        data = f.getvalue()
+        self.assertEqual(UNKNOWN_SIZE, struct.unpack_from('<I', data, 40)[0])
+        fixed = normalize(data)
+        self.assertEqual(FRAMES[:4], wave.open(io.BytesIO(fixed)).readframes(10))
+        self.assertIs(fixed, normalize(fixed))
+
+    def test_float(self):
+        f = io.BytesIO()
+        with WavWriter(f, sample_width=4, nframes=2, format_tag=WAVE_FORMAT_IEEE_FLOAT) as w:
+            w.writeframes(struct.pack('<2f', 0.5, -0.5))
+        with WavReader(f.getvalue()) as r:
+            self.assertEqual(WAVE_FORMAT_IEEE_FLOAT, r.format_tag)
+            self.assertEqual((0.5, -0.5), struct.unpack('<2f', r.readframes(2)))
+
+    def test_unsupported_format(self):
+        self.assertRaises(WavError, WavWriter, io.BytesIO(), format_tag=2)
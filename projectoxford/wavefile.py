@@ -0,0 +1,512 @@
+#-------------------------------------------------------------------------
+# Copyright (c) Microsoft Corporation
+# All rights reserved.
+#
+# Distributed under the terms of the MIT License
+#-------------------------------------------------------------------------
+'''Project Oxford Wave Files
+
+This module reads and writes RIFF wave files without copying their
+sample data.
+
+Files held in memory or on disk are parsed in place, and their frames
+are returned as views of the original buffer (or of a memory map of the
+file). Files read from pipes and sockets are parsed from the start of
+the stream and their frames read as they are needed, including streams
+whose length was not known when their header was written.
+
+Both ``WAVE_FORMAT_PCM`` and ``WAVE_FORMAT_EXTENSIBLE`` files are
+supported, as are 32-bit and 64-bit IEEE float samples.
+'''
+
+import mmap
+import socket
+import struct
+import wave
+
+__all__ = ['WavError', 'WavReader', 'WavWriter', 'open_wav', 'normalize',
+           'WAVE_FORMAT_PCM', 'WAVE_FORMAT_IEEE_FLOAT', 'WAVE_FORMAT_EXTENSIBLE', 'UNKNOWN_SIZE']
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_IEEE_FLOAT = 0x0003
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# The size written in the headers of streams whose length is not known
+UNKNOWN_SIZE = 0xFFFFFFFF
+
+_RIFF = struct.Struct('<4sI4s')
+_CHUNK = struct.Struct('<4sI')
+_FMT = struct.Struct('<HHIIHH')
+_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+_EXTENSIBLE = struct.Struct('<HHI16s')
+_SUPPORTED_FORMATS = (WAVE_FORMAT_PCM, WAVE_FORMAT_IEEE_FLOAT)
+
+class WavError(ValueError):
+    '''Raised when data is not a supported wave file.'''
+    pass
+
+def _parse_fmt(body):
+    if len(body) < _FMT.size:
+        raise WavError('fmt chunk is too short')
+    format_tag, channels, sample_rate, _, block_align, bits = _FMT.unpack_from(body)
+    if format_tag == WAVE_FORMAT_EXTENSIBLE:
+        if len(body) < _FMT.size + _EXTENSIBLE.size:
+            raise WavError('fmt chunk is too short for WAVE_FORMAT_EXTENSIBLE')
+        # The format is the first two bytes of the sub-format GUID
+        subformat = _EXTENSIBLE.unpack_from(body, _FMT.size)[3]
+        format_tag = struct.unpack_from('<H', subformat)[0]
+    if format_tag not in _SUPPORTED_FORMATS:
+        raise WavError('unsupported format 0x{:04X}'.format(format_tag))
+    if not channels or not block_align or block_align % channels:
+        raise WavError('invalid fmt chunk')
+    return format_tag, channels, sample_rate, block_align // channels, block_align, bits
+
+def _make_header(format_tag, channels, sample_rate, sample_width, data_size=None):
+    '''Returns the 44 byte header of a wave file containing
+    `data_size` bytes of samples, or an unknown amount if ``None``.
+    '''
+    block_align = channels * sample_width
+    if data_size is None:
+        riff_size = data_size = UNKNOWN_SIZE
+    else:
+        riff_size = min(UNKNOWN_SIZE, 36 + data_size + (data_size & 1))
+    return _HEADER.pack(
+        b'RIFF', riff_size, b'WAVE',
+        b'fmt ', _FMT.size, format_tag, channels, sample_rate,
+        sample_rate * block_align, block_align, sample_width * 8,
+        b'data', data_size,
+    )
+
+class _Body(object):
+    '''A readable request body of known length that is read from a
+    sequence of buffers without copying them.
+    '''
+    def __init__(self, parts):
+        self._parts = [memoryview(p).cast('B') for p in parts]
+        self._length = sum(len(p) for p in self._parts)
+        self.seek(0)
+
+    def __len__(self):
+        return self._length
+
+    def tell(self):
+        return self._offset
+
+    def seek(self, offset, whence=0):
+        if offset != 0 or whence != 0:
+            raise OSError('can only seek to the start of the body')
+        self._index = self._pos = self._offset = 0
+        return 0
+
+    def read(self, size=-1):
+        while self._index < len(self._parts):
+            part = self._parts[self._index]
+            if self._pos < len(part):
+                end = len(part) if size is None or size < 0 else min(len(part), self._pos + size)
+                chunk = part[self._pos:end]
+                self._pos = end
+                self._offset += len(chunk)
+                return chunk
+            self._index += 1
+            self._pos = 0
+        return b''
+
+class _StreamBody(object):
+    '''A request body of unknown length that is read from a stream
+    as it is sent.
+    '''
+    def __init__(self, header, reader, block_size):
+        self._header = header
+        self._reader = reader
+        self._block_size = block_size
+
+    def __iter__(self):
+        yield self._header
+        frames = max(1, self._block_size // self._reader.block_align)
+        for block in self._reader.iterframes(frames):
+            yield block
+
+class WavReader(object):
+    '''A wave file that is being read.
+
+    Use `open_wav` rather than creating readers directly. Readers
+    provide the same methods as `wave.Wave_read`, except that
+    `readframes` returns a `memoryview` of the file's buffer when the
+    file is not being read from a stream.
+
+    format_tag:
+        `WAVE_FORMAT_PCM` or `WAVE_FORMAT_IEEE_FLOAT`. Files using
+        `WAVE_FORMAT_EXTENSIBLE` report their sub-format.
+    channels, sample_rate, sample_width, block_align, bits_per_sample:
+        The format of the samples. `sample_width` and `block_align`
+        are the number of bytes in each sample and each frame.
+    nframes:
+        The number of frames, or ``None`` if the file is being read
+        from a stream and its length is not known.
+    data:
+        A `memoryview` of every frame, or ``None`` if the file is being
+        read from a stream.
+    '''
+
+    def __init__(self, buffer=None, stream=None, owned=()):
+        self.data = None
+        self.nframes = None
+        self._stream = stream
+        self._owned = list(owned)
+        self._pos = 0
+        self._remaining = None
+        self._data_offset = None
+        self._source = None
+        self._complete = False
+        if buffer is not None:
+            self._source = buffer
+            self._parse_buffer(memoryview(buffer).cast('B'))
+        else:
+            self._parse_stream(stream)
+
+    def _set_format(self, fmt):
+        (self.format_tag, self.channels, self.sample_rate,
+         self.sample_width, self.block_align, self.bits_per_sample) = fmt
+
+    def _parse_buffer(self, buf):
+        if len(buf) < _RIFF.size:
+            raise WavError('file is too short')
+        riff, riff_size, wave_id = _RIFF.unpack_from(buf)
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise WavError('file does not start with a RIFF WAVE header')
+        offset = _RIFF.size
+        fmt = None
+        while offset + _CHUNK.size <= len(buf):
+            chunk_id, size = _CHUNK.unpack_from(buf, offset)
+            offset += _CHUNK.size
+            if chunk_id == b'fmt ':
+                fmt = _parse_fmt(buf[offset:offset + size])
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise WavError('data chunk precedes fmt chunk')
+                self._set_format(fmt)
+                # Streamed files have placeholder sizes, and truncated
+                # files are read as far as they go
+                available = len(buf) - offset
+                declared = size
+                if size in (0, UNKNOWN_SIZE) or size > available:
+                    size = available
+                size -= size % self.block_align
+                self._complete = declared == size and riff_size not in (0, UNKNOWN_SIZE)
+                self.data = buf[offset:offset + size]
+                self.nframes = size // self.block_align
+                return
+            offset += size + (size & 1)
+        raise WavError('file has no data chunk')
+
+    def _read(self, size):
+        data = self._stream.read(size)
+        if len(data) < size:
+            raise WavError('file ended unexpectedly')
+        return data
+
+    def _parse_stream(self, stream):
+        riff, _, wave_id = _RIFF.unpack(self._read(_RIFF.size))
+        if riff != b'RIFF' or wave_id != b'WAVE':
+            raise WavError('file does not start with a RIFF WAVE header')
+        fmt = None
+        while True:
+            chunk_id, size = _CHUNK.unpack(self._read(_CHUNK.size))
+            if chunk_id == b'data':
+                break
+            if chunk_id == b'fmt ':
+                fmt = _parse_fmt(self._read(size))
+                if size & 1:
+                    self._read(1)
+            else:
+                self._read(size + (size & 1))
+        if fmt is None:
+            raise WavError('data chunk precedes fmt chunk')
+        self._set_format(fmt)
+        if size not in (0, UNKNOWN_SIZE):
+            self._remaining = size - size % self.block_align
+            self.nframes = self._remaining // self.block_align
+        if self.seekable():
+            self._data_offset = stream.tell()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __repr__(self):
+        return '<WavReader {} channels, {} Hz, {} bits, {} frames>'.format(
+            self.channels, self.sample_rate, self.bits_per_sample,
+            'unknown' if self.nframes is None else self.nframes
+        )
+
+    def close(self):
+        '''Closes the file and any memory map or stream opened for it.'''
+        if self.data is not None:
+            self.data.release()
+            self.data = None
+        for obj in reversed(self._owned):
+            try:
+                obj.close()
+            except BufferError:
+                # Frames returned by readframes are still referenced.
+                # The memory map is closed when they are collected.
+                pass
+        self._owned = []
+
+    def seekable(self):
+        '''Returns ``True`` if `rewind` and `setpos` are supported.'''
+        if self._stream is None:
+            return True
+        try:
+            return self._stream.seekable()
+        except (AttributeError, ValueError):
+            return False
+
+    def getnchannels(self):
+        return self.channels
+
+    def getsampwidth(self):
+        return self.sample_width
+
+    def getframerate(self):
+        return self.sample_rate
+
+    def getnframes(self):
+        '''Returns the number of frames, or 0 if it is not known.'''
+        return self.nframes or 0
+
+    def getcomptype(self):
+        return 'NONE'
+
+    def getcompname(self):
+        return 'not compressed'
+
+    def tell(self):
+        return self._pos
+
+    def rewind(self):
+        self.setpos(0)
+
+    def setpos(self, pos):
+        if self._stream is not None:
+            if self._data_offset is None:
+                raise WavError('cannot seek in a stream')
+            self._stream.seek(self._data_offset + pos * self.block_align)
+            if self.nframes is not None:
+                self._remaining = (self.nframes - pos) * self.block_align
+        elif not 0 <= pos <= self.nframes:
+            raise WavError('position not in range')
+        self._pos = pos
+
+    def readframes(self, n):
+        '''Returns up to `n` frames from the current position, as a
+        `memoryview` of the file's buffer or as `bytes` read from a
+        stream. An empty result indicates the end of the file.
+        '''
+        if self._stream is None:
+            start = self._pos * self.block_align
+            self._pos = min(self.nframes, self._pos + max(0, n))
+            return self.data[start:self._pos * self.block_align]
+
+        size = max(0, n) * self.block_align
+        if self._remaining is not None:
+            size = min(size, self._remaining)
+        data = self._stream.read(size) if size else b''
+        # A stream of unknown length may end with a partial frame
+        data = data[:len(data) - len(data) % self.block_align]
+        if self._remaining is not None:
+            self._remaining -= len(data)
+        self._pos += len(data) // self.block_align
+        return data
+
+    def iterframes(self, frames_per_chunk=8192):
+        '''Yields the frames from the current position onwards, up to
+        `frames_per_chunk` at a time.
+        '''
+        while True:
+            data = self.readframes(frames_per_chunk)
+            if not data:
+                return
+            yield data
+
+    def header(self):
+        '''Returns a 44 byte header describing the frames from the
+        current position onwards, with placeholder sizes if the number
+        of frames is not known.
+        '''
+        size = None if self.nframes is None else (self.nframes - self._pos) * self.block_align
+        return _make_header(self.format_tag, self.channels, self.sample_rate, self.sample_width, size)
+
+    def body(self, block_size=65536):
+        '''Returns the file from the current position as an object that
+        may be passed as the `data` of a request.
+
+        The original `bytes` object is returned if it is unchanged.
+        Otherwise, a file-like object that reads the frames without
+        copying them is returned, or an iterable that reads them from
+        the stream as the request is sent.
+        '''
+        if self._stream is None:
+            if self._pos == 0 and self._complete and isinstance(self._source, bytes):
+                return self._source
+            return _Body([self.header(), self.data[self._pos * self.block_align:]])
+        if self.seekable() and self.nframes is not None:
+            start = self._pos
+            frames = self.readframes(self.nframes - self._pos)
+            self.setpos(start)
+            return _Body([self.header(), frames])
+        return _StreamBody(self.header(), self, block_size)
+
+def _from_wave(w):
+    w.rewind()
+    frames = w.readframes(w.getnframes())
+    w.rewind()
+    header = _make_header(WAVE_FORMAT_PCM, w.getnchannels(), w.getframerate(), w.getsampwidth(), len(frames))
+    return WavReader(header + frames)
+
+def open_wav(wav):
+    '''Opens a wave file for reading and returns a `WavReader`.
+
+    wav:
+        A `bytes`, `bytearray`, `memoryview` or `mmap.mmap` containing
+        a wave file, the path to a wave file, a binary file object or
+        socket to read a wave file from, or an open `wave.Wave_read`
+        object.
+
+    Files are memory mapped rather than read. File objects and sockets
+    are read as frames are requested, and are not closed when the
+    reader is closed.
+    '''
+    if isinstance(wav, wave.Wave_read):
+        return _from_wave(wav)
+    if isinstance(wav, (bytearray, memoryview, mmap.mmap)):
+        return WavReader(wav)
+    if isinstance(wav, bytes) and wav[:4] == b'RIFF':
+        return WavReader(wav)
+    if isinstance(wav, socket.socket):
+        stream = wav.makefile('rb')
+        return WavReader(stream=stream, owned=[stream])
+    if hasattr(wav, 'read'):
+        return WavReader(stream=wav)
+
+    with open(wav, 'rb') as f:
+        try:
+            m = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            raise WavError('file is empty')
+    try:
+        return WavReader(m, owned=[m])
+    except BaseException:
+        m.close()
+        raise
+
+def normalize(data):
+    '''Returns the wave file in `data` with a header describing its
+    actual length, such as after it was streamed with placeholder
+    sizes. `data` is returned unchanged if its header is already
+    correct.
+    '''
+    with WavReader(data) as r:
+        if r._complete:
+            return data
+        return r.header() + r.data.tobytes()
+
+class WavWriter(object):
+    '''Writes a wave file to a path or to a file object, such as a
+    pipe or socket, as frames are provided.
+
+    WavWriter(file, channels=1, sample_rate=16000, sample_width=2,
+              nframes=None, format_tag=WAVE_FORMAT_PCM)
+
+    file:
+        A path or a binary file object. Paths are opened and closed by
+        the writer; file objects are left open.
+    channels, sample_rate, sample_width:
+        The format of the frames. `sample_width` is the number of
+        bytes in each sample.
+    nframes:
+        The number of frames that will be written, if known. Otherwise
+        the header is written with placeholder sizes, which are
+        corrected when the writer is closed if `file` is seekable.
+    format_tag:
+        `WAVE_FORMAT_PCM` or `WAVE_FORMAT_IEEE_FLOAT`.
+
+    Writers provide the `getnchannels`, `getsampwidth`, `getframerate`
+    and `writeframes` methods of `wave.Wave_write`.
+    '''
+
+    def __init__(self, file, channels=1, sample_rate=16000, sample_width=2,
+                 nframes=None, format_tag=WAVE_FORMAT_PCM):
+        if format_tag not in _SUPPORTED_FORMATS:
+            raise WavError('unsupported format 0x{:04X}'.format(format_tag))
+        self._owned = not hasattr(file, 'write')
+        self._file = open(file, 'wb') if self._owned else file
+        self.channels = channels
+        self.sample_rate = sample_rate
+        self.sample_width = sample_width
+        self.format_tag = format_tag
+        self.nframes = nframes
+        self._written = 0
+        self._start = self._tell()
+        size = None if nframes is None else nframes * channels * sample_width
+        self._header_size = size
+        self._file.write(_make_header(format_tag, channels, sample_rate, sample_width, size))
+
+    def _tell(self):
+        try:
+            return self._file.tell() if self._file.seekable() else None
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def getnchannels(self):
+        return self.channels
+
+    def getsampwidth(self):
+        return self.sample_width
+
+    def getframerate(self):
+        return self.sample_rate
+
+    def getnframes(self):
+        '''Returns the number of frames written so far.'''
+        return self._written // (self.channels * self.sample_width)
+
+    def writeframes(self, data):
+        '''Writes `data`, which may be any bytes-like object, without
+        copying it.
+        '''
+        view = memoryview(data)
+        self._file.write(view)
+        self._written += view.nbytes
+
+    writeframesraw = writeframes
+
+    def close(self):
+        '''Completes the file and corrects the sizes in its header if
+        possible.
+        '''
+        if self._file is None:
+            return
+        try:
+            if self._written & 1:
+                self._file.write(b'\0')
+            if self._start is not None and self._header_size != self._written:
+                end = self._file.tell()
+                header = _make_header(self.format_tag, self.channels, self.sample_rate,
+                                      self.sample_width, self._written)
+                self._file.seek(self._start)
+                self._file.write(header)
+                self._file.seek(end)
+            self._file.flush()
+        finally:
+            if self._owned:
+                self._file.close()
+            self._file = None